@@ -0,0 +1,443 @@
+#!/usr/local/bin/python3
+
+"""Time each phase of interface2dita over an interface file, write the results
+as JSON, and compare them against a stored baseline.
+
+    python3 benchmarks/bench_interface2dita.py --output results.json
+    python3 benchmarks/bench_interface2dita.py --save-baseline
+    python3 benchmarks/bench_interface2dita.py --threshold 0.2
+    python3 benchmarks/bench_interface2dita.py --memory-scaling
+
+The exit status is 1 if any benchmark is slower than the baseline by more than
+the threshold. With --memory-scaling, --all --stream builds of synthetic
+interfaces of several sizes are run as well, and the exit status is also 1 if
+peak memory grows with the input by more than --memory-growth allows.
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from lxml import etree
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_PATH))
+
+import interface2dita as i2d  # noqa: E402
+import synthesize_interface  # noqa: E402
+
+
+DEFAULT_INPUT = REPO_PATH / "context-en.xml"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# How many times each microbenchmark calls its builder per repetition
+MICRO_LOOPS = 200
+
+SCRIPT_PATH = REPO_PATH / "interface2dita.py"
+
+
+# --- Timing ---
+
+def time_repeated(function, repeat, setup=None):
+    # setup runs outside the timed region, and its result is passed in
+
+    timings = []
+
+    for i in range(repeat):
+        setup_result = setup() if setup else None
+        start = time.perf_counter()
+        if setup:
+            function(setup_result)
+        else:
+            function()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+    }
+
+
+# --- Model Setup ---
+
+def load_model(input_file):
+    # Build the command model once, and make it visible to the builders the way
+    # running interface2dita as a script would
+
+    full_tree = etree.parse(str(input_file))
+
+    commands_dict, variants_dict, classes_list, environments_list, relations_list = i2d.process_interface_tree(
+        full_tree)
+
+    i2d.add_supporting_env_commands(relations_list, commands_dict)
+
+    i2d.commands_dict = commands_dict
+    i2d.variants_dict = variants_dict
+    i2d.inheritance_index = i2d.build_inheritance_index(
+        commands_dict, variants_dict)
+    i2d.variant_topic_names = i2d.get_variant_topic_names(variants_dict)
+    i2d.today = datetime.date.today()
+
+    return {
+        'tree': full_tree,
+        'commands': commands_dict,
+        'classes': classes_list,
+        'environments': environments_list,
+        'relations': relations_list,
+    }
+
+
+def find_largest_argument(commands_dict, argument_type):
+    # The argument of the given type with the most children, across all commands
+
+    largest = None
+
+    for command_data in commands_dict.values():
+        for argument in command_data.arguments:
+            if argument.type != argument_type:
+                continue
+            if largest is None or argument.count > largest[1].count:
+                largest = (command_data.name, argument)
+
+    return largest
+
+
+# --- Phase Benchmarks ---
+
+def bench_phases(input_file, model, repeat, sink_type):
+    results = {}
+    commands_dict = model['commands']
+
+    print("Benchmarking parse.")
+    results['parse'] = time_repeated(
+        lambda: etree.parse(str(input_file)), repeat)
+
+    print("Benchmarking process_interface_tree.")
+    results['process_interface_tree'] = time_repeated(
+        lambda: i2d.process_interface_tree(model['tree']), repeat)
+
+    # process_interface_tree fills the shared donor set, so put the command
+    # model back the way load_model left it
+    i2d.commands_dict = commands_dict
+
+    # add_supporting_env_commands appends to the relations it is given, so each
+    # repetition gets fresh ones
+    print("Benchmarking add_supporting_env_commands.")
+    unsupported_relations = i2d.process_interface_tree(model['tree'])[4]
+    i2d.commands_dict = commands_dict
+    results['add_supporting_env_commands'] = time_repeated(
+        lambda relations: i2d.add_supporting_env_commands(
+            relations, commands_dict),
+        repeat, setup=lambda: copy.deepcopy(unsupported_relations))
+
+    print("Benchmarking generate_dita_topic.")
+    results['generate_dita_topic'] = time_repeated(
+        lambda: [i2d.generate_dita_topic(command_data)
+                 for command_data in commands_dict.values()], repeat)
+
+    topics = [i2d.generate_dita_topic(command_data)
+              for command_data in commands_dict.values()]
+    topic_count = len(topics)
+
+    print("Benchmarking serialization.")
+    results['serialize_dita'] = time_repeated(
+        lambda: [i2d.serialize_dita(topic, i2d.REFERENCE_DOCTYPE)
+                 for topic in topics], repeat)
+
+    # With the memory sink the writing benchmarks measure building and
+    # serializing, not the disk
+    with tempfile.TemporaryDirectory() as temp_dir:
+        i2d.output_sink = i2d.new_output_sink(sink_type, Path(temp_dir))
+        focus_path = i2d.make_output_dirs(Path(temp_dir), "en")
+        command_names = list(commands_dict)
+
+        print("Benchmarking map writing.")
+        results['write_maps'] = time_repeated(
+            lambda: write_all_maps(model, command_names, focus_path), repeat)
+
+    print("Benchmarking import_manually_edited_topics.")
+    manual_topics_path = REPO_PATH / "manually_edited_topics"
+    temp_dirs = []
+
+    def fresh_build_path():
+        temp_dirs.append(tempfile.TemporaryDirectory())
+        i2d.output_sink = i2d.new_output_sink(sink_type, Path(temp_dirs[-1].name))
+        return Path(temp_dirs[-1].name)
+
+    results['import_manually_edited_topics'] = time_repeated(
+        lambda build_path: i2d.import_manually_edited_topics(
+            manual_topics_path, build_path),
+        repeat, setup=fresh_build_path)
+
+    for temp_dir in temp_dirs:
+        temp_dir.cleanup()
+
+    results['generate_dita_topic']['items'] = topic_count
+    results['serialize_dita']['items'] = topic_count
+
+    return results
+
+
+def write_all_maps(model, command_names, focus_path):
+    i2d.write_inheritance_ditamap(i2d.donor_set, focus_path)
+    i2d.write_related_ditamap(model['relations'], focus_path)
+    i2d.write_command_ditamap(command_names, focus_path,
+                              "full_commands.ditamap", "Full Commands")
+    i2d.write_classes_ditamap(model['classes'], focus_path)
+    i2d.write_environments_ditamap(model['environments'], focus_path)
+
+
+# --- Microbenchmarks ---
+
+def bench_builders(model, repeat):
+    results = {}
+    commands_dict = model['commands']
+
+    settings_command, settings_argument = find_largest_argument(
+        commands_dict, "SETTINGS")
+    options_command, options_argument = find_largest_argument(
+        commands_dict, "OPTIONS")
+
+    print(
+        f"Benchmarking add_topic_refbody_settings ({settings_command}).")
+    results['add_topic_refbody_settings'] = time_repeated(
+        lambda: [i2d.add_topic_refbody_settings(settings_argument)
+                 for i in range(MICRO_LOOPS)], repeat)
+    results['add_topic_refbody_settings']['subject'] = settings_command
+
+    print(f"Benchmarking add_topic_refbody_options ({options_command}).")
+    results['add_topic_refbody_options'] = time_repeated(
+        lambda: [i2d.add_topic_refbody_options(options_argument)
+                 for i in range(MICRO_LOOPS)], repeat)
+    results['add_topic_refbody_options']['subject'] = options_command
+
+    all_arguments = [argument for command_data in commands_dict.values()
+                     for argument in command_data.arguments]
+
+    print("Benchmarking add_topic_refbody_refsyn_simpletable_row.")
+    results['add_topic_refbody_refsyn_simpletable_row'] = time_repeated(
+        lambda: [i2d.add_topic_refbody_refsyn_simpletable_row(argument)
+                 for argument in all_arguments], repeat)
+    results['add_topic_refbody_refsyn_simpletable_row']['items'] = len(
+        all_arguments)
+
+    for result in results.values():
+        result.setdefault('items', MICRO_LOOPS)
+
+    return results
+
+
+# --- Memory Scaling ---
+
+# A streamed build still keeps a little for every stanza (the light model, the
+# build manifest, the write log and the maps), so its peak grows, only far more
+# slowly than the input: about 1.6x for 4x the stanzas, where a build holding
+# the whole model grows about 2.4x. The default --memory-growth sits between.
+
+# Runs the command and prints its peak resident set size. A child forked from
+# this process would start out with all of this process's memory, so the command
+# is run from a fresh interpreter.
+PEAK_MEMORY_RUNNER = """
+import resource, subprocess, sys
+subprocess.run(sys.argv[1:], check=True, stdout=subprocess.DEVNULL)
+print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+"""
+
+
+def run_for_peak_memory(command, cwd):
+    # Peak resident set size of the command, in MB
+
+    output = subprocess.run([sys.executable, "-c", PEAK_MEMORY_RUNNER, *command],
+                            cwd=cwd, check=True, capture_output=True, text=True).stdout
+    peak = int(output.split()[-1])
+
+    # Bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+def bench_memory_scaling(input_file, scales, seed):
+    # A streamed build of a synthetic interface at each scale, from scratch, so
+    # that every topic is generated
+
+    results = {}
+    stats = synthesize_interface.collect_interface_statistics(
+        etree.parse(str(input_file)))
+
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            synthetic_path = Path(temp_dir) / "context-synthetic.xml"
+            synthetic_tree = synthesize_interface.synthesize_interface(
+                stats, scale, seed)
+            synthetic_tree.write(str(synthetic_path), encoding='UTF-8')
+            stanza_count = len(synthetic_tree.getroot().findall("*/*"))
+            del synthetic_tree
+
+            (Path(temp_dir) / "manually_edited_topics").mkdir()
+
+            print(f"Measuring a streamed build at scale {scale}.")
+            start = time.perf_counter()
+            peak = run_for_peak_memory(
+                [sys.executable, str(SCRIPT_PATH), "--input", str(synthetic_path), "--all",
+                 "--stream", "--force", "--quiet", "--log-file", ""], temp_dir)
+
+            results[str(scale)] = {
+                'stanzas': stanza_count,
+                'peak_mb': peak,
+                'seconds': time.perf_counter() - start,
+            }
+
+    return results
+
+
+def check_memory_scaling(memory_results, growth):
+    # Returns whether peak memory at the largest scale stays within growth
+    # times that at the smallest
+
+    print(f"\n{'scale':<10}{'stanzas':>10}{'peak MB':>10}{'seconds':>10}")
+
+    for scale, result in memory_results.items():
+        print(
+            f"{scale:<10}{result['stanzas']:>10}{result['peak_mb']:>10.1f}{result['seconds']:>10.1f}")
+
+    smallest, largest = memory_results[min(memory_results, key=float)], \
+        memory_results[max(memory_results, key=float)]
+    ratio = largest['peak_mb'] / smallest['peak_mb']
+
+    print(f"Peak memory grew {ratio:.2f}x for {largest['stanzas'] / smallest['stanzas']:.1f}x the stanzas (allowed {growth:.2f}x).")
+
+    return ratio <= growth
+
+
+# --- Baseline Comparison ---
+
+def compare_to_baseline(results, baseline, threshold):
+    # Returns the names of the benchmarks that regressed
+
+    regressions = []
+
+    print(f"\n{'benchmark':<45}{'baseline':>12}{'current':>12}{'change':>10}")
+
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            print(f"{name:<45}{'-':>12}{result['median']:>12.4f}{'new':>10}")
+            continue
+
+        baseline_median = baseline['benchmarks'][name]['median']
+        change = result['median'] / baseline_median - 1
+
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+
+        print(
+            f"{name:<45}{baseline_median:>12.4f}{result['median']:>12.4f}{change:>+10.1%}{flag}")
+
+    return regressions
+
+
+# --- Main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the phases of interface2dita")
+    parser.add_argument("--input", type=str, default=str(DEFAULT_INPUT))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=str,
+                        help="write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed slowdown against the baseline median, as a fraction")
+    parser.add_argument("--sink", choices=["memory", "directory"], default="memory",
+                        help="where the writing benchmarks put their output")
+    parser.add_argument("--memory-scaling", action="store_true",
+                        help="also measure peak memory of streamed builds of synthetic interfaces")
+    parser.add_argument("--memory-scales", type=float, nargs="+", default=[1, 4],
+                        help="sizes of the synthetic interfaces, relative to the input")
+    parser.add_argument("--memory-growth", type=float, default=1.75,
+                        help="allowed ratio of peak memory at the largest scale to that at the smallest")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the synthetic interfaces")
+    args = vars(parser.parse_args())
+
+    input_file = Path(args['input'])
+
+    print("Loading model.")
+    model = load_model(input_file)
+
+    benchmarks = {}
+    benchmarks.update(bench_phases(input_file, model, args['repeat'], args['sink']))
+    benchmarks.update(bench_builders(model, args['repeat']))
+
+    memory_scaling = None
+    if args['memory_scaling']:
+        memory_scaling = bench_memory_scaling(
+            input_file, args['memory_scales'], args['seed'])
+
+    results = {
+        'meta': {
+            'input': input_file.name,
+            'input_hash': i2d.get_content_hash(input_file.read_bytes()),
+            'commands': len(model['commands']),
+            'sink': args['sink'],
+            'python': platform.python_version(),
+            'lxml': etree.__version__,
+            'machine': platform.machine(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        },
+        'benchmarks': benchmarks,
+    }
+
+    # Against its own smallest scale, so with or without a baseline
+    memory_flat = True
+    if memory_scaling is not None:
+        results['memory_scaling'] = memory_scaling
+        memory_flat = check_memory_scaling(memory_scaling, args['memory_growth'])
+        if not memory_flat:
+            print("Peak memory grows with the interface more than allowed.")
+
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=1)
+
+    baseline_path = Path(args['baseline'])
+
+    if args['save_baseline']:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f"Saved baseline to {baseline_path}.")
+        sys.exit(0 if memory_flat else 1)
+
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --save-baseline to store one.")
+        print(json.dumps(results, indent=1))
+        sys.exit(0 if memory_flat else 1)
+
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    if baseline['meta'].get('input_hash') != results['meta']['input_hash']:
+        print("Warning: the baseline was measured on a different interface file.")
+
+    regressions = compare_to_baseline(results, baseline, args['threshold'])
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args['threshold']:.0%}.")
+    if regressions or not memory_flat:
+        sys.exit(1)
+
+    print("\nNo regressions.")
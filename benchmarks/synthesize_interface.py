@@ -0,0 +1,490 @@
+#!/usr/local/bin/python3
+
+"""Write a synthetic ConTeXt interface file of any size with the shape of a real
+one, for load testing interface2dita.
+
+    python3 benchmarks/synthesize_interface.py --scale 10 --output context-x10.xml
+
+The generator measures the real interface (stanza type and variant mix,
+argument kinds as get_argument_type sees them, delimiters, option and settings
+key counts, inheritance fan-in and depth, class instance counts) and draws every stanza
+of the new file from those distributions. The same seed and scale always give
+the same file.
+"""
+
+import argparse
+import json
+import random
+import sys
+from collections import Counter
+from pathlib import Path
+
+from lxml import etree
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_PATH))
+
+import interface2dita as i2d  # noqa: E402
+
+
+DEFAULT_INPUT = REPO_PATH / "context-en.xml"
+
+CD = "{http://www.pragma-ade.com/commands}"
+
+# Roughly how many stanzas the real file keeps in each cd:interface group
+STANZAS_PER_GROUP = 50
+
+# Argument kinds with a tag of their own; the rest are cd:keywords with a single
+# typed constant (e.g. NAME is <cd:keywords><cd:constant type="cd:name"/>)
+KIND_TAGS = {
+    'OPTIONS': "keywords",
+    'SETTINGS': "assignments",
+    'COMMAND': "csname",
+    'SCOPE': "content",
+    'DELIMITER': "delimiter",
+    'DIMENSION': "dimension",
+    'TRIPLET': "triplet",
+    'POSITION': "position",
+    'STRING': "string",
+    'ANGLES': "angles",
+    'TEMPLATE': "template",
+    'APPLY': "apply",
+    'TEXT': "text",
+    'INDEX': "index",
+}
+
+
+# --- Measuring the Real Interface ---
+
+def get_value_type(value):
+    # simple, argument or inherit, as generate_options sees a child
+
+    if value.tag == CD + "inherit":
+        return "inherit"
+    elif "cd:" in value.get('type', ""):
+        return "argument"
+    else:
+        return "simple"
+
+
+def collect_interface_statistics(full_tree):
+    stats = {
+        'stanza_types': Counter(),
+        'variant_types': Counter(),
+        'levels': Counter(),
+        'files': Counter(),
+        'categories': Counter(),
+        'names': [],
+        'argument_counts': Counter(),
+        'argument_kinds': Counter(),
+        'delimiters': {},
+        'optional': Counter(),
+        'options_counts': Counter(),
+        'option_values': Counter(),
+        'option_defaults': 0,
+        'option_constants': 0,
+        'simple_values': Counter(),
+        'argument_values': Counter(),
+        'settings_counts': Counter(),
+        'settings_values': Counter(),
+        'settings_key_counts': Counter(),
+        'settings_key_values': Counter(),
+        'parameter_names': Counter(),
+        'delimiter_names': Counter(),
+        'donor_fan_in': Counter(),
+        'inheritance_depths': Counter(),
+        'class_instance_counts': Counter(),
+        'class_environments': 0,
+    }
+
+    inheritors_by_donor = Counter()
+    donors_by_inheritor = {}
+
+    for stanza in i2d.list_of_commands(full_tree, i2d.NSMAP):
+        stanza_name, stanza_type, variant_type, environment_prefix = i2d.get_stanza_type(
+            stanza)
+
+        stats['stanza_types'][stanza_type] += 1
+        if stanza_type == "variant" and variant_type:
+            stats['variant_types'][variant_type] += 1
+        stats['levels'][stanza.get('level', "")] += 1
+        stats['files'][stanza.get('file', "")] += 1
+        if stanza.get('category'):
+            stats['categories'][stanza.get('category')] += 1
+        if stanza.get('name'):
+            stats['names'].append(stanza.get('name'))
+
+        if stanza_type == "class":
+            stats['class_instance_counts'][len(
+                stanza.xpath('cd:instances/cd:constant', namespaces=i2d.NSMAP))] += 1
+            if stanza.get('type') == "environment":
+                stats['class_environments'] += 1
+
+        # Chains only run through commands, as donors are looked up by name
+        if stanza_type == "command" and stanza.get('variant') is None:
+            donors = stanza.xpath('cd:arguments//cd:inherit/@name', namespaces=i2d.NSMAP)
+            if donors:
+                donors_by_inheritor.setdefault(stanza.get('name'), set()).update(donors)
+
+        arguments = stanza.xpath('cd:arguments/*', namespaces=i2d.NSMAP)
+        stats['argument_counts'][len(arguments)] += 1
+
+        for argument in arguments:
+            kind = i2d.get_argument_type(argument)
+            if kind is None:
+                continue
+
+            stats['argument_kinds'][kind] += 1
+            stats['delimiters'].setdefault(kind, Counter())[
+                argument.get('delimiters', "")] += 1
+            if i2d.is_argument_optional(argument):
+                stats['optional'][kind] += 1
+
+            if kind == "DELIMITER":
+                stats['delimiter_names'][argument.get('name')] += 1
+
+            elif kind == "OPTIONS":
+                stats['options_counts'][len(argument)] += 1
+                for value in argument:
+                    value_type = get_value_type(value)
+                    stats['option_values'][value_type] += 1
+                    if value_type == "inherit":
+                        inheritors_by_donor[value.get('name')] += 1
+                        continue
+                    stats['option_constants'] += 1
+                    if value.get('default') == "yes":
+                        stats['option_defaults'] += 1
+                    if value_type == "argument":
+                        stats['argument_values'][value.get('type')] += 1
+                    else:
+                        stats['simple_values'][value.get('type')] += 1
+
+            elif kind == "SETTINGS":
+                stats['settings_counts'][len(argument)] += 1
+                for value in argument:
+                    if value.tag == CD + "inherit":
+                        stats['settings_values']["inherit"] += 1
+                        inheritors_by_donor[value.get('name')] += 1
+                        continue
+                    stats['settings_values']["keys"] += 1
+                    stats['parameter_names'][value.get('name')] += 1
+                    stats['settings_key_counts'][len(value)] += 1
+                    for key in value:
+                        value_type = get_value_type(key)
+                        stats['settings_key_values'][value_type] += 1
+                        if value_type == "inherit":
+                            inheritors_by_donor[key.get('name')] += 1
+
+    stats['donor_fan_in'] = Counter(inheritors_by_donor.values())
+    stats['inheritance_depths'] = Counter(
+        get_inheritance_depths(donors_by_inheritor).values())
+
+    return stats
+
+
+def get_inheritance_depths(donors_by_inheritor):
+    # How many donors deep the longest chain from each inheritor goes; a cycle
+    # ends the chain where it closes
+
+    depths = {}
+
+    def get_depth(name, chain):
+        if name in depths:
+            return depths[name]
+        if name in chain or name not in donors_by_inheritor:
+            return 0
+
+        depth = 1 + max(get_depth(donor, chain | {name})
+                        for donor in donors_by_inheritor[name])
+        depths[name] = depth
+        return depth
+
+    for name in donors_by_inheritor:
+        get_depth(name, frozenset())
+
+    return depths
+
+
+def summarize_statistics(stats):
+    # The parts worth printing; the value pools are long
+
+    summary = {}
+
+    for key, value in stats.items():
+        if key in ('names', 'files', 'simple_values', 'argument_values', 'parameter_names',
+                   'categories', 'delimiter_names'):
+            summary[key] = len(value)
+        elif isinstance(value, Counter):
+            summary[key] = dict(sorted(value.items(), key=str))
+        elif isinstance(value, dict):
+            summary[key] = {k: dict(v) for k, v in sorted(value.items())}
+        else:
+            summary[key] = value
+
+    return summary
+
+
+# --- Generating a Synthetic Interface ---
+
+def sample(rng, counter):
+    population = sorted(counter, key=str)
+    return rng.choices(population, weights=[counter[p] for p in population])[0]
+
+
+def add_constant(rng, stats, parent, value_type, default_rate):
+    constant = etree.SubElement(parent, CD + "constant")
+
+    if value_type == "argument":
+        constant.set('type', sample(rng, stats['argument_values']))
+    else:
+        constant.set('type', sample(rng, stats['simple_values']))
+
+    if rng.random() < default_rate:
+        constant.set('default', "yes")
+
+    return constant
+
+
+def add_argument(rng, stats, arguments_element, kind, inherit_slots):
+    tag = KIND_TAGS.get(kind, "keywords")
+    argument = etree.SubElement(arguments_element, CD + tag)
+
+    delimiters = sample(rng, stats['delimiters'][kind])
+    if delimiters:
+        argument.set('delimiters', delimiters)
+
+    if rng.random() < stats['optional'][kind] / stats['argument_kinds'][kind]:
+        argument.set('optional', "yes")
+
+    default_rate = stats['option_defaults'] / max(stats['option_constants'], 1)
+
+    if kind == "DELIMITER":
+        argument.set('name', sample(rng, stats['delimiter_names']))
+
+    elif kind == "OPTIONS":
+        for i in range(sample(rng, stats['options_counts'])):
+            value_type = sample(rng, stats['option_values'])
+            if value_type == "inherit":
+                inherit = etree.SubElement(argument, CD + "inherit")
+                inherit_slots['options'].append(inherit)
+            else:
+                add_constant(rng, stats, argument, value_type, default_rate)
+
+    elif kind == "SETTINGS":
+        parameter_names = set()
+        for i in range(sample(rng, stats['settings_counts'])):
+            if sample(rng, stats['settings_values']) == "inherit":
+                inherit = etree.SubElement(argument, CD + "inherit")
+                inherit_slots['settings'].append(inherit)
+                continue
+
+            parameter_name = sample(rng, stats['parameter_names'])
+            while parameter_name in parameter_names:
+                parameter_name += "x"
+            parameter_names.add(parameter_name)
+
+            parameter = etree.SubElement(
+                argument, CD + "parameter", name=parameter_name)
+            for j in range(sample(rng, stats['settings_key_counts'])):
+                value_type = sample(rng, stats['settings_key_values'])
+                if value_type == "inherit":
+                    inherit = etree.SubElement(parameter, CD + "inherit")
+                    inherit_slots['options'].append(inherit)
+                else:
+                    add_constant(rng, stats, parameter,
+                                 value_type, default_rate)
+
+    elif tag == "keywords":
+        # A single typed constant, e.g. NAME or NUMBER
+        etree.SubElement(argument, CD + "constant",
+                         type=f"cd:{kind.lower()}")
+
+    return argument
+
+
+def new_stanza(rng, stats, name):
+    stanza = etree.Element(CD + "command")
+    stanza.set('file', sample(rng, stats['files']))
+    stanza.set('level', sample(rng, stats['levels']))
+    stanza.set('name', name)
+    if rng.random() < sum(stats['categories'].values()) / sum(stats['stanza_types'].values()):
+        stanza.set('category', sample(rng, stats['categories']))
+    return stanza
+
+
+def add_arguments(rng, stats, stanza, stanza_number, inherit_slots, donor_candidates):
+    # Inherit slots and donor candidates are kept with the stanza's number
+
+    argument_count = sample(rng, stats['argument_counts'])
+    if argument_count == 0:
+        return
+
+    arguments_element = etree.SubElement(stanza, CD + "arguments")
+    first_kinds = set()
+    stanza_slots = {'options': [], 'settings': []}
+
+    for i in range(argument_count):
+        kind = sample(rng, stats['argument_kinds'])
+        argument = add_argument(
+            rng, stats, arguments_element, kind, stanza_slots)
+        # A short option list can read as a single typed keyword
+        first_kinds.add(i2d.get_argument_type(argument))
+
+    for kind, slots in stanza_slots.items():
+        inherit_slots[kind].extend((stanza_number, inherit) for inherit in slots)
+
+    # Only plain commands donate, as donors are looked up by command name
+    if stanza.get('variant') is None and stanza.get('type') is None:
+        if "OPTIONS" in first_kinds:
+            donor_candidates['options'].append((stanza_number, stanza.get('name')))
+        if "SETTINGS" in first_kinds:
+            donor_candidates['settings'].append((stanza_number, stanza.get('name')))
+
+
+def assign_donors(rng, stats, inherit_slots, donor_candidates):
+    # Hand out the inherit slots to donors. Each donor is drawn once, without
+    # replacement and for one kind only, as the real fan-in counts a donor's
+    # inheritors of both kinds together, and takes as many slots as a draw from the real fan-in
+    # distribution. A stanza only inherits from commands before it, so there
+    # are no cycles, and a donor whose own chain is already as deep as the
+    # real ones go donates nothing. A slot with no donor left is dropped.
+
+    depth_limit = max(stats['inheritance_depths'], default=1)
+    depths = Counter()
+
+    # Per kind: the drawn donors in file order, how far they have been opened,
+    # and those open to stanzas after them that still have slots to fill
+    pools = {}
+    drawn_donors = set()
+
+    for kind in ('options', 'settings'):
+        candidates = list(donor_candidates[kind])
+        rng.shuffle(candidates)
+
+        drawn = []
+        capacity = 0
+        for stanza_number, donor in candidates:
+            if capacity >= len(inherit_slots[kind]):
+                break
+            if donor in drawn_donors:
+                continue
+            drawn_donors.add(donor)
+            fan_in = sample(rng, stats['donor_fan_in'])
+            drawn.append([stanza_number, donor, fan_in])
+            capacity += fan_in
+
+        drawn.sort()
+        pools[kind] = {'drawn': drawn, 'opened': 0, 'open': []}
+
+    # Slots in file order, so that a donor's depth is settled before it is
+    # opened
+    slots = sorted(((stanza_number, kind, inherit) for kind in pools
+                    for stanza_number, inherit in inherit_slots[kind]),
+                   key=lambda slot: slot[0])
+
+    for stanza_number, kind, inherit in slots:
+        pool = pools[kind]
+
+        while pool['opened'] < len(pool['drawn']) \
+                and pool['drawn'][pool['opened']][0] < stanza_number:
+            entry = pool['drawn'][pool['opened']]
+            if depths[entry[0]] < depth_limit:
+                pool['open'].append(entry)
+            pool['opened'] += 1
+
+        if not pool['open']:
+            inherit.getparent().remove(inherit)
+            continue
+
+        position = rng.randrange(len(pool['open']))
+        entry = pool['open'][position]
+
+        inherit.set('name', entry[1])
+        depths[stanza_number] = max(depths[stanza_number], depths[entry[0]] + 1)
+
+        entry[2] -= 1
+        if entry[2] == 0:
+            pool['open'][position] = pool['open'][-1]
+            pool['open'].pop()
+
+
+def synthesize_interface(stats, scale, seed):
+    rng = random.Random(seed)
+
+    stanza_total = round(sum(stats['stanza_types'].values()) * scale)
+
+    interface = etree.Element(CD + "interface", nsmap=i2d.NSMAP)
+    group = None
+
+    inherit_slots = {'options': [], 'settings': []}
+    donor_candidates = {'options': [], 'settings': []}
+    base_names = []
+
+    for i in range(stanza_total):
+        if i % STANZAS_PER_GROUP == 0:
+            group = etree.SubElement(
+                interface, CD + "interface", file=f"i-synthetic-{i // STANZAS_PER_GROUP:05}.xml")
+
+        stanza_type = sample(rng, stats['stanza_types'])
+
+        # A real name with a unique suffix keeps the setup.../define.../start...
+        # shapes that relation building looks for
+        name = f"{rng.choice(stats['names'])}x{i}"
+
+        if stanza_type == "variant" and base_names:
+            stanza = new_stanza(rng, stats, rng.choice(base_names))
+            stanza.set('variant', sample(rng, stats['variant_types']))
+        elif stanza_type == "class":
+            stanza = new_stanza(rng, stats, name)
+            stanza.set('variant', "instance")
+            if rng.random() < stats['class_environments'] / stats['stanza_types']['class']:
+                stanza.set('type', "environment")
+            sequence = etree.SubElement(stanza, CD + "sequence")
+            etree.SubElement(sequence, CD + "instance", value=name)
+            instances = etree.SubElement(stanza, CD + "instances")
+            for j in range(max(1, sample(rng, stats['class_instance_counts']))):
+                etree.SubElement(instances, CD + "constant",
+                                 value=f"{name}i{j}")
+        elif stanza_type == "environment":
+            stanza = new_stanza(rng, stats, name)
+            stanza.set('type', "environment")
+        else:
+            stanza = new_stanza(rng, stats, name)
+            base_names.append(name)
+
+        add_arguments(rng, stats, stanza, i, inherit_slots, donor_candidates)
+
+        group.append(stanza)
+
+    assign_donors(rng, stats, inherit_slots, donor_candidates)
+
+    return etree.ElementTree(interface)
+
+
+# --- Main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic interface file shaped like a real one")
+    parser.add_argument("--input", type=str, default=str(DEFAULT_INPUT),
+                        help="the real interface file to measure")
+    parser.add_argument("--output", type=str, default="context-synthetic.xml")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="size relative to the input, in stanzas")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stats", action="store_true",
+                        help="print the measured statistics as JSON")
+    args = vars(parser.parse_args())
+
+    stats = collect_interface_statistics(etree.parse(args['input']))
+
+    if args['stats']:
+        print(json.dumps(summarize_statistics(stats), indent=1))
+
+    synthetic_tree = synthesize_interface(stats, args['scale'], args['seed'])
+
+    synthetic_tree.write(args['output'], pretty_print=True,
+                         xml_declaration=True, encoding='UTF-8')
+
+    print(
+        f"Wrote {len(synthetic_tree.getroot().xpath('cd:interface/cd:command', namespaces=i2d.NSMAP))} stanzas to {args['output']}.")
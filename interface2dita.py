@@ -2,19 +2,38 @@
 
 from lxml import etree
 import argparse
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import string
-from collections import OrderedDict
+from collections import OrderedDict, ChainMap, Counter
+from itertools import zip_longest
 import datetime
 import pprint
 import random
-from distutils.dir_util import copy_tree
+import hashlib
+import json
+import pickle
+import copy
+import gc
+import multiprocessing
+import time
+import cProfile
+import signal
+import contextlib
+import functools
+import difflib
+import os
+import io
+import queue
+import threading
+import zipfile
+import tarfile
+import zlib
+import gzip
+import shutil
 
 
 import logging
-
-logging.basicConfig(filename="interface2dita_debug.log",
-                    format='%(levelname)s:%(message)s', level=logging.DEBUG)
+import sys
 
 logger = logging.getLogger(__name__)
 
@@ -24,1923 +43,4990 @@ SOURCE_BASE_URL = "https://source.contextgarden.net/tex/context/base/mkiv/"
 
 NSMAP = {'cd': 'http://www.pragma-ade.com/commands'}
 
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# The xml:lang of every topic and map; the language being built
+output_lang = "en"
+
+REFERENCE_DOCTYPE = '''<!DOCTYPE reference PUBLIC "-//OASIS//DTD DITA Reference//EN" "reference.dtd">'''
+CONCEPT_DOCTYPE = '''<!DOCTYPE concept PUBLIC "-//OASIS//DTD DITA Concept//EN" "concept.dtd">'''
+MAP_DOCTYPE = '''<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">'''
+
+CD = "{http://www.pragma-ade.com/commands}"
+
+CD_COMMAND_TAG = CD + "command"
+CD_INTERFACE_TAG = CD + "interface"
+
 donor_set = set()
 
+# Set to False (--compact) to write files without indentation
+pretty_print_output = True
+
+# Set by --reproducible or SOURCE_DATE_EPOCH: the same input then gives the
+# same bytes, with today taken from SOURCE_DATE_EPOCH, review dates from the
+# topic name, and archives written in name order with fixed timestamps
+reproducible_build = False
+
+# (filename, status) for every topic and map this run produced, where status is
+# added, changed or unchanged
+write_log = []
+
+# (filename, error) for every topic and map that could not be written
+write_failures = []
+
+# Set by --write-threads; with none, files are written as they are produced
+write_threads = 0
+
 # --- Utility Functions ---
 
 
-def ppxml(element, element_doctype='''<!DOCTYPE reference PUBLIC "-//OASIS//DTD DITA Reference//EN" "reference.dtd">'''):
-    foobytes = etree.tostring(element,
-                              pretty_print=True,
-                              xml_declaration=True,
-                              encoding='UTF-8',
-                              doctype=element_doctype)
+def serialize_dita(element, doctype, pretty_print=None):
+    if pretty_print is None:
+        pretty_print = pretty_print_output
 
-    foo = foobytes.decode("utf-8")
+    return etree.tostring(element,
+                          pretty_print=pretty_print,
+                          xml_declaration=True,
+                          encoding='UTF-8',
+                          doctype=doctype)
 
-    foo = foo.replace('xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    foo = foo.replace('ns0:lang="en"', 'xml:lang="en"')
 
-    return(foo)
+def write_file(filename, output):
+    write_log.append((str(filename), output_sink.put(filename, output)))
 
 
-def get_command_url(command_name):
-    return f"commands/{command_name[0].lower()}/r_command_{command_name}.dita"
+def write_output(filename, output):
+    # Returns the bytes given, whether or not they have been written yet
 
+    if write_threads > 0:
+        get_background_writer().put(filename, output)
+    else:
+        try:
+            write_file(filename, output)
+        except OSError as error:
+            write_failures.append((str(filename), str(error)))
 
-# --- Dealing with Variants ---
+    return output
 
-def generate_variant_data(
-        command_name, command_stanza, variant_type):
-    return("Not implemented yet")
 
+def write_dita(element, filename, doctype):
+    return write_output(filename, serialize_dita(element, doctype))
 
-# --- Functions to manage the command data ---
 
-def generate_settings_keys(argument):
+def ppxml(element, element_doctype=REFERENCE_DOCTYPE):
+    return serialize_dita(element, element_doctype, pretty_print=True).decode("utf-8")
 
-    keys = []
 
-    # each of the keys can be an option inheritance, a simple value, or a argument
+# --- Background Writing ---
 
-    for value in argument:
+# Generating a topic is CPU bound and writing it is I/O bound, so with
+# --write-threads the generation loop only hands the bytes over and moves on.
+# The queue is bounded, so that generation cannot get far ahead of slow
+# storage. Each thread takes whatever is waiting, up to a batch, and writes it
+# in filename order. Failures are kept in write_failures and reported at the
+# end of the run.
 
-        this_key = {}
+WRITE_QUEUE_SIZE = 256
+WRITE_BATCH_SIZE = 32
 
-        # print(f"Working with key value: {ppxml(value)}")
 
-        if value.tag == "{http://www.pragma-ade.com/commands}inherit":
-            # print(f"Found inheritance from options in {value.get('name')}")
-            this_key['type'] = "inherit"
-            this_key['donor'] = value.get('name')
-            this_key['donor_id'] = "options1"
-            donor_set.add(this_key['donor'])
+class BackgroundWriter:
+    def __init__(self, thread_count):
+        self.queue = queue.Queue(WRITE_QUEUE_SIZE)
+        # A forked process gets a writer of its own, not its parent's threads
+        self.pid = os.getpid()
 
-        elif value.tag == "{http://www.pragma-ade.com/commands}constant":
-            # (f"Found key name of {value.get('type')}")
-            if "cd:" in value.get('type'):
-                this_key['type'] = "argument"
-                this_key['text'] = value.get('type')[3:].upper()
-            else:
-                this_key['type'] = "simple"
-                this_key['text'] = value.get('type')
+        for i in range(thread_count):
+            threading.Thread(target=self.run, daemon=True).start()
 
-            if 'default' in value.attrib and value.get('default') == 'yes':
-                this_key['default'] = True
-            else:
-                this_key['default'] = False
-        keys.append(this_key)
+    def put(self, filename, output):
+        self.queue.put((filename, output))
 
-    return keys
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
 
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
 
-def generate_settings(argument):
-    settings = []
+            try:
+                for filename, output in sorted(batch, key=lambda item: str(item[0])):
+                    # Anything escaping here would end the thread, and flush()
+                    # would wait forever on the batch
+                    try:
+                        write_file(filename, output)
+                    except Exception as error:
+                        write_failures.append((str(filename), str(error)))
+            finally:
+                for item in batch:
+                    self.queue.task_done()
 
-    # one set of assignments
+    def flush(self):
+        self.queue.join()
 
-    # settings key=value can be inherited as a whole, or have children
-    # if articulated, settings keys can be an option inheritance, a simple value, or a argument
 
-    for value in argument:
+background_writer = None
 
-        # Handling the parameter or inherit element as the value, here
 
-        this_setting = {}
+def get_background_writer():
+    global background_writer
 
-        # this should always work
-        try:
-            value_name = value.get('name')
-        except:
-            logger.warn(f"Couldn't get name for setting!")
+    if background_writer is None or background_writer.pid != os.getpid():
+        background_writer = BackgroundWriter(write_threads)
 
-        this_setting['name'] = value_name
+    return background_writer
 
-        # This is either going to be an inherit, or a parameter
 
-        if value.tag == "{http://www.pragma-ade.com/commands}inherit":
-            this_setting['type'] = "inherit"
-            this_setting['donor'] = value.get('name')
-            this_setting['donor_id'] = "settings1"
-            donor_set.add(this_setting['donor'])
-        elif value.tag == "{http://www.pragma-ade.com/commands}parameter":
-            # get the keys in the parameter
-            this_setting['type'] = "keys"
-            this_setting['keys'] = generate_settings_keys(value)
+def flush_background_writes():
+    # Wait until everything handed to the writer is on disk (or has failed)
 
-        settings.append(this_setting)
+    if background_writer is not None and background_writer.pid == os.getpid():
+        background_writer.flush()
 
-    return settings
 
+def report_write_failures():
+    for filename, error in write_failures:
+        logger.error("Could not write %s: %s", filename, error)
 
-def generate_options(argument):
-    options = []
+    if write_failures:
+        report(
+            f"{len(write_failures)} file(s) could not be written; see the log.")
 
-    # Option values can be of one of three types: an inheritance, a simple value, or a argument
 
-    for value in argument:
+# --- Output Sinks ---
 
-        this_option = {}
+# Everything a build produces goes to output_sink, by its path under the build
+# directory: topics and maps from write_file, the directories from
+# make_output_dirs, and the manually edited topics. The directory sink writes
+# the files themselves. The archive sinks stream them into one zip or tar file,
+# which replaces the previous one when the sink is closed. The memory sink keeps
+# them in a dict, for tests and benchmarks.
+#
+# put returns added, changed or unchanged, against what the sink held before
+# this run. keep carries a file over from the previous output without it being
+# generated again, which only matters to sinks that start afresh. read returns
+# what the sink held before this run, or None.
+#
+# cache_tag goes into the names of the manifests and the model cache kept in
+# the build directory, as they vouch for what one destination holds. It is None
+# for a sink that holds nothing from one run to the next.
 
-        if value.tag == "{http://www.pragma-ade.com/commands}constant":
-            # print(f"Found constant with type {value.get('type')}")
-            if "cd:" in value.get('type'):
-                this_option['type'] = "argument"
-                this_option['text'] = value.get('type')[3:].upper()
-            else:
-                this_option['type'] = "simple"
-                this_option['text'] = value.get('type')
+class OutputSink:
+    # Whether forked processes can write to the sink themselves; if not, they
+    # hand what they write back through a ForwardingSink
+    forkable = False
 
-            if 'default' in value.attrib and value.get('default') == 'yes':
-                this_option['default'] = True
-            else:
-                this_option['default'] = False
+    # Whether unchanged files are stored again
+    rewrites = True
 
-        elif value.tag == "{http://www.pragma-ade.com/commands}inherit":
-            # print(f"Found inheritance from command {value.get('name')}")
-            this_option['type'] = "inherit"
-            this_option['donor'] = value.get('name')
-            this_option['donor_id'] = "options1"
-            donor_set.add(this_option['donor'])
-        options.append(this_option)
+    cache_tag = None
 
-    return options
+    def __init__(self, root):
+        self.root = Path(root)
 
+    def get_name(self, filename):
+        return Path(os.path.relpath(filename, self.root)).as_posix()
 
-def is_argument_optional(arg):
-    if "optional" in arg.attrib and arg.get('optional') == 'yes':
-        return True
-    else:
-        return False
+    def put(self, filename, output):
+        status = self.status(filename, output)
 
+        if status != "unchanged" or self.rewrites:
+            self.store(filename, output)
 
-def get_argument_delimiters(arg):
+        return status
 
-    try:
-        delim_type = arg.get('delimiters')
-    except:
+    def put_file(self, filename, source, link=False):
+        # Only the directory sink can link
+        return self.put(filename, Path(source).read_bytes())
+
+    def make_dirs(self, path):
         pass
 
-    if delim_type is None:
-        delim_type = "brackets"
+    def keep(self, filename):
+        pass
 
-    return delim_type
+    def holds(self, filename, content_hash):
+        output = self.read(filename)
+        return output is not None and get_content_hash(output) == content_hash
 
+    def remove(self, filename):
+        pass
 
-def get_argument_type(arg):
-    if arg.tag == "{http://www.pragma-ade.com/commands}keywords":
-        if len(arg) == 1:
-            if 'type' in arg[0].attrib and "cd:" in arg[0].get('type'):
-                return arg[0].get('type')[3:].upper()
-        return "OPTIONS"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}assignments":
-        return "SETTINGS"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}csname":
-        return "COMMAND"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}content":
-        return "SCOPE"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}delimiter":
-        return "DELIMITER"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}dimension":
-        return "DIMENSION"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}triplet":
-        return "TRIPLET"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}position":
-        return "POSITION"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}string":
-        return "STRING"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}angles":
-        return "ANGLES"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}template":
-        return "TEMPLATE"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}apply":
-        return "APPLY"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}text":
-        return "TEXT"
-    elif arg.tag == "{http://www.pragma-ade.com/commands}index":
-        return "INDEX"
-    else:
-        logger.warning(
-            f"Found unknown argument type of {arg.tag} in:\n{ppxml(arg)}")
+    def close(self):
+        pass
 
 
-def generate_args_data(args_tree):
-    args_list = []
+def matches_pattern(name, prefix, pattern):
+    # name is under prefix, and the rest of it matches the glob pattern part
+    # for part, as Path.glob would
 
-    option_i = 0
-    setting_i = 0
+    if not name.startswith(prefix + "/"):
+        return False
 
-    for args in args_tree:
+    rest = PurePosixPath(name[len(prefix) + 1:])
 
-        for argument in args:
-            this_argument = {}
-            this_argument['delimiters'] = get_argument_delimiters(argument)
-            this_argument['type'] = get_argument_type(argument)
-            if this_argument['type'] == "SCOPE":
-                this_argument['delimiters'] = "braces"
-            if this_argument['type'] == "DELIMITER":
-                this_argument['delimiters'] = "none"
-                this_argument[f'name'] = argument.get('name')
-            this_argument['optional'] = is_argument_optional(argument)
-            if this_argument['type'] == "OPTIONS":
-                option_i += 1
-                this_argument[f'name'] = f"options{option_i}"
-                this_argument[f'count'] = len(argument)
-                this_argument[f'children'] = generate_options(
-                    argument)
-            if this_argument['type'] == "SETTINGS":
-                setting_i += 1
-                this_argument[f'name'] = f"settings{setting_i}"
-                this_argument[f'count'] = len(argument)
-                this_argument[f'children'] = generate_settings(
-                    argument)
-
-            args_list.append(this_argument)
-
-    return args_list
+    return len(rest.parts) == len(PurePosixPath(pattern).parts) and rest.match(pattern)
 
 
-def generate_command_data(
-        command_name, command_stanza):
+class DirectorySink(OutputSink):
+    forkable = True
+    rewrites = False
+    cache_tag = ""
 
-    keywords = []
+    def status(self, filename, output):
+        # Files that would not change are left alone, so that their mtimes
+        # still tell downstream builds something
 
-    try:
-        command_level = command_stanza.get('level')
-    except:
-        command_level = "UNKNOWN"
+        try:
+            if os.path.getsize(filename) == len(output) and Path(filename).read_bytes() == output:
+                return "unchanged"
+            return "changed"
+        except FileNotFoundError:
+            return "added"
+
+    def store(self, filename, output):
+        with open(filename, 'wb') as f:
+            f.write(output)
+
+    def put_file(self, filename, source, link=False):
+        if not link:
+            return super().put_file(filename, source)
+
+        if not os.path.lexists(filename):
+            status = "added"
+        elif os.path.samefile(filename, source):
+            # Already linked, so it changed along with the source
+            return "changed"
+        else:
+            status = "changed"
+            os.remove(filename)
 
-    if command_level == "system":
-        command_is_system = True
-    else:
-        command_is_system = False
+        try:
+            os.link(source, filename)
+        except OSError:
+            # Not on the same file system, for one
+            shutil.copy2(source, filename)
 
-    try:
-        reported_category = command_stanza.get('category')
-    except:
-        reported_category = False
+        return status
 
-    if reported_category:
-        for kw in reported_category.split():
-            keywords.append(kw)
+    def make_dirs(self, path):
+        Path(path).mkdir(exist_ok=True, parents=True)
 
-    try:
-        source_filename = command_stanza.get('file')
-    except:
-        source_filename = "UNKNOWN"
+    def exists(self, filename):
+        return Path(filename).exists()
 
-    try:
-        command_variant = command_stanza.get('variant')
-    except:
-        command_variant = ""
+    def read(self, filename):
+        try:
+            return Path(filename).read_bytes()
+        except OSError:
+            return None
 
-    try:
-        args_tree = command_stanza.xpath('cd:arguments', namespaces=NSMAP)
-    except:
-        args_tree = []
+    def list(self, path, pattern):
+        return [str(filename) for filename in Path(path).glob(pattern)]
 
-    args = generate_args_data(args_tree)
+    def remove(self, filename):
+        os.remove(filename)
 
-    command_topic_data = {
-        'name': command_name,
-        'is_system': command_is_system,
-        'category': command_level,
-        'variant': command_variant,
-        'keywords': keywords,
-        'filename': source_filename,
-        'args_tree': args_tree,
-        'arguments': args,
-        'tree': command_stanza,
-    }
 
-    for arg in args:
-        if 'name' in arg and arg['name'] == 'options1':
-            command_topic_data['options1_count'] = arg['count']
-        if 'name' in arg and arg['name'] == 'settings1':
-            command_topic_data['settings1_count'] = arg['count']
+class MemorySink(OutputSink):
+    def __init__(self, root, files=None):
+        super().__init__(root)
+        self.files = {} if files is None else files
 
-    return command_topic_data
+    def status(self, filename, output):
+        previous = self.files.get(self.get_name(filename))
 
+        if previous is None:
+            return "added"
 
-def list_of_commands(tr, nsp):
-    root = tr.getroot()
+        return "unchanged" if previous == output else "changed"
 
-    pred = f'cd:interface/cd:command'
+    def store(self, filename, output):
+        self.files[self.get_name(filename)] = output
 
-    all_commands = root.xpath(pred, namespaces=nsp)
+    def exists(self, filename):
+        return self.get_name(filename) in self.files
 
-    result = []
+    def read(self, filename):
+        return self.files.get(self.get_name(filename))
 
-    for c in all_commands:
-        result.append(c)
+    def list(self, path, pattern):
+        prefix = self.get_name(path)
+        return [str(self.root / name) for name in self.files if matches_pattern(name, prefix, pattern)]
 
-    return result
+    def remove(self, filename):
+        del self.files[self.get_name(filename)]
 
 
-def process_variant(stanza_name, stanza):
+def get_archive_timestamp():
+    # Midnight (UTC) of the build date in a reproducible build
+    if reproducible_build:
+        return datetime.datetime.combine(today, datetime.time(), datetime.timezone.utc).timestamp()
+    return time.time()
 
-    variant_type = stanza.get('variant')
 
-    print(
-        f" VARIANT - Noting variant for {stanza_name} with type {variant_type}...")
+class ArchiveSink(OutputSink):
+    # Writes a new archive next to the old one; the old one is only read, to
+    # judge what changed and to carry kept files over
 
+    def __init__(self, root, archive_path):
+        super().__init__(root)
+        self.archive_path = Path(archive_path)
+        self.temp_path = self.archive_path.with_name(
+            self.archive_path.name + ".tmp")
+        self.lock = threading.Lock()
+        self.written = set()
+        # In a reproducible build, what is stored is held until close, as
+        # files come from several threads and processes in no fixed order
+        self.pending = {} if reproducible_build else None
+        self.previous_archive = None
+        self.previous_pid = None
+        self.previous_index = {}
+        self.cache_tag = "_" + \
+            get_content_hash(str(self.archive_path.resolve()))[:12]
 
-def add_command(command_name, stanza, commands_dict, with_arguments=True):
-    print(
-        f" COMMAND - Adding command for {command_name}...(arguments: {with_arguments})")
+        if self.archive_path.exists():
+            self.previous_index = self.read_index()
 
-    if command_name in commands_dict:
-        logger.debug(
-            f"Warning! Attempting to clobber entry for {command_name}!")
-    else:
-        commands_dict[command_name] = generate_command_data(
-            command_name, stanza)
+        self.archive_path.parent.mkdir(exist_ok=True, parents=True)
+        self.archive = self.open_new()
 
+    def get_previous_archive(self):
+        # Forked processes share open files with their parent, so each opens
+        # the old archive for itself
+        with self.lock:
+            if self.previous_pid != os.getpid():
+                self.previous_archive = self.open_previous()
+                self.previous_pid = os.getpid()
+            return self.previous_archive
 
-def add_environment(stanza_name, stanza, environments_list, commands_dict, relations_list):
+    def status(self, filename, output):
+        name = self.get_name(filename)
 
-    environment_relations = {}
-    environment_relations['stem'] = stanza_name
-    environment_relations['members'] = []
+        if name not in self.previous_index:
+            return "added"
 
-    print(
-        f" ENVIRON - Starting on environment {stanza_name}...")
+        return "unchanged" if self.is_unchanged(name, output) else "changed"
 
-    if 'begin' in stanza.attrib:
-        env_start_string = stanza.attrib['begin']
-    else:
-        env_start_string = "start"
+    def store(self, filename, output):
+        name = self.get_name(filename)
 
-    if 'end' in stanza.attrib:
-        env_stop_string = stanza.attrib['end'].encode(
-            "ascii", errors="ignore").decode()
-    else:
-        env_stop_string = "stop"
+        with self.lock:
+            if name in self.written:
+                logger.debug("%s is already in the archive; keeping the first one.", name)
+                return
+            self.written.add(name)
+            if self.pending is not None:
+                self.pending[name] = output
+            else:
+                self.add(name, output)
 
-    start_command_name = env_start_string + stanza_name
-    stop_command_name = env_stop_string + stanza_name
+    def keep(self, filename):
+        name = self.get_name(filename)
 
-    print(
-        f" ENVIRON - For the environment {stanza_name}, generating {start_command_name}, {stop_command_name}")
-    add_command(start_command_name, stanza, commands_dict)
-    environment_relations['members'].append(start_command_name)
-    add_command(stop_command_name, stanza, commands_dict, with_arguments=False)
-    environment_relations['members'].append(stop_command_name)
+        if name in self.previous_index:
+            self.store(filename, self.read_previous(name))
 
-    relations_list.append(environment_relations)
-    if stanza_name not in environments_list:
-        environments_list.append(stanza_name)
+    def exists(self, filename):
+        return self.get_name(filename) in self.previous_index
 
+    def read(self, filename):
+        name = self.get_name(filename)
 
-def add_class(stanza_name, stanza, classes_list,
-              environments_list, commands_dict, relations_list):
+        if name not in self.previous_index:
+            return None
 
-    class_relations = {}
-    class_relations['name'] = stanza_name
-    class_relations['instances'] = []
+        return self.read_previous(name)
 
-    print(
-        f"   CLASS - Starting on class {stanza_name}...")
+    def list(self, path, pattern):
+        # What the previous archive held; anything not written again is
+        # simply not in the new one
+        prefix = self.get_name(path)
+        return [str(self.root / name) for name in self.previous_index if matches_pattern(name, prefix, pattern)]
 
-    # First, do we have an environment
-    try:
-        stanza_type = stanza.attrib['type']
-    except:
-        stanza_type = False
+    def close(self):
+        for name in sorted(self.pending or ()):
+            self.add(name, self.pending[name])
 
-    # Do we have a pattern
+        self.close_archive()
+        os.replace(self.temp_path, self.archive_path)
 
-    sequence_elements = stanza.xpath(
-        'cd:sequence/*', namespaces=NSMAP)
+    def close_archive(self):
+        self.archive.close()
 
-    # if stanza_name == "placefloat":
-    #     print(f"{stanza_name} sequence is {sequence_elements}")
 
-    stem_seen = False
-    prefix = ""
-    default_stem = ""
-    postfix = ""
+ZIP_EARLIEST_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 
-    for sequence_element in sequence_elements:
-        # print(f"{stanza_name} sequence tag is {sequence_element.tag}")
-        if sequence_element.tag == "{http://www.pragma-ade.com/commands}string" and stem_seen == False:
-            prefix = sequence_element.get('value')
-        elif sequence_element.tag == "{http://www.pragma-ade.com/commands}instance":
-            default_stem = sequence_element.get('value')
-            stem_seen = True
-        elif sequence_element.tag == "{http://www.pragma-ade.com/commands}string" and stem_seen == True:
-            postfix = sequence_element.get('value')
 
-    instances = stanza.xpath(
-        'cd:instances/cd:constant/@value', namespaces=NSMAP)
+class ZipSink(ArchiveSink):
 
-    if stanza_type == "environment":
-        # Process each instance as an environment
-        print(
-            f"CLASSENV - For the class {stanza_name}, generating environment")
-        environment_relations = {}
-        environment_relations['stem'] = stanza_name
-        environment_relations['members'] = []
+    def read_index(self):
+        with zipfile.ZipFile(self.archive_path) as archive:
+            return {info.filename: (info.file_size, info.CRC) for info in archive.infolist()}
 
-        for instance_name in instances:
-            instance_name = prefix + instance_name + postfix
-            # add_environment(instance_name, stanza,
-            #                 environments_dict, commands_dict, relations_list)
+    def open_previous(self):
+        return zipfile.ZipFile(self.archive_path)
 
-            print(
-                f"CLASSENV - Starting on environment {instance_name} in class {stanza_name}...")
+    def open_new(self):
+        return zipfile.ZipFile(self.temp_path, 'w', zipfile.ZIP_DEFLATED)
 
-            if 'begin' in stanza.attrib:
-                env_start_string = stanza.attrib['begin']
-            else:
-                env_start_string = "start"
+    def is_unchanged(self, name, output):
+        return self.previous_index[name] == (len(output), zlib.crc32(output))
 
-            if 'end' in stanza.attrib:
-                env_stop_string = stanza.attrib['end'].encode(
-                    "ascii", errors="ignore").decode()
-            else:
-                env_stop_string = "stop"
+    def read_previous(self, name):
+        return self.get_previous_archive().read(name)
 
-            start_command_name = env_start_string + instance_name
-            stop_command_name = env_stop_string + instance_name
+    def add(self, name, output):
+        timestamp = get_archive_timestamp()
+        date_time = time.gmtime(timestamp) if reproducible_build else time.localtime(timestamp)
 
-            print(
-                f" ENVIRON - For the environment {stanza_name}, generating {start_command_name}, {stop_command_name}")
-            add_command(start_command_name, stanza, commands_dict)
-            environment_relations['members'].append(start_command_name)
-            add_command(stop_command_name, stanza,
-                        commands_dict, with_arguments=False)
-            environment_relations['members'].append(stop_command_name)
+        # Zip dates start in 1980, and SOURCE_DATE_EPOCH may well be 0
+        info = zipfile.ZipInfo(name, max(date_time[:6], ZIP_EARLIEST_DATE_TIME))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        self.archive.writestr(info, output)
 
-        class_relations['instances'].append(environment_relations)
 
-    else:
-        # Process each instance as a command
+class TarSink(ArchiveSink):
 
-        all_instances = []
+    def read_index(self):
+        # A tar (and more so a compressed one) has no cheap random access, so
+        # the old contents are read once, in order, and held
+        with tarfile.open(self.archive_path, 'r:*') as archive:
+            return {member.name: archive.extractfile(member).read()
+                    for member in archive if member.isfile()}
 
-        for instance_name in instances:
-            instance_name = prefix + instance_name + postfix
-            add_command(instance_name, stanza, commands_dict)
-            all_instances.append(instance_name)
-            class_relations['instances'].append(instance_name)
+    def open_new(self):
+        # A .tar.gz or .tgz is compressed here rather than by tarfile, which
+        # would stamp the gzip header with the current time
+        self.compressed_file = None
 
-        sep = ", "
-        all_instances = sep.join(all_instances)
+        if self.archive_path.suffix in (".gz", ".tgz"):
+            self.compressed_file = gzip.GzipFile(
+                self.temp_path, 'wb', mtime=int(get_archive_timestamp()))
+            return tarfile.open(fileobj=self.compressed_file, mode='w|')
 
-        print(
-            f"   CLASS - For the class {stanza_name}, generated {all_instances}")
+        return tarfile.open(self.temp_path, 'w|')
 
-    relations_list.append(class_relations)
-    if stanza_name not in classes_list:
-        classes_list.append(stanza_name)
+    def close_archive(self):
+        super().close_archive()
+        if self.compressed_file is not None:
+            self.compressed_file.close()
 
+    def is_unchanged(self, name, output):
+        return self.previous_index[name] == output
 
-def get_stanza_type(stanza):
+    def read_previous(self, name):
+        return self.previous_index[name]
 
-    # We are looking for one of three types of stanzas, and an escape case:
-    #
-    # CLASSES
-    #
-    # These stanzas describe sets of related commands that share setups. Commands can be added
-    # to the set by the user with an appropraite \define command
-    #
-    # variant="instance" AND instance child AND non-zero instances
-    #
-    # ENVIRONMENTS
-    #
-    # This imply at base a pair of commands, a stem with a prefix for the begining of the environment
-    # and a prefix for the end
-    #
-    # type=environment
-    #
-    # COMMANDS
-    #
-    # Everything else that doesn't have a strange variant attribute (we wan the command manual to
-    # document extant commands the user might encounter, not things that are as yet unimplemented)
-    #
-    # (everything else except unhandled variants)
-    #
-    # UNHANDLED VARIANTS
-    #
-    # ...get reported, but no commands are created?
+    def add(self, name, output):
+        info = tarfile.TarInfo(name)
+        info.size = len(output)
+        info.mtime = int(get_archive_timestamp())
+        self.archive.addfile(info, io.BytesIO(output))
 
-    # We want the return values from here to be sufficient to disambiguate any collisions
 
-    try:
-        variant_type = stanza.attrib['variant']
-    except:
-        variant_type = False
+class ForwardingSink(OutputSink):
+    # In a forked process, for a sink that is not forkable: changes are judged
+    # against the parent's sink, and what would be stored or kept is collected
+    # for the parent to replay
 
-    try:
-        stanza_type = stanza.attrib['type']
-    except:
-        stanza_type = False
+    def __init__(self, sink):
+        super().__init__(sink.root)
+        self.sink = sink
+        self.cache_tag = sink.cache_tag
+        self.entries = []
 
-    try:
-        environment_prefix = stanza.attrib['begin']
-    except:
-        environment_prefix = False
+    def status(self, filename, output):
+        return self.sink.status(filename, output)
 
-    try:
-        stanza_name = stanza.attrib['name']
-    except:
-        logger.debug(
-            f"ENONAME: No name found in the folllowing stanza:\n\n{ppxml(stanza)}\n\n")
-        return "ENONAME", "variant", variant_type, environment_prefix
+    def store(self, filename, output):
+        self.entries.append((filename, output))
 
-    if stanza_name.encode(
-            "ascii", errors="ignore").decode() == "":
-        # we have no name to work with, bail out
-        logger.debug(
-            f"EEMPTYNAME: Empty name found in the folllowing stanza:\n\n{ppxml(stanza)}\n\n")
-        return "EEMPTYNAME", "variant", variant_type, environment_prefix
+    def keep(self, filename):
+        self.entries.append((filename, None))
 
-    has_instances = stanza.xpath(
-        'boolean(cd:instances/cd:constant)', namespaces=NSMAP)
+    def exists(self, filename):
+        return self.sink.exists(filename)
 
-    if variant_type == "instance" and has_instances:
-        return stanza_name, "class", variant_type, environment_prefix
-    elif stanza_type == "environment" and variant_type == False:
-        return stanza_name, "environment", variant_type, environment_prefix
-    elif variant_type == False:
-        return stanza_name, "command", variant_type, environment_prefix
-    else:
-        return stanza_name, "variant", variant_type, environment_prefix
+    def read(self, filename):
+        return self.sink.read(filename)
 
+    def list(self, path, pattern):
+        return self.sink.list(path, pattern)
 
-def process_interface_tree(ft):
-    """Use the complete interface XML file to prepare dictionaries of commands:
-    one of commands (style, document, and system) and one of variants.
-    """
 
-    # some stanzas appear twice in the interface, and cannot be disambiguated:
-    interface_duplicates = [
-        'thinspace',
-        'monobold',
-        'xmlregisterns',
-        'defineinterlinespace',
-        'setupinterlinespace',
-        'setuplocalinterlinespace',
-        'switchtointerlinespace',
-        'dosetupcheckedinterlinespace',
-        'useinterlinespaceparameter',
-        'definelinefiller',
-        'setuplinefiller',  # Second one has global added, as of 2020-07-05
-        'setuplinefillers',
-        'startlinefiller',
-        'stoplinefiller',
-        'setlinefiller',
-        'starttexcode',
-        'stoptexcode',
-    ]
+def replay_sink_entries(entries):
+    for filename, output in entries:
+        if output is None:
+            output_sink.keep(filename)
+        else:
+            output_sink.store(filename, output)
 
-    logger.debug("### Processing interface tree.")
 
-    classes_list = []
-    commands_dict = {}
-    environments_list = []
-    variants_dict = {}
-    relations_list = []
+def new_output_sink(sink_type, root, archive_path=None):
+    if sink_type == "directory":
+        return DirectorySink(root)
+    elif sink_type == "memory":
+        return MemorySink(root)
+    elif sink_type == "zip":
+        return ZipSink(root, archive_path or Path(root) / "dita.zip")
+    elif sink_type == "tar":
+        return TarSink(root, archive_path or Path(root) / "dita.tar")
 
-    interface_commands = list_of_commands(ft, NSMAP)
+    raise ValueError(f"Unknown output sink {sink_type}")
 
-    for command_stanza in interface_commands:
 
-        stanza_name, stanza_type, variant_type, environment_prefix = get_stanza_type(
-            command_stanza)
+# Set by --sink; everything under the build directory goes through it
+output_sink = DirectorySink(Path.cwd() / 'build')
 
-        # print(
-        #     f"Found command {stanza_name} with type {stanza_type} (Variant:{variant_type}) (Env Prefix: {environment_prefix})")
 
-        if stanza_name in commands_dict and stanza_name in interface_duplicates:
-            print(
-                f"     DUP - Found duplicate stanza for command {stanza_name}")
-            continue
+# Stand-ins for log message arguments that are costly to format; the work is
+# only done if the message is actually emitted
 
-        if "start" + stanza_name in commands_dict and "start" + stanza_name in interface_duplicates:
-            print(
-                f"     DUP - Found duplicate environment stanza for command {stanza_name}")
-            continue
+class LazyXML:
+    __slots__ = ('element',)
 
-        collision_list = []
-        command_signature = (stanza_name, stanza_type,
-                             variant_type, environment_prefix)
-        if command_signature in collision_list:
-            logger.warn(
-                f"Collision for command {stanza_name} with type {stanza_type} (Variant:{variant_type}) (Env Prefix: {environment_prefix})")
-        else:
-            collision_list.append(command_signature)
-
-        if stanza_type == "class":
-            add_class(stanza_name, command_stanza, classes_list,
-                      environments_list, commands_dict, relations_list)
-        elif stanza_type == "environment":
-            add_environment(
-                stanza_name, command_stanza, environments_list, commands_dict, relations_list)
-        elif stanza_type == "command":
-            add_command(stanza_name, command_stanza, commands_dict)
-        elif stanza_type == "variant":
-            process_variant(stanza_name, command_stanza)
+    def __init__(self, element):
+        self.element = element
 
-    # Run back through the dict of commands stems, and add to the child list any
-    # command that has the environment as a stem of common forms
+    def __str__(self):
+        return ppxml(self.element)
 
-    # env_related_dict = generate_env_related_dict(
-    #     env_related_dict, commands_dict)
 
-    return commands_dict, variants_dict, classes_list, environments_list, relations_list
+class LazyJoin:
+    __slots__ = ('items',)
 
+    def __init__(self, items):
+        self.items = items
 
-def add_supporting_env_commands(relations_list, commands_dict):
+    def __str__(self):
+        return ", ".join(self.items)
 
-    transformation_map = {
-        'definefloats': 'definefloat',
-        'setupfloats': 'setupfloat',
-        'definebox': 'definehbox',
-        'definectxfunction': 'installctxfunction',
-        'definectxfunctiondefinition':  'startctxfunctiondefintion',
-        'definefence': 'definemathfence',
-        'definelabel': 'definelabelclass',
-        'definelanguage': 'installlanguage',
-        'definesynonym': 'definesynonyms',
-        'definesorts': 'definesorting',
-        'definesection': 'definehead',
-        'setupsection': 'setuphead',
-    }
 
-    for relation in relations_list:
-        if 'stem' in relation:
-            setup_command = "setup" + relation['stem']
-            if setup_command in commands_dict:
-                relation['members'].append(setup_command)
+def get_command_url(command_name):
+    return f"commands/{command_name[0].lower()}/r_command_{command_name}.dita"
 
-            define_command = "define" + relation['stem']
-            if define_command in transformation_map:
-                print(
-                    f"#### Transforming {define_command} to {transformation_map[define_command]}")
-                define_command = transformation_map[define_command]
-            if define_command in commands_dict:
-                relation['members'].append(define_command)
 
-        if 'name' in relation:
-            setup_command = "setup" + relation['name']
-            if setup_command in commands_dict:
-                relation['instances'].append(setup_command)
+def get_content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
 
-            define_command = "define" + relation['name']
-            if define_command in transformation_map:
-                print(
-                    f"#### Transforming {define_command} to {transformation_map[define_command]}")
-                define_command = transformation_map[define_command]
-            if define_command in commands_dict:
-                relation['instances'].append(define_command)
 
-            for instance in relation['instances']:
-                if 'stem' in instance:
-                    setup_command = "setup" + instance['stem']
-                    if setup_command in commands_dict:
-                        instance['members'].append(setup_command)
+def get_stanza_hash(stanza):
+    # Canonical form, so that attribute order and whitespace in tags don't matter
+    return get_content_hash(etree.tostring(stanza, method="c14n"))
 
-                    define_command = "define" + instance['stem']
-                    if define_command in transformation_map:
-                        print(
-                            f"#### Transforming {define_command} to {transformation_map[define_command]}")
-                        define_command = transformation_map[define_command]
 
-                    if define_command in commands_dict:
-                        instance['members'].append(define_command)
+# --- Command Model ---
 
-    return relations_list
+# Commands, their arguments, and the options and settings of those arguments are
+# slotted records rather than dicts. Strings are interned, and records and
+# tuples that are equal are made once and shared, between the commands of a
+# stanza and across stanzas. Records are never changed once made.
 
-# --- Topic Building Functions ---
+class Record:
+    __slots__ = ()
 
+    def __init__(self, *values, **fields):
+        # Fields in __slots__ order, then by name; the rest are None
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+        for field in self.__slots__[len(values):]:
+            setattr(self, field, fields.get(field))
 
-def add_topic_rellinks(topic_data):
-    related_links_string = f"""
-    <related-links>
-      <link href="{SOURCE_BASE_URL}{topic_data['filename']}" scope="external" format="html">
-        <linktext>Command definition in the <ph conkeyref="definitions/product_name"/> source file  <filepath>{topic_data['filename']}</filepath></linktext>
-      </link>
-    </related-links>"""
+    def as_dict(self):
+        # For printing; nested records and tuples of them become dicts and lists
 
-    related_links_element = etree.fromstring(related_links_string)
+        def plain(value):
+            if isinstance(value, Record):
+                return value.as_dict()
+            elif isinstance(value, tuple):
+                return [plain(item) for item in value]
+            return value
 
-    return related_links_element
+        return {field: plain(getattr(self, field)) for field in self.__slots__
+                if getattr(self, field) is not None}
 
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()})"
 
-def add_topic_second_ex():
-    second_example_string = """<example id="example_02" rev="0" otherprops="no_output">
-      <title>Descriptive Example Title</title>
-      <codeblock outputclass="normalize-space">
-\\starttext
 
+class CommandRecord(Record):
+    # arguments is None for the light entries made while streaming or from the
+    # name index, which list their donors instead. variant_id is only set for
+    # variants, whose topics sit next to the topic of the command they vary.
+    __slots__ = ('name', 'is_system', 'category', 'variant', 'keywords', 'filename',
+                 'arguments', 'stanza_hash', 'options1_count', 'settings1_count', 'donors',
+                 'variant_id')
 
 
-\\stoptext
-      </codeblock>
-    </example>"""
-    second_example_comment = etree.Comment(second_example_string)
-    return second_example_comment
+class ArgumentRecord(Record):
+    __slots__ = ('type', 'delimiters', 'optional',
+                 'name', 'count', 'children')
 
 
-def add_topic_mwe():
-    mwe_string = """
-    <example id="mwe" rev="0" otherprops="no_output">
-      <title>Minimal Working Example</title>
-      <codeblock outputclass="normalize-space">
-\\starttext
+class ValueRecord(Record):
+    # An option, or a key of a setting: simple, argument or inherit
+    __slots__ = ('type', 'text', 'default', 'donor', 'donor_id')
 
 
+class SettingRecord(Record):
+    # A setting with keys, or inherited whole
+    __slots__ = ('name', 'type', 'keys', 'donor', 'donor_id')
 
-\\stoptext
-      </codeblock>
-    </example>"""
-    mwe_element = etree.fromstring(mwe_string)
-    return mwe_element
 
+# Only for making records: the model holds on to the records it uses, so the
+# table is emptied once an interface is decoded, and every
+# SHARED_RECORDS_WINDOW stanzas while streaming
+shared_records = {}
 
-def add_topic_notes():
-    notes_comment_string = """<section id="notes">
-      <title>Notes</title>
-      <p></p>
-    </section>"""
-    notes_comment = etree.Comment(notes_comment_string)
-    return notes_comment
+SHARED_RECORDS_WINDOW = 256
 
 
-def add_topic_refbody_settings(argument_data):
+def clear_shared_records():
+    shared_records.clear()
 
-    settings_donors = set()
-    options_donors = set()
 
-    settings_section_element = etree.Element(
-        'section', id=argument_data['name'])
+def share_record(record_class, *values):
+    key = (record_class,) + values
 
-    title_element = etree.Element('title')
-    title_element.text = "Settings"
-    settings_section_element.append(title_element)
+    record = shared_records.get(key)
+    if record is None:
+        record = shared_records[key] = record_class(
+            *[sys.intern(value) if type(value) is str else value for value in values])
 
-    settings_table_element = etree.Element(
-        'table', frame="all", rowsep="1", colsep="1")
+    return record
 
-    # We need a tgroup for each child
 
-    for c in argument_data['children']:
-        if c['type'] == 'keys':
-            # We have a set of keys to process
-            table_group_element = etree.Element('tgroup', cols="2")
-            table_group_element.append(etree.Element(
-                'colspec', colname="value_name", colnum="1", colwidth="1*"))
-            table_group_element.append(etree.Element(
-                'colspec', colname="value_desc", colnum="2", colwidth="1*"))
+def share_tuple(items):
+    items = tuple(items)
+    return shared_records.setdefault(items, items)
 
-            table_head_element = etree.Element('thead')
 
-            table_head_first_row_element = etree.Element('row')
+# --- Decoding Arguments ---
 
-            for k in c['keys']:
-                if k['type'] == "inherit":
-                    table_head_title_entry = etree.Element(
-                        'entry', namest="value_name", nameend="value_desc")
-                    table_head_title_entry.text = f"{c['name']}"
-                    ph_element = etree.Element('ph')
-                    ph_element.text = " (Inherits from "
-                    xref_element = etree.Element(
-                        'xref', keyref=f"command_{k['donor']}")
-                    xref_element.tail = ")"
-                    ph_element.append(xref_element)
-                    table_head_title_entry.append(ph_element)
-                    break
-            else:
-                table_head_title_entry = etree.Element(
-                    'entry', namest="value_name", nameend="value_desc")
-                table_head_title_entry.text = c['name']
+# Each child of cd:arguments is decoded through ARGUMENT_DECODERS, keyed by tag:
+# the kind of argument it is, the delimiters it always has (None to take them
+# from the element, or brackets), and how its children are decoded. New ConTeXt
+# argument kinds only need an entry here.
 
-            table_head_first_row_element.append(table_head_title_entry)
+# Tags the registries have no entry for, counted rather than logged each time,
+# with the source line where each was first seen
+unknown_argument_tags = Counter()
+unknown_argument_lines = {}
 
-            table_head_element.append(table_head_first_row_element)
 
-            table_head_second_row_string = """<row>
-              <entry>Value</entry>
-              <entry>Description</entry>
-            </row>"""
+def note_unknown_tag(element):
+    if element.tag not in unknown_argument_lines:
+        unknown_argument_lines[element.tag] = element.sourceline
+    unknown_argument_tags[element.tag] += 1
 
-            table_head_second_row_element = etree.fromstring(
-                table_head_second_row_string)
 
-            table_head_element.append(table_head_second_row_element)
+def report_unknown_argument_tags():
+    for tag, count in unknown_argument_tags.most_common():
+        logger.warning("Found unknown argument tag %s %s time(s), first on line %s",
+                       tag, count, unknown_argument_lines[tag])
 
-            table_group_element.append(table_head_element)
 
-            table_body_element = etree.Element('tbody')
+def decode_constant(value):
+    # A simple value, or an argument when typed as cd:...
 
-            for k in c['keys']:
+    value_type = value.get('type')
 
-                if k['type'] == "inherit":
-                    options_donors.add(k['donor'])
-                    donor_set.add(k['donor'])
+    if value_type.startswith("cd:"):
+        return share_record(ValueRecord, "argument", value_type[3:].upper(), value.get('default') == 'yes')
 
-                    # print("## Donor Data:")
-                    # pp = pprint.PrettyPrinter(indent=2)
-                    # pp.pprint(commands_dict[c['donor']])
+    return share_record(ValueRecord, "simple", value_type, value.get('default') == 'yes')
 
-                    if commands_dict[k['donor']]['options1_count'] == 1:
-                        inheritance_element_string = f'''<row conkeyref="command_{k['donor']}/options1_entry">
-                      <entry></entry>
-                    </row>
-                    '''
-                    elif commands_dict[k['donor']]['options1_count'] > 1:
-                        inheritance_element_string = f'''<row conkeyref="command_{k['donor']}/options1_start" conrefend="default.dita#default/options1_stop">
-                      <entry></entry>
-                    </row>
-                    '''
-                    else:
-                        logger.warn(
-                            f"Trying to inherit options from {k['donor']}, but donor has no count.")
 
-                    table_row_element = etree.fromstring(
-                        inheritance_element_string)
+def decode_options_inherit(value):
+    donor = value.get('name')
+    donor_set.add(donor)
+    return share_record(ValueRecord, "inherit", None, False, donor, "options1")
 
-                elif k['type'] == "argument":
-                    table_row_element = etree.Element('row')
-                    keyword_entry_element = etree.Element('entry')
-                    argument_name_element = etree.Element(
-                        'xref', keyref=k['text'], type="reference")
-                    keyword_entry_element.append(argument_name_element)
-                    table_row_element.append(keyword_entry_element)
 
-                    keyword_desc_element = etree.Element('entry')
-                    argument_desc_element = etree.Element(
-                        'ph', conkeyref=f"{k['text']}/argument_desc")
-                    keyword_desc_element.append(argument_desc_element)
-                    table_row_element.append(keyword_desc_element)
+def decode_settings_inherit(value):
+    donor = value.get('name')
+    donor_set.add(donor)
+    return share_record(SettingRecord, donor, "inherit", None, donor, "settings1")
 
-                elif k['type'] == "simple":
-                    table_row_element = etree.Element('row')
-                    keyword_entry_element = etree.Element('entry')
-                    keyword_entry_element.text = k['text']
-                    table_row_element.append(keyword_entry_element)
-                    keyword_desc_element = etree.Element('entry', rev="0")
-                    keyword_desc_element.text = ""
-                    table_row_element.append(keyword_desc_element)
 
-                else:
-                    logger.debug(f"Unknown keytype of key type: {k['type']}")
+def decode_parameter(value):
+    return share_record(SettingRecord, value.get('name'), "keys", generate_settings_keys(value))
 
-                if 'default' in k and k['default'] == True:
-                    table_row_element.attrib['importance'] = "default"
 
-                table_body_element.append(table_row_element)
+def decode_children(argument, decoders):
+    children = []
 
-            table_group_element.append(table_body_element)
+    for value in argument:
+        decoder = decoders.get(value.tag)
+        if decoder is None:
+            note_unknown_tag(value)
+            continue
+        children.append(decoder(value))
 
-        elif c['type'] == 'inherit':
-            # We are pulling in a settings set
-            settings_donors.add(c['donor'])
-            donor_set.add(c['donor'])
+    return share_tuple(children)
 
-            # print("## Donor Data:")
-            # pp = pprint.PrettyPrinter(indent=2)
-            # pp.pprint(commands_dict[c['donor']])
 
-            if commands_dict[c['donor']]['settings1_count'] > 1:
-                multigroup_inherit_string = f"""<tgroup conkeyref="command_{c['donor']}/settings1_start" conrefend="default.dita#default/settings1_stop" cols="2">
-                        <colspec/>
-                        <colspec/>
-                        <thead>
-                            <row>
-                                <entry></entry>
-                            </row>
-                        </thead>
-                        <tbody>
-                            <row>
-                                <entry></entry>
-                            </row>
-                        </tbody>
-                    </tgroup>"""
-                table_group_element = etree.fromstring(
-                    multigroup_inherit_string)
-            elif commands_dict[c['donor']]['settings1_count'] == 1:
-                singlegroup_inherit_string = f"""<tgroup conkeyref="command_{c['donor']}/settings1_entry" cols="2">
-                        <colspec/>
-                        <colspec/>
-                        <thead>
-                            <row>
-                                <entry></entry>
-                            </row>
-                        </thead>
-                        <tbody>
-                            <row>
-                                <entry></entry>
-                            </row>
-                        </tbody>
-                    </tgroup>"""
-                table_group_element = etree.fromstring(
-                    singlegroup_inherit_string)
+# Option values and settings keys are each an inheritance, a simple value, or an
+# argument; settings are inherited as a whole or are a parameter with keys
+OPTION_DECODERS = {
+    CD + "constant": decode_constant,
+    CD + "inherit": decode_options_inherit,
+}
 
-        settings_table_element.append(table_group_element)
+SETTING_DECODERS = {
+    CD + "parameter": decode_parameter,
+    CD + "inherit": decode_settings_inherit,
+}
 
-    settings_section_element.append(settings_table_element)
 
-    if len(settings_table_element) > 1:
-        settings_table_element[0].attrib['id'] = f"{argument_data['name']}_start"
-        settings_table_element[-1].attrib['id'] = f"{argument_data['name']}_stop"
-    elif len(settings_table_element) == 1:
-        settings_table_element[0].attrib['id'] = f"{argument_data['name']}_entry"
+def generate_settings_keys(argument):
+    return decode_children(argument, OPTION_DECODERS)
 
-    for donor in settings_donors:
-        # donor_xref_element = etree.Element(
-        #     'xref', href=f"../../{get_command_url(donor)}")
-        donor_xref_element = etree.Element(
-            'xref', keyref=f"command_{donor}")
-        donor_xref_element.tail = "."
-        note_element = etree.Element('note')
-        note_element.text = "Inherits settings from "
-        note_element.append(donor_xref_element)
-        settings_section_element.append(note_element)
 
-    for donor in options_donors:
-        # donor_xref_element = etree.Element(
-        #     'xref', href=f"../../{get_command_url(donor)}")
-        donor_xref_element = etree.Element(
-            'xref', keyref=f"command_{donor}")
-        donor_xref_element.tail = "."
-        note_element = etree.Element('note')
-        note_element.text = "Inherits options from "
-        note_element.append(donor_xref_element)
-        settings_section_element.append(note_element)
+def generate_settings(argument):
+    return decode_children(argument, SETTING_DECODERS)
 
-    return settings_section_element
 
+def generate_options(argument):
+    return decode_children(argument, OPTION_DECODERS)
+
+
+def get_keywords_kind(argument):
+    # A lone typed constant, e.g. <cd:constant type="cd:name"/>, is an argument
+    # of that type rather than a list of options
+    if len(argument) == 1 and argument[0].get('type', "").startswith("cd:"):
+        return argument[0].get('type')[3:].upper()
+    return "OPTIONS"
+
+
+ARGUMENT_DECODERS = {
+    CD + "keywords": {'kind': get_keywords_kind, 'delimiters': None, 'children': generate_options},
+    CD + "assignments": {'kind': "SETTINGS", 'delimiters': None, 'children': generate_settings},
+    CD + "csname": {'kind': "COMMAND", 'delimiters': None, 'children': None},
+    CD + "content": {'kind': "SCOPE", 'delimiters': "braces", 'children': None},
+    CD + "delimiter": {'kind': "DELIMITER", 'delimiters': "none", 'children': None},
+    CD + "dimension": {'kind': "DIMENSION", 'delimiters': None, 'children': None},
+    CD + "triplet": {'kind': "TRIPLET", 'delimiters': None, 'children': None},
+    CD + "position": {'kind': "POSITION", 'delimiters': None, 'children': None},
+    CD + "string": {'kind': "STRING", 'delimiters': None, 'children': None},
+    CD + "angles": {'kind': "ANGLES", 'delimiters': None, 'children': None},
+    CD + "template": {'kind': "TEMPLATE", 'delimiters': None, 'children': None},
+    CD + "apply": {'kind': "APPLY", 'delimiters': None, 'children': None},
+    CD + "text": {'kind': "TEXT", 'delimiters': None, 'children': None},
+    CD + "index": {'kind': "INDEX", 'delimiters': None, 'children': None},
+}
+
+# Kinds whose arguments are numbered and have their children decoded
+# (options1, settings1, ...)
+NUMBERED_ARGUMENT_KINDS = ("OPTIONS", "SETTINGS")
 
-def add_topic_refbody_options(argument_data):
 
-    options_donors = set()
+def is_argument_optional(arg):
+    return arg.get('optional') == 'yes'
 
-    options_section_element = etree.Element(
-        'section', id=argument_data['name'])
 
-    title_element = etree.Element('title')
-    title_element.text = "Options"
-    options_section_element.append(title_element)
+def get_argument_delimiters(arg):
+    delim_type = arg.get('delimiters')
 
-    options_table_element = etree.Element(
-        'table', frame="all", rowsep="1", colsep="1", id=f"{argument_data['name']}_table")
+    if delim_type is None:
+        delim_type = "brackets"
 
-    table_group_element = etree.Element('tgroup', cols="2")
+    return delim_type
 
-    table_group_element.append(etree.Element(
-        'colspec', colname="value_name", colnum="1", colwidth="1*"))
-    table_group_element.append(etree.Element(
-        'colspec', colname="value_desc", colnum="2", colwidth="1*"))
 
-    table_head_string = """<thead>
-            <row>
-              <entry>Keyword</entry>
-              <entry>Description</entry>
-            </row>
-          </thead>"""
+def get_argument_type(arg):
+    # Unknown tags are noted when the arguments are decoded, not here
+    decoder = ARGUMENT_DECODERS.get(arg.tag)
 
-    table_group_element.append(etree.fromstring(table_head_string))
+    if decoder is None:
+        return None
 
-    table_body_element = etree.Element('tbody')
+    kind = decoder['kind']
+    if callable(kind):
+        kind = kind(arg)
 
-    for c in argument_data['children']:
-        if c['type'] == "inherit":
-            options_donors.add(c['donor'])
-            donor_set.add(c['donor'])
+    return kind
 
-            # print("## Donor Data:")
-            # pp = pprint.PrettyPrinter(indent=2)
-            # pp.pprint(commands_dict[c['donor']])
 
-            if commands_dict[c['donor']]['options1_count'] == 1:
-                inheritance_element_string = f'''<row conkeyref="command_{c['donor']}/options1_entry">
-              <entry></entry>
-            </row>
-            '''
-            elif commands_dict[c['donor']]['options1_count'] > 1:
-                inheritance_element_string = f'''<row conkeyref="command_{c['donor']}/options1_start" conrefend="default.dita#default/options1_stop">
-              <entry></entry>
-            </row>
-            '''
-            else:
-                logger.warn(
-                    f"Trying to inherit options from {c['donor']}, but donor has no count.")
+def decode_argument(argument, kind_counts):
+    # kind_counts holds how many arguments of each numbered kind came before
+    # this one, and is updated
 
-            table_row_element = etree.fromstring(inheritance_element_string)
+    decoder = ARGUMENT_DECODERS.get(argument.tag)
 
-        elif c['type'] == "argument":
-            table_row_element = etree.Element('row')
-            keyword_entry_element = etree.Element('entry')
-            argument_name_element = etree.Element(
-                'xref', keyref=c['text'], type="reference")
-            keyword_entry_element.append(argument_name_element)
-            table_row_element.append(keyword_entry_element)
+    if decoder is None:
+        note_unknown_tag(argument)
+        kind = None
+        delimiters = get_argument_delimiters(argument)
+    else:
+        kind = decoder['kind']
+        if callable(kind):
+            kind = kind(argument)
+        delimiters = decoder['delimiters'] or get_argument_delimiters(
+            argument)
 
-            keyword_desc_element = etree.Element('entry')
-            argument_desc_element = etree.Element(
-                'ph', conkeyref=f"{c['text']}/argument_desc")
-            keyword_desc_element.append(argument_desc_element)
-            table_row_element.append(keyword_desc_element)
+    name = None
+    count = None
+    children = None
 
-        elif c['type'] == "simple":
-            table_row_element = etree.Element('row')
-            keyword_entry_element = etree.Element('entry')
-            keyword_entry_element.text = c['text']
-            table_row_element.append(keyword_entry_element)
-            keyword_desc_element = etree.Element('entry', rev="0")
-            keyword_desc_element.text = ""
-            table_row_element.append(keyword_desc_element)
+    if kind == "DELIMITER":
+        name = argument.get('name')
 
-        if 'default' in c and c['default'] == True:
-            table_row_element.attrib['importance'] = "default"
+    if kind in NUMBERED_ARGUMENT_KINDS:
+        kind_counts[kind] += 1
+        name = f"{kind.lower()}{kind_counts[kind]}"
+        count = len(argument)
+        children = decoder['children'](argument)
 
-        table_body_element.append(table_row_element)
+    return share_record(ArgumentRecord, kind, delimiters,
+                        is_argument_optional(argument), name, count, children)
 
-    if len(table_body_element.getchildren()) > 1:
-        table_body_element[0].attrib['id'] = f"{argument_data['name']}_start"
-        table_body_element[-1].attrib['id'] = f"{argument_data['name']}_stop"
-    elif len(table_body_element.getchildren()) == 1:
-        table_body_element[0].attrib['id'] = f"{argument_data['name']}_entry"
 
-    table_group_element.append(table_body_element)
+def generate_args_data(args_tree):
+    args_list = []
 
-    options_table_element.append(table_group_element)
+    kind_counts = Counter()
 
-    options_section_element.append(options_table_element)
+    for args in args_tree:
 
-    for donor in options_donors:
-        # donor_xref_element = etree.Element(
-        #     'xref', href=f"../../{get_command_url(donor)}")
-        donor_xref_element = etree.Element(
-            'xref', keyref=f"command_{donor}")
-        donor_xref_element.tail = "."
-        note_element = etree.Element('note')
-        note_element.text = "Inherits options from "
-        note_element.append(donor_xref_element)
-        options_section_element.append(note_element)
+        for argument in args:
+            args_list.append(decode_argument(argument, kind_counts))
 
-    return options_section_element
+    return share_tuple(args_list)
 
 
-def add_topic_refbody_refsyn_simpletable_row(this_argument):
-    row_element = etree.Element('strow')
+# --- Functions to manage the command data ---
 
-    name_entry_element = etree.Element('stentry')
-    desc_entry_element = etree.Element('stentry')
-    vals_entry_element = etree.Element('stentry')
+def generate_stanza_data(command_stanza, args=None):
+    # Everything about a command that comes from its stanza rather than its
+    # name, so that the commands of a class or environment can share it.
+    # Arguments already decoded (for a variant) are used as they are.
 
-    argument_name_element = etree.Element(
-        'xref', keyref=this_argument['type'], type="reference")
-    name_entry_element.append(argument_name_element)
+    keywords = []
 
-    argument_desc_element = etree.Element(
-        'ph', conkeyref=f"{this_argument['type']}/argument_desc")
-    desc_entry_element.append(argument_desc_element)
+    try:
+        command_level = command_stanza.get('level')
+    except:
+        command_level = "UNKNOWN"
 
-    if this_argument['type'] == "OPTIONS":
-        # This is the complicated one; we want to actually include a short list of options here
+    if command_level == "system":
+        command_is_system = True
+    else:
+        command_is_system = False
 
-        vals_entry_element = etree.Element('stentry')
-        current_element = vals_entry_element
-        current_element.text = ""
-        in_tail = False
+    try:
+        reported_category = command_stanza.get('category')
+    except:
+        reported_category = False
 
-        for c in this_argument['children']:
-            if 'type' in c and c['type'] == "inherit":
-                # Set upthe translcusion, then return the whole row element
-                row_element = etree.Element(
-                    'strow', conkeyref=f"command_{c['donor']}/short_options1", id=f"short_{this_argument['name']}")
-                row_element.append(etree.Element('stentry'))
-                row_element.append(etree.Element('stentry'))
-                row_element.append(etree.Element('stentry'))
-                return row_element
-            elif c['default'] == True and c['type'] == "argument":
-                argument_name_element = etree.Element(
-                    'xref', keyref=c['text'], type="reference")
-                default_phrase = etree.Element('ph', importance="default")
-                default_phrase.append(argument_name_element)
-                vals_entry_element.append(default_phrase)
-                current_element = default_phrase
-                current_element.tail = ", "
-                in_tail = True
-            elif c['type'] == "argument":
-                argument_name_element = etree.Element(
-                    'xref', keyref=c['text'], type="reference")
-                vals_entry_element.append(argument_name_element)
-                current_element = argument_name_element
-                current_element.tail = ", "
-                in_tail = True
-            elif c['default'] == True:
-                default_phrase = etree.Element('ph', importance="default")
-                default_phrase.text = c['text']
-                current_element = default_phrase
-                current_element.tail = ", "
-                in_tail = True
-            else:
-                if in_tail:
-                    current_element.tail += f"{c['text']}, "
-                else:
-                    current_element.text += f"{c['text']}, "
+    if reported_category:
+        for kw in reported_category.split():
+            keywords.append(sys.intern(kw))
 
-        # Get rid of trailing comma
-        if in_tail:
-            current_element.tail = current_element.tail[:-2]
-        else:
-            current_element.text = current_element.text[:-2]
+    try:
+        source_filename = command_stanza.get('file')
+    except:
+        source_filename = "UNKNOWN"
 
-        row_element.set('id', f'short_{this_argument["name"]}')
+    try:
+        command_variant = command_stanza.get('variant')
+    except:
+        command_variant = ""
 
-        if vals_entry_element != current_element:
-            vals_entry_element.append(current_element)
+    if args is None:
+        try:
+            args_tree = command_stanza.xpath('cd:arguments', namespaces=NSMAP)
+        except:
+            args_tree = []
 
-        # Add link to section
-        xref_element = etree.Element(
-            'xref', href=f"#./{this_argument['name']}")
-        xref_element.text = " (See options table for details.)"
-        vals_entry_element.append(xref_element)
+        args = generate_args_data(args_tree)
 
-    elif this_argument['type'] == "SETTINGS":
-        xref_element = etree.Element(
-            'xref', href=f"#./{this_argument['name']}")
-        xref_element.text = " (See settings table for details.)"
-        vals_entry_element.append(xref_element)
+    # Plain data only, so that the model can be cached and the tree freed
+    stanza_data = {
+        'is_system': command_is_system,
+        'category': command_level,
+        'variant': command_variant,
+        'keywords': share_tuple(keywords),
+        'filename': source_filename,
+        'arguments': args,
+        'stanza_hash': get_stanza_hash(command_stanza),
+    }
 
-    elif this_argument['type'] == "DELIMITER":
-        vals_entry_element.text = "\\" + this_argument['name']
+    for arg in args:
+        if arg.name == 'options1':
+            stanza_data['options1_count'] = arg.count
+        if arg.name == 'settings1':
+            stanza_data['settings1_count'] = arg.count
 
-    else:
-        argument_vals_element = etree.Element(
-            'ph', conkeyref=f"{this_argument['type']}/argument_value")
-        vals_entry_element.append(argument_vals_element)
+    return stanza_data
 
-    row_element.append(name_entry_element)
-    row_element.append(desc_entry_element)
-    row_element.append(vals_entry_element)
 
-    return row_element
+def generate_command_data(
+        command_name, command_stanza, stanza_data=None):
+    # The decoded arguments are shared, not copied, between the commands made
+    # from one stanza; nothing downstream changes them
 
+    if stanza_data is None:
+        stanza_data = generate_stanza_data(command_stanza)
 
-def add_topic_refbody_refsyn_simpletable(topic_data):
-    simpletable_element = etree.Element('simpletable')
+    return CommandRecord(name=command_name, **stanza_data)
 
-    simpletable_header_string = """
-                    <sthead>
-          <stentry>Argument</stentry>
-          <stentry>Description</stentry>
-          <stentry>Values</stentry>
-        </sthead>"""
 
-    simpletable_element.append(etree.fromstring(simpletable_header_string))
+def get_command_donors(command_data):
+    # Every command this one pulls options or settings from via cd:inherit
 
-    for this_argument in topic_data['arguments']:
-        simpletable_element.append(
-            add_topic_refbody_refsyn_simpletable_row(this_argument))
+    if command_data.arguments is None:
+        # A light entry from scan_interface
+        return set(command_data.donors)
 
-    return simpletable_element
+    donors = set()
 
+    for arg in command_data.arguments:
+        for c in arg.children or ():
+            if c.type == "inherit":
+                donors.add(c.donor)
+            elif c.type == "keys":
+                for k in c.keys:
+                    if k.type == "inherit":
+                        donors.add(k.donor)
 
-def add_topic_refbody_refsyn_synph_var(this_argument):
+    return donors
 
-    if this_argument['optional']:
-        var_element = etree.Element('var', importance="optional")
+
+def list_of_commands(tr, nsp):
+    root = tr.getroot()
+
+    pred = f'cd:interface/cd:command'
+
+    all_commands = root.xpath(pred, namespaces=nsp)
+
+    result = []
+
+    for c in all_commands:
+        result.append(c)
+
+    return result
+
+
+def add_command(command_name, stanza, commands_dict, with_arguments=True, stanza_data=None):
+    logger.debug(
+        " COMMAND - Adding command for %s...(arguments: %s)", command_name, with_arguments)
+
+    if command_name in commands_dict:
+        logger.debug(
+            "Warning! Attempting to clobber entry for %s!", command_name)
     else:
-        var_element = etree.Element('var')
+        commands_dict[command_name] = generate_command_data(
+            command_name, stanza, stanza_data)
 
-    if this_argument['type'] == 'DELIMITER':
-        var_element.text = "\\" + this_argument['name']
-    elif this_argument['type'] == 'OPTIONS':
-        var_element.set('id', f"synvar_{this_argument['name']}")
-        var_element.text = this_argument['type']
-    elif this_argument['type'] == 'SETTINGS':
-        var_element.set('id', f"synvar_{this_argument['name']}")
-        var_element.text = this_argument['type']
+
+def get_environment_command_names(stem, stanza):
+
+    if 'begin' in stanza.attrib:
+        env_start_string = stanza.attrib['begin']
     else:
-        var_element.text = this_argument['type']
+        env_start_string = "start"
 
-    return var_element
+    if 'end' in stanza.attrib:
+        env_stop_string = stanza.attrib['end'].encode(
+            "ascii", errors="ignore").decode()
+    else:
+        env_stop_string = "stop"
 
+    return env_start_string + stem, env_stop_string + stem
 
-def add_delimiter(type, chirality="left"):
-    delimiter_element = etree.Element('delim')
 
-    if type == 'parenthesis':
-        if chirality == 'left':
-            delimiter_element.text = "("
-        if chirality == 'right':
-            delimiter_element.text = ")"
-    elif type == 'braces':
-        if chirality == 'left':
-            delimiter_element.text = "{"
-        if chirality == 'right':
-            delimiter_element.text = "}"
-    elif type == 'brackets':
-        if chirality == 'left':
-            delimiter_element.text = "["
-        if chirality == 'right':
-            delimiter_element.text = "]"
+def get_class_instance_names(stanza):
+
+    # Do we have a pattern
+
+    sequence_elements = stanza.xpath(
+        'cd:sequence/*', namespaces=NSMAP)
+
+    # if stanza_name == "placefloat":
+    #     print(f"{stanza_name} sequence is {sequence_elements}")
+
+    stem_seen = False
+    prefix = ""
+    default_stem = ""
+    postfix = ""
+
+    for sequence_element in sequence_elements:
+        # print(f"{stanza_name} sequence tag is {sequence_element.tag}")
+        if sequence_element.tag == "{http://www.pragma-ade.com/commands}string" and stem_seen == False:
+            prefix = sequence_element.get('value')
+        elif sequence_element.tag == "{http://www.pragma-ade.com/commands}instance":
+            default_stem = sequence_element.get('value')
+            stem_seen = True
+        elif sequence_element.tag == "{http://www.pragma-ade.com/commands}string" and stem_seen == True:
+            postfix = sequence_element.get('value')
+
+    instances = stanza.xpath(
+        'cd:instances/cd:constant/@value', namespaces=NSMAP)
+
+    return [prefix + instance_name + postfix for instance_name in instances]
+
+
+def add_environment(stanza_name, stanza, environments_list, commands_dict, relations_list):
+
+    environment_relations = {}
+    environment_relations['stem'] = stanza_name
+    environment_relations['members'] = []
+
+    logger.debug(
+        " ENVIRON - Starting on environment %s...", stanza_name)
+
+    start_command_name, stop_command_name = get_environment_command_names(
+        stanza_name, stanza)
+
+    stanza_data = generate_stanza_data(stanza)
+
+    logger.debug(
+        " ENVIRON - For the environment %s, generating %s, %s", stanza_name, start_command_name, stop_command_name)
+    add_command(start_command_name, stanza, commands_dict,
+                stanza_data=stanza_data)
+    environment_relations['members'].append(start_command_name)
+    add_command(stop_command_name, stanza, commands_dict,
+                with_arguments=False, stanza_data=stanza_data)
+    environment_relations['members'].append(stop_command_name)
+
+    relations_list.append(environment_relations)
+    if stanza_name not in environments_list:
+        environments_list.append(stanza_name)
+
+
+def add_class(stanza_name, stanza, classes_list,
+              environments_list, commands_dict, relations_list):
+
+    class_relations = {}
+    class_relations['name'] = stanza_name
+    class_relations['instances'] = []
+
+    logger.debug(
+        "   CLASS - Starting on class %s...", stanza_name)
+
+    # First, do we have an environment
+    try:
+        stanza_type = stanza.attrib['type']
+    except:
+        stanza_type = False
+
+    instances = get_class_instance_names(stanza)
+
+    # Decoded once, however many instances the class has
+    stanza_data = generate_stanza_data(stanza)
+
+    if stanza_type == "environment":
+        # Process each instance as an environment
+        logger.debug(
+            "CLASSENV - For the class %s, generating environment", stanza_name)
+        environment_relations = {}
+        environment_relations['stem'] = stanza_name
+        environment_relations['members'] = []
+
+        for instance_name in instances:
+            # add_environment(instance_name, stanza,
+            #                 environments_dict, commands_dict, relations_list)
+
+            logger.debug(
+                "CLASSENV - Starting on environment %s in class %s...", instance_name, stanza_name)
+
+            start_command_name, stop_command_name = get_environment_command_names(
+                instance_name, stanza)
+
+            logger.debug(
+                " ENVIRON - For the environment %s, generating %s, %s", stanza_name, start_command_name, stop_command_name)
+            add_command(start_command_name, stanza, commands_dict,
+                        stanza_data=stanza_data)
+            environment_relations['members'].append(start_command_name)
+            add_command(stop_command_name, stanza,
+                        commands_dict, with_arguments=False, stanza_data=stanza_data)
+            environment_relations['members'].append(stop_command_name)
+
+        class_relations['instances'].append(environment_relations)
+
     else:
-        delimiter_element.text = "?"
+        # Process each instance as a command
 
-    return delimiter_element
+        for instance_name in instances:
+            add_command(instance_name, stanza, commands_dict,
+                        stanza_data=stanza_data)
+            class_relations['instances'].append(instance_name)
 
+        logger.debug(
+            "   CLASS - For the class %s, generated %s", stanza_name, LazyJoin(instances))
 
-def add_topic_refbody_refsyn_synph(topic_data):
+    relations_list.append(class_relations)
+    if stanza_name not in classes_list:
+        classes_list.append(stanza_name)
 
-    synph_element = etree.Element('synph')
 
-    synph_element.text = f"\\{topic_data['name']} "
+# --- Dealing with Variants ---
 
-    for this_argument in topic_data['arguments']:
-        if this_argument['delimiters'] != "none":
-            synph_element.append(add_delimiter(
-                this_argument['delimiters'], 'left'))
+# A variant stanza (variant="example", "assignment", "name" and so on) is another
+# form of a command, class or environment whose base stanza has the same name.
+# Most of a variant's arguments are the same as its base's, so only the ones that
+# differ are decoded; the others are the base command's records. Variants are
+# grouped by the base command they belong to, and each gets a topic of its own
+# next to the base command's topic.
 
-        synph_element.append(
-            add_topic_refbody_refsyn_synph_var(this_argument))
+def get_variant_id(variant_type):
+    # For IDs and filenames: instance:assignment becomes instance_assignment
+    return variant_type.replace(":", "_")
 
-        if this_argument['delimiters'] != "none":
-            synph_element.append(add_delimiter(
-                this_argument['delimiters'], 'right'))
 
-    return synph_element
+def get_topic_name(command_data):
+    # The command name, and for a variant its type after it, as in
+    # r_command_definecolor_name
 
+    if command_data.variant_id is None:
+        return command_data.name
 
-def add_topic_refbody_refsyn(topic_data):
-    refsyn_element = etree.Element('refsyn', id="syntax")
+    return f"{command_data.name}_{command_data.variant_id}"
 
-    title_element = etree.Element('title')
-    title_element.text = "Syntax"
-    refsyn_element.append(title_element)
 
-    # The refsyn_synph show the syntax of the command
-    refsyn_element.append(add_topic_refbody_refsyn_synph(topic_data))
+# The variant topic names of each command, for the links from its topic to its
+# variants. Set with the inheritance index, from the scan when streaming, so
+# that it is complete before any topic is written.
+variant_topic_names = {}
 
-    # The refsyn_table lists and describes the elements of the synph
-    if len(topic_data['arguments']) > 0:
-        refsyn_element.append(add_topic_refbody_refsyn_simpletable(topic_data))
 
-    return refsyn_element
+def get_variant_topic_names(variants_dict):
+    return {command_name: [get_topic_name(variant_data) for variant_data in variants]
+            for command_name, variants in variants_dict.items()}
+
+
+def get_base_stanza_key(stanza_name, stanza):
+    # Environment variants vary the environment, everything else the command or
+    # class of the same name
+    return stanza_name, stanza.get('type') == "environment"
+
+
+def elements_equal(first, second):
+    # Same tags, attributes and children, ignoring text and whitespace
+
+    if first.tag != second.tag or len(first) != len(second):
+        return False
+
+    if dict(first.attrib) != dict(second.attrib):
+        return False
+
+    return all(elements_equal(first_child, second_child)
+               for first_child, second_child in zip(first, second))
+
+
+def generate_variant_args_data(args_tree, base_args_tree, base_args):
+    # Arguments that are the same as the base's, at the same place and with the
+    # same number, are taken from the base rather than decoded
+
+    base_arguments = [argument for args in base_args_tree for argument in args]
+
+    args_list = []
+    kind_counts = Counter()
+    reused_count = 0
+
+    for position, argument in enumerate(argument for args in args_tree for argument in args):
+        if position < len(base_arguments) and elements_equal(argument, base_arguments[position]):
+            base_argument = base_args[position]
+
+            if base_argument.type not in NUMBERED_ARGUMENT_KINDS:
+                args_list.append(base_argument)
+                reused_count += 1
+                continue
+
+            number = kind_counts[base_argument.type] + 1
+            if base_argument.name == f"{base_argument.type.lower()}{number}":
+                kind_counts[base_argument.type] = number
+                args_list.append(base_argument)
+                reused_count += 1
+                continue
+
+        args_list.append(decode_argument(argument, kind_counts))
+
+    return share_tuple(args_list), reused_count
+
+
+def generate_variant_stanza_data(command_stanza, base_stanza=None, base_data=None):
+    args_tree = command_stanza.xpath('cd:arguments', namespaces=NSMAP)
+
+    if base_stanza is None or base_data is None or base_data.arguments is None:
+        args = generate_args_data(args_tree)
+        reused_count = 0
+    else:
+        args, reused_count = generate_variant_args_data(
+            args_tree, base_stanza.xpath('cd:arguments', namespaces=NSMAP), base_data.arguments)
+
+    logger.debug(
+        " VARIANT - %s of %s arguments of %s (%s) taken from the base", reused_count, len(args), command_stanza.get('name'), command_stanza.get('variant'))
+
+    stanza_data = generate_stanza_data(command_stanza, args)
+    stanza_data['variant_id'] = get_variant_id(stanza_data['variant'])
+
+    return stanza_data
+
+
+def generate_variant_data(command_name, command_stanza, stanza_data=None):
+    if stanza_data is None:
+        stanza_data = generate_variant_stanza_data(command_stanza)
+
+    return CommandRecord(name=command_name, **stanza_data)
+
+
+def process_variant(stanza_name, stanza, commands_dict, variants_dict, base_stanzas=None):
+    # base_stanzas maps get_base_stanza_key to each base stanza and its type;
+    # without it (or without the base's arguments, when streaming) the
+    # variant is decoded in full
+
+    variant_type = stanza.get('variant')
+
+    logger.debug(
+        " VARIANT - Adding variant for %s with type %s...", stanza_name, variant_type)
+
+    if stanza.get('type') == "environment":
+        command_names = get_environment_command_names(stanza_name, stanza)
+    else:
+        command_names = [stanza_name]
+
+    base_stanza = None
+    base_data = None
+
+    if base_stanzas is not None:
+        base_stanza, base_type = base_stanzas.get(
+            get_base_stanza_key(stanza_name, stanza), (None, None))
+
+    if base_stanza is not None:
+        base_names = get_stanza_command_names(
+            stanza_name, base_type, base_stanza)
+        if base_names:
+            base_data = commands_dict.get(base_names[0])
+
+    # The start and stop of an environment share the decoded data, just as they
+    # do in add_environment
+    stanza_data = generate_variant_stanza_data(stanza, base_stanza, base_data)
+
+    for command_name in command_names:
+        variants = variants_dict.setdefault(command_name, [])
+
+        if any(variant.variant_id == stanza_data['variant_id'] for variant in variants):
+            logger.debug(
+                "Warning! Attempting to clobber %s variant of %s!", variant_type, command_name)
+            continue
+
+        variants.append(generate_variant_data(
+            command_name, stanza, stanza_data))
+
+
+def get_stanza_type(stanza):
+
+    # We are looking for one of three types of stanzas, and an escape case:
+    #
+    # CLASSES
+    #
+    # These stanzas describe sets of related commands that share setups. Commands can be added
+    # to the set by the user with an appropraite \define command
+    #
+    # variant="instance" AND instance child AND non-zero instances
+    #
+    # ENVIRONMENTS
+    #
+    # This imply at base a pair of commands, a stem with a prefix for the begining of the environment
+    # and a prefix for the end
+    #
+    # type=environment
+    #
+    # COMMANDS
+    #
+    # Everything else that doesn't have a strange variant attribute (we wan the command manual to
+    # document extant commands the user might encounter, not things that are as yet unimplemented)
+    #
+    # (everything else except unhandled variants)
+    #
+    # UNHANDLED VARIANTS
+    #
+    # ...get reported, but no commands are created?
+
+    # We want the return values from here to be sufficient to disambiguate any collisions
+
+    try:
+        variant_type = stanza.attrib['variant']
+    except:
+        variant_type = False
+
+    try:
+        stanza_type = stanza.attrib['type']
+    except:
+        stanza_type = False
+
+    try:
+        environment_prefix = stanza.attrib['begin']
+    except:
+        environment_prefix = False
+
+    try:
+        stanza_name = stanza.attrib['name']
+    except:
+        logger.debug(
+            "ENONAME: No name found in the folllowing stanza:\n\n%s\n\n", LazyXML(stanza))
+        return "ENONAME", "variant", variant_type, environment_prefix
+
+    if stanza_name.encode(
+            "ascii", errors="ignore").decode() == "":
+        # we have no name to work with, bail out
+        logger.debug(
+            "EEMPTYNAME: Empty name found in the folllowing stanza:\n\n%s\n\n", LazyXML(stanza))
+        return "EEMPTYNAME", "variant", variant_type, environment_prefix
+
+    has_instances = stanza.xpath(
+        'boolean(cd:instances/cd:constant)', namespaces=NSMAP)
+
+    if variant_type == "instance" and has_instances:
+        return stanza_name, "class", variant_type, environment_prefix
+    elif stanza_type == "environment" and variant_type == False:
+        return stanza_name, "environment", variant_type, environment_prefix
+    elif variant_type == False:
+        return stanza_name, "command", variant_type, environment_prefix
+    else:
+        return stanza_name, "variant", variant_type, environment_prefix
+
+
+# some stanzas appear twice in the interface, and cannot be disambiguated:
+INTERFACE_DUPLICATES = {
+    'thinspace',
+    'monobold',
+    'xmlregisterns',
+    'defineinterlinespace',
+    'setupinterlinespace',
+    'setuplocalinterlinespace',
+    'switchtointerlinespace',
+    'dosetupcheckedinterlinespace',
+    'useinterlinespaceparameter',
+    'definelinefiller',
+    'setuplinefiller',  # Second one has global added, as of 2020-07-05
+    'setuplinefillers',
+    'startlinefiller',
+    'stoplinefiller',
+    'setlinefiller',
+    'starttexcode',
+    'stoptexcode',
+}
+
+
+# --- Stanza Index ---
+
+# Every stanza in the interface, keyed by what get_stanza_type says about it,
+# (name, stanza type, variant, begin prefix), and its type attribute, which
+# tells a class of environments from a class of commands. Secondary indexes
+# hold the sets of keys by name, source file and level. process_interface_tree
+# (or scan_interface, when streaming) fills in stanza_index, and a second stanza
+# with a key already seen is recorded as a collision. Nothing looks stanzas up
+# while streaming, so scan_interface leaves the secondary indexes out.
+
+# What get_stanza_type calls stanzas without a usable name
+STANZA_NAME_ERRORS = ("ENONAME", "EEMPTYNAME")
+
+
+def new_stanza_index(lookups=True):
+    if not lookups:
+        return {'by_key': {}, 'collisions': []}
+
+    return {'by_key': {}, 'by_name': {}, 'by_file': {}, 'by_level': {}, 'collisions': []}
+
+
+stanza_index = new_stanza_index()
+
+
+def add_to_stanza_index(index, stanza, stanza_key):
+    index_key = stanza_key + (stanza.get('type'),)
+
+    record = {
+        'key': index_key,
+        'file': stanza.get('file'),
+        'level': stanza.get('level'),
+        'sourceline': stanza.sourceline,
+    }
+
+    if stanza_key[0] in STANZA_NAME_ERRORS:
+        return record
+
+    if index_key in index['by_key']:
+        index['collisions'].append((index['by_key'][index_key], record))
+        return record
+
+    index['by_key'][index_key] = record
+
+    if 'by_name' not in index:
+        return record
+
+    index['by_name'].setdefault(stanza_key[0], set()).add(index_key)
+    index['by_file'].setdefault(record['file'], set()).add(index_key)
+    index['by_level'].setdefault(record['level'], set()).add(index_key)
+
+    return record
+
+
+def set_stanza_index(index):
+    stanza_index.clear()
+    stanza_index.update(index)
+
+
+def find_stanzas(name=None, file=None, level=None):
+    # The records of every stanza matching all of the given fields
+
+    key_sets = []
+    if name is not None:
+        key_sets.append(stanza_index['by_name'].get(name, set()))
+    if file is not None:
+        key_sets.append(stanza_index['by_file'].get(file, set()))
+    if level is not None:
+        key_sets.append(stanza_index['by_level'].get(level, set()))
+
+    if not key_sets:
+        keys = stanza_index['by_key']
+    else:
+        keys = set.intersection(*key_sets)
+
+    return sorted((stanza_index['by_key'][key] for key in keys),
+                  key=lambda record: record['sourceline'] or 0)
+
+
+def report_stanza_collisions(index):
+    known_count = 0
+
+    for first, duplicate in index['collisions']:
+        stanza_name, stanza_type, variant_type, environment_prefix, type_attribute = duplicate['key']
+        if stanza_name in INTERFACE_DUPLICATES or "start" + stanza_name in INTERFACE_DUPLICATES:
+            known_count += 1
+            log = logger.debug
+        else:
+            log = logger.warning
+        log("Collision for command %s with type %s (Variant:%s) (Env Prefix: %s) on lines %s and %s",
+            stanza_name, stanza_type, variant_type, environment_prefix, first['sourceline'], duplicate['sourceline'])
+
+    if len(index['collisions']) > known_count:
+        report(
+            f"Stanza index: {len(index['collisions'])} collisions, {known_count} of them known duplicates; see the log.")
+
+
+def process_stanza(command_stanza, commands_dict, classes_list, environments_list, relations_list, stanza_key=None,
+                   variants_dict=None, base_stanzas=None):
+
+    if stanza_key is None:
+        stanza_key = get_stanza_type(command_stanza)
+
+    stanza_name, stanza_type, variant_type, environment_prefix = stanza_key
+
+    # print(
+    #     f"Found command {stanza_name} with type {stanza_type} (Variant:{variant_type}) (Env Prefix: {environment_prefix})")
+
+    if is_known_duplicate(stanza_name, commands_dict):
+        return
+
+    if stanza_type == "class":
+        add_class(stanza_name, command_stanza, classes_list,
+                  environments_list, commands_dict, relations_list)
+    elif stanza_type == "environment":
+        add_environment(
+            stanza_name, command_stanza, environments_list, commands_dict, relations_list)
+    elif stanza_type == "command":
+        add_command(stanza_name, command_stanza, commands_dict)
+    elif stanza_type == "variant" and variants_dict is not None and stanza_name not in STANZA_NAME_ERRORS:
+        process_variant(stanza_name, command_stanza,
+                        commands_dict, variants_dict, base_stanzas)
+
+
+def is_known_duplicate(stanza_name, commands_dict):
+    # A stanza in INTERFACE_DUPLICATES whose command is already made
+
+    if stanza_name in commands_dict and stanza_name in INTERFACE_DUPLICATES:
+        logger.debug(
+            "     DUP - Found duplicate stanza for command %s", stanza_name)
+        return True
+
+    if "start" + stanza_name in commands_dict and "start" + stanza_name in INTERFACE_DUPLICATES:
+        logger.debug(
+            "     DUP - Found duplicate environment stanza for command %s", stanza_name)
+        return True
+
+    return False
+
+
+def process_interface_tree(ft):
+    """Use the complete interface XML file to prepare dictionaries of commands:
+    one of commands (style, document, and system) and one of variants.
+    """
+
+    logger.debug("### Processing interface tree.")
+
+    classes_list = []
+    commands_dict = {}
+    environments_list = []
+    variants_dict = {}
+    relations_list = []
+
+    interface_commands = list_of_commands(ft, NSMAP)
+
+    index = new_stanza_index()
+    stanza_keys = []
+    structure = {'stanza_names': [], 'stanza_types': [], 'command_names': []}
+
+    for command_stanza in interface_commands:
+        stanza_keys.append(get_stanza_type(command_stanza))
+        add_to_stanza_index(index, command_stanza, stanza_keys[-1])
+        structure['stanza_names'].append(stanza_keys[-1][0])
+        structure['stanza_types'].append(stanza_keys[-1][1])
+        structure['command_names'].append(get_stanza_command_names(
+            stanza_keys[-1][0], stanza_keys[-1][1], command_stanza))
+
+    set_stanza_index(index)
+    set_interface_structure(structure)
+
+    # Variants come after every base stanza has been decoded, as a variant can
+    # come before its base in the file
+    base_stanzas = {}
+    variant_stanzas = []
+
+    for command_stanza, stanza_key in zip(interface_commands, stanza_keys):
+        if stanza_key[1] == "variant":
+            variant_stanzas.append((command_stanza, stanza_key))
+            continue
+
+        base_stanzas.setdefault(get_base_stanza_key(
+            stanza_key[0], command_stanza), (command_stanza, stanza_key[1]))
+
+        process_stanza(command_stanza, commands_dict, classes_list,
+                       environments_list, relations_list, stanza_key)
+
+    for command_stanza, stanza_key in variant_stanzas:
+        process_stanza(command_stanza, commands_dict, classes_list,
+                       environments_list, relations_list, stanza_key,
+                       variants_dict, base_stanzas)
+
+    clear_shared_records()
+
+    # Run back through the dict of commands stems, and add to the child list any
+    # command that has the environment as a stem of common forms
+
+    # env_related_dict = generate_env_related_dict(
+    #     env_related_dict, commands_dict)
+
+    return commands_dict, variants_dict, classes_list, environments_list, relations_list
+
+
+def add_supporting_env_commands(relations_list, commands_dict):
+
+    transformation_map = {
+        'definefloats': 'definefloat',
+        'setupfloats': 'setupfloat',
+        'definebox': 'definehbox',
+        'definectxfunction': 'installctxfunction',
+        'definectxfunctiondefinition':  'startctxfunctiondefintion',
+        'definefence': 'definemathfence',
+        'definelabel': 'definelabelclass',
+        'definelanguage': 'installlanguage',
+        'definesynonym': 'definesynonyms',
+        'definesorts': 'definesorting',
+        'definesection': 'definehead',
+        'setupsection': 'setuphead',
+    }
+
+    for relation in relations_list:
+        if 'stem' in relation:
+            setup_command = "setup" + relation['stem']
+            if setup_command in commands_dict:
+                relation['members'].append(setup_command)
+
+            define_command = "define" + relation['stem']
+            if define_command in transformation_map:
+                logger.debug(
+                    "#### Transforming %s to %s", define_command, transformation_map[define_command])
+                define_command = transformation_map[define_command]
+            if define_command in commands_dict:
+                relation['members'].append(define_command)
+
+        if 'name' in relation:
+            setup_command = "setup" + relation['name']
+            if setup_command in commands_dict:
+                relation['instances'].append(setup_command)
+
+            define_command = "define" + relation['name']
+            if define_command in transformation_map:
+                logger.debug(
+                    "#### Transforming %s to %s", define_command, transformation_map[define_command])
+                define_command = transformation_map[define_command]
+            if define_command in commands_dict:
+                relation['instances'].append(define_command)
+
+            for instance in relation['instances']:
+                # Instances of a class of commands are just their names
+                if isinstance(instance, dict) and 'stem' in instance:
+                    setup_command = "setup" + instance['stem']
+                    if setup_command in commands_dict:
+                        instance['members'].append(setup_command)
+
+                    define_command = "define" + instance['stem']
+                    if define_command in transformation_map:
+                        logger.debug(
+                            "#### Transforming %s to %s", define_command, transformation_map[define_command])
+                        define_command = transformation_map[define_command]
+
+                    if define_command in commands_dict:
+                        instance['members'].append(define_command)
+
+    return relations_list
+
+# --- Streaming the Interface ---
+
+# For inputs too large to hold in memory at once, stanzas can be read one at a
+# time. A first, light pass collects what topic generation needs to know about
+# commands it has not reached yet (donor counts and which commands exist); the
+# second pass builds and writes each topic, then frees the stanza.
+
+def iter_interface_stanzas(input_file):
+    context = etree.iterparse(
+        str(input_file), events=('end',), tag=CD_COMMAND_TAG)
+
+    for event, stanza in context:
+        interface = stanza.getparent()
+
+        # Only cd:interface/cd:interface/cd:command, as in list_of_commands
+        if (interface is None or interface.tag != CD_INTERFACE_TAG
+                or interface.getparent() is None
+                or interface.getparent().getparent() is not None):
+            continue
+
+        yield stanza
+
+        # Drop the stanza and everything before it
+        stanza.clear(keep_tail=True)
+        while stanza.getprevious() is not None:
+            del interface[0]
+        while interface.getprevious() is not None:
+            del interface.getparent()[0]
+
+    del context
+
+
+def get_stanza_command_names(stanza_name, stanza_type, stanza):
+    # The names of the commands add_class, add_environment or add_command
+    # would create for this stanza
+
+    if stanza_type == "class":
+        instances = get_class_instance_names(stanza)
+        if stanza.get('type') == "environment":
+            command_names = []
+            for instance_name in instances:
+                command_names.extend(
+                    get_environment_command_names(instance_name, stanza))
+            return command_names
+        return instances
+    elif stanza_type == "environment":
+        return list(get_environment_command_names(stanza_name, stanza))
+    elif stanza_type == "command":
+        return [stanza_name]
+    else:
+        return []
+
+
+def get_stanza_summary(stanza):
+    # Just enough of generate_command_data for other commands to refer to
+
+    summary = {
+        'is_system': stanza.get('level') == "system",
+        'stanza_hash': get_stanza_hash(stanza),
+    }
+
+    for argument in stanza.xpath('cd:arguments/*', namespaces=NSMAP):
+        argument_type = get_argument_type(argument)
+        if argument_type == "OPTIONS" and 'options1_count' not in summary:
+            summary['options1_count'] = len(argument)
+        elif argument_type == "SETTINGS" and 'settings1_count' not in summary:
+            summary['settings1_count'] = len(argument)
+
+    # Plain strings, as lxml's would keep their cd:inherit elements alive after
+    # the stanza is freed; and mostly the one shared empty tuple
+    summary['donors'] = tuple(sorted(set(stanza.xpath(
+        'cd:arguments//cd:inherit/@name', namespaces=NSMAP, smart_strings=False))))
+
+    return summary
+
+
+def scan_interface(input_file):
+    """Make light dictionaries of every command and variant in the interface
+    file, holding no XML, for use by topic generation while streaming.
+    """
+
+    logger.debug("### Scanning interface file.")
+
+    commands_dict = {}
+    variants_dict = {}
+    scanned_variants = []
+    index = new_stanza_index(lookups=False)
+
+    for stanza in iter_interface_stanzas(input_file):
+        stanza_name, stanza_type, variant_type, environment_prefix = get_stanza_type(
+            stanza)
+
+        add_to_stanza_index(index, stanza, (stanza_name, stanza_type,
+                            variant_type, environment_prefix))
+
+        if stanza_type == "variant":
+            # Only their donors matter before they are decoded, and, as in
+            # process_interface_tree, they wait for every base stanza
+            if stanza_name not in STANZA_NAME_ERRORS:
+                scanned_variants.append(scan_variant(stanza_name, stanza, variant_type))
+            continue
+
+        command_names = [name for name in get_stanza_command_names(stanza_name, stanza_type, stanza)
+                         if name not in commands_dict]
+
+        if not command_names:
+            continue
+
+        summary = get_stanza_summary(stanza)
+
+        for command_name in command_names:
+            commands_dict[command_name] = CommandRecord(
+                name=command_name, **summary)
+
+    for stanza_name, command_names, variant_id, summary in scanned_variants:
+        if is_known_duplicate(stanza_name, commands_dict):
+            continue
+
+        for command_name in command_names:
+            variants = variants_dict.setdefault(command_name, [])
+            if all(variant.variant_id != variant_id for variant in variants):
+                variants.append(CommandRecord(
+                    name=command_name, variant_id=variant_id, **summary))
+
+    set_stanza_index(index)
+
+    return commands_dict, variants_dict
+
+
+def scan_variant(stanza_name, stanza, variant_type):
+    # The names process_variant would give the stanza's variant topics, and
+    # the light summary of each
+
+    if stanza.get('type') == "environment":
+        command_names = get_environment_command_names(stanza_name, stanza)
+    else:
+        command_names = [stanza_name]
+
+    return stanza_name, command_names, get_variant_id(variant_type), get_stanza_summary(stanza)
+
+
+# --- Inheritance Index ---
+
+# Built once from the whole command model before any topic is generated, so that
+# topics can be built in any order: for each donor, the fragment IDs inheritors
+# point their conkeyrefs at; for each inheritor, the commands it inherits from
+# directly, which get_transitive_donors follows when the whole chain is wanted.
+# Donors that don't exist and inheritance cycles are found here rather than part
+# way through generation.
+
+inheritance_index = {'donors': {}, 'inheritors': {}, 'missing': {}, 'cycles': []}
+
+
+def get_donor_fragment_id(kind, count):
+    # options1_entry for a single row or tgroup, options1_start for a range
+
+    if count == 1:
+        return f"{kind}1_entry"
+    elif count > 1:
+        return f"{kind}1_start"
+    else:
+        return None
+
+
+def find_inheritance_cycles(direct_donors):
+    cycles = []
+    state = {}
+
+    for start in sorted(direct_donors):
+        if start in state:
+            continue
+
+        # Iterative depth first search; state is "open" while on the path
+        path = [start]
+        state[start] = "open"
+        pending = [iter(sorted(direct_donors[start]))]
+
+        while pending:
+            donor = next(pending[-1], None)
+            if donor is None:
+                state[path.pop()] = "done"
+                pending.pop()
+            elif state.get(donor) == "open":
+                cycles.append(path[path.index(donor):] + [donor])
+            elif donor not in state and donor in direct_donors:
+                path.append(donor)
+                state[donor] = "open"
+                pending.append(iter(sorted(direct_donors[donor])))
+
+    return cycles
+
+
+def get_transitive_donors(name, direct_donors):
+    seen = set()
+    pending = list(direct_donors.get(name, ()))
+
+    while pending:
+        donor = pending.pop()
+        if donor in seen:
+            continue
+        seen.add(donor)
+        pending.extend(direct_donors.get(donor, ()))
+
+    seen.discard(name)
+
+    return sorted(seen)
+
+
+def build_inheritance_index(commands_dict, variants_dict=None):
+    # Variants inherit like the commands they vary, but nothing inherits from
+    # them; they are listed under their topic names
+
+    direct_donors = {}
+
+    for command_name, command_data in commands_dict.items():
+        donors = get_command_donors(command_data)
+        if donors:
+            direct_donors[command_name] = tuple(sorted(donors))
+
+    for variants in (variants_dict or {}).values():
+        for variant_data in variants:
+            donors = get_command_donors(variant_data)
+            if donors:
+                direct_donors[get_topic_name(variant_data)] = tuple(sorted(donors))
+
+    index = {'donors': {}, 'inheritors': direct_donors, 'missing': {}, 'cycles': []}
+
+    for command_name, donors in direct_donors.items():
+        for donor in donors:
+            if donor not in commands_dict:
+                index['missing'].setdefault(donor, []).append(command_name)
+                continue
+
+            if donor not in index['donors']:
+                donor_data = commands_dict[donor]
+                options_count = donor_data.options1_count or 0
+                settings_count = donor_data.settings1_count or 0
+                index['donors'][donor] = {
+                    'options1_count': options_count,
+                    'settings1_count': settings_count,
+                    'options_fragment': get_donor_fragment_id("options", options_count),
+                    'settings_fragment': get_donor_fragment_id("settings", settings_count),
+                }
+
+    for inheritors in index['missing'].values():
+        inheritors.sort()
+
+    index['cycles'] = find_inheritance_cycles(direct_donors)
+
+    return index
+
+
+def report_inheritance_problems(index):
+    for donor, inheritors in sorted(index['missing'].items()):
+        logger.warning("Missing donor %s, inherited from by %s",
+                       donor, LazyJoin(inheritors))
+
+    for cycle in index['cycles']:
+        logger.warning("Inheritance cycle: %s", " -> ".join(cycle))
+
+    if index['missing'] or index['cycles']:
+        report(
+            f"Inheritance: {len(index['missing'])} missing donor(s), {len(index['cycles'])} cycle(s); see the log.")
+
+
+def get_donor_fragment(donor, kind):
+    # The fragment ID to conkeyref for a donor's options or settings, or None
+    # if it has nothing to inherit
+
+    donor_entry = inheritance_index['donors'].get(donor)
+
+    if donor_entry is None:
+        return None
+
+    return donor_entry[f"{kind}_fragment"]
+
+
+# --- Fragment Library ---
+
+# Static pieces of DITA that every topic needs. Each template is parsed once, the
+# first time it is asked for, and copies are handed out from then on. Attributes
+# given as placeholders (conkeyref="") keep their place when filled in.
+
+FRAGMENT_TEMPLATES = {
+    'related_links': """
+    <related-links>
+      <link href="" scope="external" format="html">
+        <linktext>Command definition in the <ph conkeyref="definitions/product_name"/> source file  <filepath></filepath></linktext>
+      </link>
+    </related-links>""",
+    'mwe': """
+    <example id="mwe" rev="0" otherprops="no_output">
+      <title>Minimal Working Example</title>
+      <codeblock outputclass="normalize-space">
+\\starttext
+
+
+
+\\stoptext
+      </codeblock>
+    </example>""",
+    'prodinfo': """
+            <prodinfo>
+        <prodname>ConTeXt</prodname>
+          <vrmlist>
+            <vrm version="iv" release="production" modification=""/>
+          </vrmlist>
+        </prodinfo>""",
+    'options_thead': """<thead>
+            <row>
+              <entry>Keyword</entry>
+              <entry>Description</entry>
+            </row>
+          </thead>""",
+    'settings_thead_row': """<row>
+              <entry>Value</entry>
+              <entry>Description</entry>
+            </row>""",
+    'simpletable_thead': """
+                    <sthead>
+          <stentry>Argument</stentry>
+          <stentry>Description</stentry>
+          <stentry>Values</stentry>
+        </sthead>""",
+    'conbody': """<conbody>
+    <section>
+      <p></p>
+    </section>
+  </conbody>
+    """,
+    'options_inherit_entry_row': """<row conkeyref="">
+              <entry></entry>
+            </row>
+            """,
+    'options_inherit_range_row': """<row conkeyref="" conrefend="default.dita#default/options1_stop">
+              <entry></entry>
+            </row>
+            """,
+    'settings_key_inherit_entry_row': """<row conkeyref="">
+                      <entry></entry>
+                    </row>
+                    """,
+    'settings_key_inherit_range_row': """<row conkeyref="" conrefend="default.dita#default/options1_stop">
+                      <entry></entry>
+                    </row>
+                    """,
+    'settings_inherit_range_tgroup': """<tgroup conkeyref="" conrefend="default.dita#default/settings1_stop" cols="2">
+                        <colspec/>
+                        <colspec/>
+                        <thead>
+                            <row>
+                                <entry></entry>
+                            </row>
+                        </thead>
+                        <tbody>
+                            <row>
+                                <entry></entry>
+                            </row>
+                        </tbody>
+                    </tgroup>""",
+    'settings_inherit_entry_tgroup': """<tgroup conkeyref="" cols="2">
+                        <colspec/>
+                        <colspec/>
+                        <thead>
+                            <row>
+                                <entry></entry>
+                            </row>
+                        </thead>
+                        <tbody>
+                            <row>
+                                <entry></entry>
+                            </row>
+                        </tbody>
+                    </tgroup>""",
+}
+
+# Commented-out sections, for authors to fill in by hand
+FRAGMENT_COMMENTS = {
+    'second_example': """<example id="example_02" rev="0" otherprops="no_output">
+      <title>Descriptive Example Title</title>
+      <codeblock outputclass="normalize-space">
+\\starttext
+
+
+
+\\stoptext
+      </codeblock>
+    </example>""",
+    'notes': """<section id="notes">
+      <title>Notes</title>
+      <p></p>
+    </section>""",
+}
+
+fragment_cache = {}
+
+
+def get_fragment(fragment_name, **attributes):
+    try:
+        template = fragment_cache[fragment_name]
+    except KeyError:
+        if fragment_name in FRAGMENT_COMMENTS:
+            template = etree.Comment(FRAGMENT_COMMENTS[fragment_name])
+        else:
+            template = etree.fromstring(FRAGMENT_TEMPLATES[fragment_name])
+        fragment_cache[fragment_name] = template
+
+    fragment = copy.deepcopy(template)
+
+    for attribute, value in attributes.items():
+        fragment.set(attribute, value)
+
+    return fragment
+
+
+# --- Topic Building Functions ---
+
+
+def add_topic_rellinks(topic_data):
+    related_links_element = get_fragment('related_links')
+
+    related_links_element[0].set(
+        'href', f"{SOURCE_BASE_URL}{topic_data.filename}")
+    related_links_element.find('.//filepath').text = f"{topic_data.filename}"
+
+    add_variant_links(related_links_element, topic_data)
+
+    return related_links_element
+
+
+def add_variant_links(related_links_element, topic_data):
+    if topic_data.variant_id is not None:
+        # Back to the command this is a variant of
+        add_variant_link(related_links_element, topic_data.name)
+        return
+
+    for topic_name in variant_topic_names.get(topic_data.name, ()):
+        add_variant_link(related_links_element, topic_name)
+
+
+def add_variant_link(related_links_element, topic_name):
+    # The fragment's own whitespace stops pretty printing from indenting the
+    # link, so it takes the indent of the first link, and the last link's tail
+    # (before the closing tag) moves on to it
+
+    link_element = etree.Element('link', keyref=f"command_{topic_name}")
+
+    last_link = related_links_element[-1]
+    link_element.tail = last_link.tail
+    last_link.tail = related_links_element.text
+
+    related_links_element.append(link_element)
+
+
+def add_topic_second_ex():
+    return get_fragment('second_example')
+
+
+def add_topic_mwe():
+    return get_fragment('mwe')
+
+
+def add_topic_notes():
+    return get_fragment('notes')
+
+
+def add_topic_refbody_settings(argument_data):
+
+    settings_donors = set()
+    options_donors = set()
+
+    settings_section_element = etree.Element(
+        'section', id=argument_data.name)
+
+    title_element = etree.Element('title')
+    title_element.text = "Settings"
+    settings_section_element.append(title_element)
+
+    settings_table_element = etree.Element(
+        'table', frame="all", rowsep="1", colsep="1")
+
+    # We need a tgroup for each child
+
+    for c in argument_data.children:
+        if c.type == 'keys':
+            # We have a set of keys to process
+            table_group_element = etree.Element('tgroup', cols="2")
+            table_group_element.append(etree.Element(
+                'colspec', colname="value_name", colnum="1", colwidth="1*"))
+            table_group_element.append(etree.Element(
+                'colspec', colname="value_desc", colnum="2", colwidth="1*"))
+
+            table_head_element = etree.Element('thead')
+
+            table_head_first_row_element = etree.Element('row')
+
+            for k in c.keys:
+                if k.type == "inherit":
+                    table_head_title_entry = etree.Element(
+                        'entry', namest="value_name", nameend="value_desc")
+                    table_head_title_entry.text = f"{c.name}"
+                    ph_element = etree.Element('ph')
+                    ph_element.text = " (Inherits from "
+                    xref_element = etree.Element(
+                        'xref', keyref=f"command_{k.donor}")
+                    xref_element.tail = ")"
+                    ph_element.append(xref_element)
+                    table_head_title_entry.append(ph_element)
+                    break
+            else:
+                table_head_title_entry = etree.Element(
+                    'entry', namest="value_name", nameend="value_desc")
+                table_head_title_entry.text = c.name
+
+            table_head_first_row_element.append(table_head_title_entry)
+
+            table_head_element.append(table_head_first_row_element)
+
+            table_head_element.append(get_fragment('settings_thead_row'))
+
+            table_group_element.append(table_head_element)
+
+            table_body_element = etree.Element('tbody')
+
+            for k in c.keys:
+
+                if k.type == "inherit":
+                    options_donors.add(k.donor)
+                    donor_set.add(k.donor)
+
+                    # print("## Donor Data:")
+                    # pp = pprint.PrettyPrinter(indent=2)
+                    # pp.pprint(commands_dict[c.donor])
+
+                    fragment_id = get_donor_fragment(k.donor, "options")
+
+                    if fragment_id is None:
+                        logger.warning(
+                            "Trying to inherit options from %s, but donor has no count.", k.donor)
+                        continue
+                    elif fragment_id == "options1_entry":
+                        table_row_element = get_fragment(
+                            'settings_key_inherit_entry_row', conkeyref=f"command_{k.donor}/{fragment_id}")
+                    else:
+                        table_row_element = get_fragment(
+                            'settings_key_inherit_range_row', conkeyref=f"command_{k.donor}/{fragment_id}")
+
+                elif k.type == "argument":
+                    table_row_element = etree.Element('row')
+                    keyword_entry_element = etree.Element('entry')
+                    argument_name_element = etree.Element(
+                        'xref', keyref=k.text, type="reference")
+                    keyword_entry_element.append(argument_name_element)
+                    table_row_element.append(keyword_entry_element)
+
+                    keyword_desc_element = etree.Element('entry')
+                    argument_desc_element = etree.Element(
+                        'ph', conkeyref=f"{k.text}/argument_desc")
+                    keyword_desc_element.append(argument_desc_element)
+                    table_row_element.append(keyword_desc_element)
+
+                elif k.type == "simple":
+                    table_row_element = etree.Element('row')
+                    keyword_entry_element = etree.Element('entry')
+                    keyword_entry_element.text = k.text
+                    table_row_element.append(keyword_entry_element)
+                    keyword_desc_element = etree.Element('entry', rev="0")
+                    keyword_desc_element.text = ""
+                    table_row_element.append(keyword_desc_element)
+
+                else:
+                    logger.debug("Unknown keytype of key type: %s", k.type)
+
+                if k.default:
+                    table_row_element.attrib['importance'] = "default"
+
+                table_body_element.append(table_row_element)
+
+            table_group_element.append(table_body_element)
+
+        elif c.type == 'inherit':
+            # We are pulling in a settings set
+            settings_donors.add(c.donor)
+            donor_set.add(c.donor)
+
+            # print("## Donor Data:")
+            # pp = pprint.PrettyPrinter(indent=2)
+            # pp.pprint(commands_dict[c.donor])
+
+            fragment_id = get_donor_fragment(c.donor, "settings")
+
+            if fragment_id is None:
+                logger.warning(
+                    "Trying to inherit settings from %s, but donor has no count.", c.donor)
+                continue
+            elif fragment_id == "settings1_entry":
+                table_group_element = get_fragment(
+                    'settings_inherit_entry_tgroup', conkeyref=f"command_{c.donor}/{fragment_id}")
+            else:
+                table_group_element = get_fragment(
+                    'settings_inherit_range_tgroup', conkeyref=f"command_{c.donor}/{fragment_id}")
+
+        settings_table_element.append(table_group_element)
+
+    settings_section_element.append(settings_table_element)
+
+    if len(settings_table_element) > 1:
+        settings_table_element[0].attrib['id'] = f"{argument_data.name}_start"
+        settings_table_element[-1].attrib['id'] = f"{argument_data.name}_stop"
+    elif len(settings_table_element) == 1:
+        settings_table_element[0].attrib['id'] = f"{argument_data.name}_entry"
+
+    for donor in sorted(settings_donors):
+        # donor_xref_element = etree.Element(
+        #     'xref', href=f"../../{get_command_url(donor)}")
+        donor_xref_element = etree.Element(
+            'xref', keyref=f"command_{donor}")
+        donor_xref_element.tail = "."
+        note_element = etree.Element('note')
+        note_element.text = "Inherits settings from "
+        note_element.append(donor_xref_element)
+        settings_section_element.append(note_element)
+
+    for donor in sorted(options_donors):
+        # donor_xref_element = etree.Element(
+        #     'xref', href=f"../../{get_command_url(donor)}")
+        donor_xref_element = etree.Element(
+            'xref', keyref=f"command_{donor}")
+        donor_xref_element.tail = "."
+        note_element = etree.Element('note')
+        note_element.text = "Inherits options from "
+        note_element.append(donor_xref_element)
+        settings_section_element.append(note_element)
+
+    return settings_section_element
+
+
+def add_topic_refbody_options(argument_data):
+
+    options_donors = set()
+
+    options_section_element = etree.Element(
+        'section', id=argument_data.name)
+
+    title_element = etree.Element('title')
+    title_element.text = "Options"
+    options_section_element.append(title_element)
+
+    options_table_element = etree.Element(
+        'table', frame="all", rowsep="1", colsep="1", id=f"{argument_data.name}_table")
+
+    table_group_element = etree.Element('tgroup', cols="2")
+
+    table_group_element.append(etree.Element(
+        'colspec', colname="value_name", colnum="1", colwidth="1*"))
+    table_group_element.append(etree.Element(
+        'colspec', colname="value_desc", colnum="2", colwidth="1*"))
+
+    table_group_element.append(get_fragment('options_thead'))
+
+    table_body_element = etree.Element('tbody')
+
+    for c in argument_data.children:
+        if c.type == "inherit":
+            options_donors.add(c.donor)
+            donor_set.add(c.donor)
+
+            # print("## Donor Data:")
+            # pp = pprint.PrettyPrinter(indent=2)
+            # pp.pprint(commands_dict[c.donor])
+
+            fragment_id = get_donor_fragment(c.donor, "options")
+
+            if fragment_id is None:
+                logger.warning(
+                    "Trying to inherit options from %s, but donor has no count.", c.donor)
+                continue
+            elif fragment_id == "options1_entry":
+                table_row_element = get_fragment(
+                    'options_inherit_entry_row', conkeyref=f"command_{c.donor}/{fragment_id}")
+            else:
+                table_row_element = get_fragment(
+                    'options_inherit_range_row', conkeyref=f"command_{c.donor}/{fragment_id}")
+
+        elif c.type == "argument":
+            table_row_element = etree.Element('row')
+            keyword_entry_element = etree.Element('entry')
+            argument_name_element = etree.Element(
+                'xref', keyref=c.text, type="reference")
+            keyword_entry_element.append(argument_name_element)
+            table_row_element.append(keyword_entry_element)
+
+            keyword_desc_element = etree.Element('entry')
+            argument_desc_element = etree.Element(
+                'ph', conkeyref=f"{c.text}/argument_desc")
+            keyword_desc_element.append(argument_desc_element)
+            table_row_element.append(keyword_desc_element)
+
+        elif c.type == "simple":
+            table_row_element = etree.Element('row')
+            keyword_entry_element = etree.Element('entry')
+            keyword_entry_element.text = c.text
+            table_row_element.append(keyword_entry_element)
+            keyword_desc_element = etree.Element('entry', rev="0")
+            keyword_desc_element.text = ""
+            table_row_element.append(keyword_desc_element)
+
+        if c.default:
+            table_row_element.attrib['importance'] = "default"
+
+        table_body_element.append(table_row_element)
+
+    if len(table_body_element.getchildren()) > 1:
+        table_body_element[0].attrib['id'] = f"{argument_data.name}_start"
+        table_body_element[-1].attrib['id'] = f"{argument_data.name}_stop"
+    elif len(table_body_element.getchildren()) == 1:
+        table_body_element[0].attrib['id'] = f"{argument_data.name}_entry"
+
+    table_group_element.append(table_body_element)
+
+    options_table_element.append(table_group_element)
+
+    options_section_element.append(options_table_element)
+
+    for donor in sorted(options_donors):
+        # donor_xref_element = etree.Element(
+        #     'xref', href=f"../../{get_command_url(donor)}")
+        donor_xref_element = etree.Element(
+            'xref', keyref=f"command_{donor}")
+        donor_xref_element.tail = "."
+        note_element = etree.Element('note')
+        note_element.text = "Inherits options from "
+        note_element.append(donor_xref_element)
+        options_section_element.append(note_element)
+
+    return options_section_element
+
+
+def add_topic_refbody_refsyn_simpletable_row(this_argument):
+    row_element = etree.Element('strow')
+
+    name_entry_element = etree.Element('stentry')
+    desc_entry_element = etree.Element('stentry')
+    vals_entry_element = etree.Element('stentry')
+
+    argument_name_element = etree.Element(
+        'xref', keyref=this_argument.type, type="reference")
+    name_entry_element.append(argument_name_element)
+
+    argument_desc_element = etree.Element(
+        'ph', conkeyref=f"{this_argument.type}/argument_desc")
+    desc_entry_element.append(argument_desc_element)
+
+    if this_argument.type == "OPTIONS":
+        # This is the complicated one; we want to actually include a short list of options here
+
+        vals_entry_element = etree.Element('stentry')
+        current_element = vals_entry_element
+        current_element.text = ""
+        in_tail = False
+
+        for c in this_argument.children:
+            if c.type == "inherit":
+                # Set upthe translcusion, then return the whole row element
+                row_element = etree.Element(
+                    'strow', conkeyref=f"command_{c.donor}/short_options1", id=f"short_{this_argument.name}")
+                row_element.append(etree.Element('stentry'))
+                row_element.append(etree.Element('stentry'))
+                row_element.append(etree.Element('stentry'))
+                return row_element
+            elif c.default and c.type == "argument":
+                argument_name_element = etree.Element(
+                    'xref', keyref=c.text, type="reference")
+                default_phrase = etree.Element('ph', importance="default")
+                default_phrase.append(argument_name_element)
+                vals_entry_element.append(default_phrase)
+                current_element = default_phrase
+                current_element.tail = ", "
+                in_tail = True
+            elif c.type == "argument":
+                argument_name_element = etree.Element(
+                    'xref', keyref=c.text, type="reference")
+                vals_entry_element.append(argument_name_element)
+                current_element = argument_name_element
+                current_element.tail = ", "
+                in_tail = True
+            elif c.default:
+                default_phrase = etree.Element('ph', importance="default")
+                default_phrase.text = c.text
+                current_element = default_phrase
+                current_element.tail = ", "
+                in_tail = True
+            else:
+                if in_tail:
+                    current_element.tail += f"{c.text}, "
+                else:
+                    current_element.text += f"{c.text}, "
+
+        # Get rid of trailing comma
+        if in_tail:
+            current_element.tail = current_element.tail[:-2]
+        else:
+            current_element.text = current_element.text[:-2]
+
+        row_element.set('id', f'short_{this_argument.name}')
+
+        if vals_entry_element != current_element:
+            vals_entry_element.append(current_element)
+
+        # Add link to section
+        xref_element = etree.Element(
+            'xref', href=f"#./{this_argument.name}")
+        xref_element.text = " (See options table for details.)"
+        vals_entry_element.append(xref_element)
+
+    elif this_argument.type == "SETTINGS":
+        xref_element = etree.Element(
+            'xref', href=f"#./{this_argument.name}")
+        xref_element.text = " (See settings table for details.)"
+        vals_entry_element.append(xref_element)
+
+    elif this_argument.type == "DELIMITER":
+        vals_entry_element.text = "\\" + this_argument.name
+
+    else:
+        argument_vals_element = etree.Element(
+            'ph', conkeyref=f"{this_argument.type}/argument_value")
+        vals_entry_element.append(argument_vals_element)
+
+    row_element.append(name_entry_element)
+    row_element.append(desc_entry_element)
+    row_element.append(vals_entry_element)
+
+    return row_element
+
+
+def add_topic_refbody_refsyn_simpletable(topic_data):
+    simpletable_element = etree.Element('simpletable')
+
+    simpletable_element.append(get_fragment('simpletable_thead'))
+
+    for this_argument in topic_data.arguments:
+        simpletable_element.append(
+            add_topic_refbody_refsyn_simpletable_row(this_argument))
+
+    return simpletable_element
+
+
+def add_topic_refbody_refsyn_synph_var(this_argument):
+
+    if this_argument.optional:
+        var_element = etree.Element('var', importance="optional")
+    else:
+        var_element = etree.Element('var')
+
+    if this_argument.type == 'DELIMITER':
+        var_element.text = "\\" + this_argument.name
+    elif this_argument.type == 'OPTIONS':
+        var_element.set('id', f"synvar_{this_argument.name}")
+        var_element.text = this_argument.type
+    elif this_argument.type == 'SETTINGS':
+        var_element.set('id', f"synvar_{this_argument.name}")
+        var_element.text = this_argument.type
+    else:
+        var_element.text = this_argument.type
+
+    return var_element
+
+
+def add_delimiter(type, chirality="left"):
+    delimiter_element = etree.Element('delim')
+
+    if type == 'parenthesis':
+        if chirality == 'left':
+            delimiter_element.text = "("
+        if chirality == 'right':
+            delimiter_element.text = ")"
+    elif type == 'braces':
+        if chirality == 'left':
+            delimiter_element.text = "{"
+        if chirality == 'right':
+            delimiter_element.text = "}"
+    elif type == 'brackets':
+        if chirality == 'left':
+            delimiter_element.text = "["
+        if chirality == 'right':
+            delimiter_element.text = "]"
+    else:
+        delimiter_element.text = "?"
+
+    return delimiter_element
+
+
+def add_topic_refbody_refsyn_synph(topic_data):
+
+    synph_element = etree.Element('synph')
+
+    synph_element.text = f"\\{topic_data.name} "
+
+    for this_argument in topic_data.arguments:
+        if this_argument.delimiters != "none":
+            synph_element.append(add_delimiter(
+                this_argument.delimiters, 'left'))
+
+        synph_element.append(
+            add_topic_refbody_refsyn_synph_var(this_argument))
+
+        if this_argument.delimiters != "none":
+            synph_element.append(add_delimiter(
+                this_argument.delimiters, 'right'))
+
+    return synph_element
+
+
+def add_topic_refbody_refsyn(topic_data):
+    refsyn_element = etree.Element('refsyn', id="syntax")
+
+    title_element = etree.Element('title')
+    title_element.text = "Syntax"
+    refsyn_element.append(title_element)
+
+    # The refsyn_synph show the syntax of the command
+    refsyn_element.append(add_topic_refbody_refsyn_synph(topic_data))
+
+    # The refsyn_table lists and describes the elements of the synph
+    if len(topic_data.arguments) > 0:
+        refsyn_element.append(add_topic_refbody_refsyn_simpletable(topic_data))
+
+    return refsyn_element
 
 
 def add_topic_refbody(topic_data):
     refbody_element = etree.Element('refbody')
 
-    refbody_element.append(add_topic_refbody_refsyn(topic_data))
+    refbody_element.append(add_topic_refbody_refsyn(topic_data))
+
+    for argument_data in topic_data.arguments:
+        if argument_data.type == 'OPTIONS':
+            refbody_element.append(add_topic_refbody_options(argument_data))
+        elif argument_data.type == 'SETTINGS':
+            refbody_element.append(add_topic_refbody_settings(argument_data))
+
+    refbody_element.append(add_topic_notes())
+    refbody_element.append(add_topic_mwe())
+    refbody_element.append(add_topic_second_ex())
+
+    return refbody_element
+
+
+def get_build_date():
+    # SOURCE_DATE_EPOCH as reproducible-builds.org defines it, else today
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+
+    if epoch is None:
+        return datetime.date.today()
+
+    try:
+        return datetime.datetime.fromtimestamp(int(epoch), datetime.timezone.utc).date()
+    except ValueError:
+        raise SystemExit(f"SOURCE_DATE_EPOCH is not a number of seconds: {epoch}")
+
+
+def get_review_days(topic_name):
+    # Spread over 120 to 240 days so that reviews do not all fall due at once
+    if reproducible_build:
+        return 120 + int(get_content_hash(topic_name)[:8], 16) % 120
+    return random.randrange(120, 240)
+
+
+def set_topic_dates(created_element, topic_name):
+    check_date = today + datetime.timedelta(days=get_review_days(topic_name))
+
+    created_element.set('date', f"{today.strftime('%Y-%m-%d')}")
+    created_element.set('expiry', f"{check_date.strftime('%Y-%m-%d')}")
+
+
+def add_topic_prolog(topic_data):
+
+    prolog_element = etree.Element('prolog')
+
+    # Source file (TODO: is this path reasonable?)
+
+    source_element = etree.Element('source')
+    source_element.text = f"tex/texmf-context/tex/context/base/mkiv/{topic_data.filename}"
+    prolog_element.append(source_element)
+
+    # Critical Dates
+
+    critdates_element = etree.Element('critdates')
+
+    created_element = etree.Element('created', date="", expiry="")
+    set_topic_dates(created_element, get_topic_name(topic_data))
+    critdates_element.append(created_element)
+
+    revised_comment = etree.Comment(
+        '<revised date="YYYY-MM-DD" expiry="YYYY-MM-DD"/>')
+    critdates_element.append(revised_comment)
+
+    prolog_element.append(critdates_element)
+
+    # Metadata
+
+    metadata_element = etree.Element('metadata')
+
+    if topic_data.is_system:
+        audience_element = etree.Element('audience', type="internal")
+    else:
+        audience_element = etree.Element('audience', type="user")
+    metadata_element.append(audience_element)
+
+    category_element = etree.Element('category')
+    category_element.text = topic_data.category
+    metadata_element.append(category_element)
+
+    keywords_element = etree.Element('keywords')
+    for kw in topic_data.keywords:
+        keyword_element = etree.Element('keyword')
+        keyword_element.text = kw
+        keywords_element.append(keyword_element)
+    metadata_element.append(keywords_element)
+
+    metadata_element.append(get_fragment('prodinfo'))
+
+    prolog_element.append(metadata_element)
+
+    return prolog_element
+
+
+def add_topic_shortdesc(topic_data):
+    cmdname_element = etree.Element('cmdname')
+    cmdname_element.text = f"\\{topic_data.name}"
+    if topic_data.variant_id is None:
+        cmdname_element.tail = " command..."
+    else:
+        cmdname_element.tail = f" command, {topic_data.variant} variant..."
+
+    shortdesc_element = etree.Element('shortdesc', rev='0')
+    shortdesc_element.text = "The "
+    shortdesc_element.append(cmdname_element)
+
+    return shortdesc_element
+
+
+def add_topic_title(topic_data):
+    title_element = etree.Element('title')
+    title_element.text = f"\\{topic_data.name}"
+    return title_element
+
+
+def build_dita_topic(topic_data):
+    topic = etree.Element(
+        'reference', id=f"r_command_{get_topic_name(topic_data)}")
+
+    topic.set(XML_LANG, output_lang)
+
+    topic.append(add_topic_title(topic_data))
+    topic.append(add_topic_shortdesc(topic_data))
+    topic.append(add_topic_prolog(topic_data))
+    topic.append(add_topic_refbody(topic_data))
+    topic.append(add_topic_rellinks(topic_data))
+
+    return topic
+
+
+# The commands of a class, and the start and stop of an environment, come from
+# one stanza, and their topics differ only in the name and the prolog dates. The
+# first topic built for a stanza is kept, and the others are copies of it with
+# those nodes replaced. Class instances are generated together, so only the
+# most recent stanzas are kept. Topics may be shared with the cache and must not
+# be changed after they are returned.
+TOPIC_TEMPLATE_CACHE_SIZE = 16
+
+topic_template_cache = OrderedDict()
+
+
+def stamp_dita_topic(template, topic_data):
+    command_name = topic_data.name
+
+    topic = copy.deepcopy(template)
+
+    topic.set('id', f"r_command_{get_topic_name(topic_data)}")
+
+    # title, shortdesc/cmdname, prolog/critdates/created, refbody/refsyn/synph
+    topic[0].text = f"\\{command_name}"
+    topic[1][0].text = f"\\{command_name}"
+    set_topic_dates(topic[2][1][0], get_topic_name(topic_data))
+    topic[3][0][1].text = f"\\{command_name} "
+
+    # related-links, after the source file link: to the base command, or to
+    # this command's variants. The source file link gets back the tail the
+    # last link took over from it.
+    topic[4][0].tail = topic[4][-1].tail
+    del topic[4][1:]
+    add_variant_links(topic[4], topic_data)
+
+    return topic
+
+
+def generate_dita_topic(topic_data):
+    template = topic_template_cache.get(topic_data.stanza_hash)
+
+    if template is not None:
+        topic_template_cache.move_to_end(topic_data.stanza_hash)
+        return stamp_dita_topic(template, topic_data)
+
+    topic = build_dita_topic(topic_data)
+
+    topic_template_cache[topic_data.stanza_hash] = topic
+    if len(topic_template_cache) > TOPIC_TEMPLATE_CACHE_SIZE:
+        topic_template_cache.popitem(last=False)
+
+    return topic
+
+
+def generate_environment_topic(environment_name):
+    topic = etree.Element(
+        'concept', id=f"r_command_{environment_name}")
+
+    topic.set(XML_LANG, output_lang)
+
+    keyword_element = etree.Element('keyword')
+    keyword_element.text = f"{environment_name}"
+    keyword_element.tail = " Environment"
+
+    title_element = etree.Element('title')
+    title_element.text = "The "
+    title_element.append(keyword_element)
+    topic.append(title_element)
+
+    keyword_element = etree.Element('keyword')
+    keyword_element.text = f"{environment_name}"
+    keyword_element.tail = " environment..."
+
+    shortdesc_element = etree.Element('shortdesc', rev='0')
+    shortdesc_element.text = "The "
+    shortdesc_element.append(keyword_element)
+    topic.append(shortdesc_element)
+
+    topic.append(get_fragment('conbody'))
+
+    return topic
+
+
+def generate_class_topic(class_name):
+    topic = etree.Element('concept', id=f"c_class_{class_name}")
+
+    topic.set(XML_LANG, output_lang)
+
+    keyword_element = etree.Element('keyword')
+    keyword_element.text = f"{class_name}"
+    keyword_element.tail = " Class"
+
+    title_element = etree.Element('title')
+    title_element.text = "The "
+    title_element.append(keyword_element)
+    topic.append(title_element)
+
+    keyword_element = etree.Element('keyword')
+    keyword_element.text = f"{class_name}"
+    keyword_element.tail = " class..."
+
+    shortdesc_element = etree.Element('shortdesc', rev='0')
+    shortdesc_element.text = "The "
+    shortdesc_element.append(keyword_element)
+    topic.append(shortdesc_element)
+
+    topic.append(get_fragment('conbody'))
+
+    return topic
+
+
+# --- Dealing With Output
+
+def make_output_dirs(base_path, lang, languages=None):
+
+    # Setup areas for common and translation, for every language being built;
+    # sinks that are not directories need none of this
+    common_path = base_path / 'common'
+    output_sink.make_dirs(common_path)
+    supported_languages = languages or [lang]
+
+    for language in supported_languages:
+        lp = base_path / language
+        output_sink.make_dirs(lp)
+
+    focus_path = base_path / lang
+
+    topic_areas = ["commands", "classes", "environments", "frontmatter", "glossary",
+                   "out", "arguments", "support", "temp", ]
+
+    for directory in topic_areas:
+        topic_area = focus_path / directory
+        output_sink.make_dirs(topic_area)
+
+    for directory in string.ascii_lowercase:
+        command_area = focus_path / "commands" / directory
+        output_sink.make_dirs(command_area)
+
+    return focus_path
+
+
+def write_class_topic(class_topic, name, path):
+
+    filename = path / "classes" / f"c_class_{name}.dita"
+
+    write_dita(class_topic, filename, CONCEPT_DOCTYPE)
+
+
+def write_environment_topic(environment_topic, name, path):
+
+    filename = path / "environments" / f"c_environment_{name}.dita"
+
+    write_dita(environment_topic, filename, CONCEPT_DOCTYPE)
+
+
+def get_command_topic_path(name, path):
+    return path / "commands" / name[0].lower() / f"r_command_{name}.dita"
+
+
+def write_command_topic(topic_element, name, path):
+
+    filename = get_command_topic_path(name, path)
+
+    return write_dita(topic_element, filename, REFERENCE_DOCTYPE)
+
+
+def write_inheritance_ditamap(donor_set, path):
+    inheritance_map = etree.Element('map')
+    inheritance_map.set(XML_LANG, output_lang)
+
+    title_element = etree.Element('title')
+    title_element.text = "Command Inheritance"
+    inheritance_map.append(title_element)
+
+    inheritance_map.append(etree.Comment(
+        "Conrefs for commands that use settings that other command inheirit. We only ever want to update these in one place, and have all of the dependant commands also update."))
+
+    # Sorted, as set order changes from run to run (and when worker results are merged)
+    for donor in sorted(donor_set):
+        keydef_element = etree.Element(
+            'keydef', keys=f"command_{donor}", href=f"commands/{donor[0]}/r_command_{donor}.dita")
+        inheritance_map.append(keydef_element)
+
+    filename = path / "inheritance.ditamap"
+
+    write_dita(inheritance_map, filename, MAP_DOCTYPE)
+
+
+def get_reltable_width(related_list):
+
+    longest_row = 1
+
+    for row in related_list:
+        if 'instances' in row:
+            if len(row['instances']) > longest_row:
+                longest_row = len(row['instances'])
+
+    # We add two here to accomodate a link to the umbrella topic for the class, the environment, or both
+    return longest_row + 2
+
+
+def get_related_row(row, reltable_width):
+    relrow_element = etree.Element('relrow')
+    # print(row)
+    if 'stem' in row:
+        # print(f"Found environment")
+        relcell_element = etree.Element('relcell')
+        relcell_element.attrib['collection-type'] = "family"
+        topicref_element = etree.Element(
+            'topicref', keyref=f"environment_{row['stem']}")
+        relcell_element.append(topicref_element)
+        for member in row['members']:
+            topicref_element = etree.Element(
+                'topicref', keyref=f"command_{member}")
+            relcell_element.append(topicref_element)
+        relrow_element.append(relcell_element)
+        for i in range(reltable_width - len(relrow_element)):
+            relrow_element.append(etree.Element('relcell'))
+
+    elif 'name' in row:
+        # print(f"Found class")
+        relcell_element = etree.Element('relcell')
+        topicref_element = etree.Element(
+            'topicref', keyref=f"class_{row['name']}")
+        relcell_element.append(topicref_element)
+        relrow_element.append(relcell_element)
+
+        for instance in row['instances']:
+            # Make a relcell
+            relcell_element = etree.Element('relcell')
+            # populate the relcell
+            if type(instance) == str:
+                relcell_element = etree.Element('relcell')
+                topicref_element = etree.Element(
+                    'topicref', keyref=f"command_{instance}")
+                relcell_element.append(topicref_element)
+            elif type(instance) == dict:
+                relcell_element = etree.Element('relcell')
+                relcell_element.attrib['collection-type'] = "family"
+                topicref_element = etree.Element(
+                    'topicref', keyref=f"environment_{instance['stem']}")
+                relcell_element.append(topicref_element)
+                for member in instance['members']:
+                    topicref_element = etree.Element(
+                        'topicref', keyref=f"command_{member}")
+                    relcell_element.append(topicref_element)
+                relrow_element.append(relcell_element)
+            # add relcell to row
+            relrow_element.append(relcell_element)
+
+        # pad row with empty cells
+        for i in range(reltable_width - len(relrow_element)):
+            relrow_element.append(etree.Element('relcell'))
+
+    return relrow_element
+
+
+# The maps that list every command grow with the interface, so rather than held
+# as one tree they are serialized a node at a time, to the same bytes write_dita
+# would give.
+
+@contextlib.contextmanager
+def map_writer(filename):
+    # Yields an lxml xmlfile, inside the map element, for write_map_node
+
+    output = io.BytesIO()
+
+    with etree.xmlfile(output, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        xf.write_doctype(MAP_DOCTYPE)
+
+        # xmlfile would declare a prefix of its own for XML_LANG
+        with xf.element('map', {'xml:lang': output_lang}):
+            yield xf
+            write_map_space(xf, 0)
+
+    if pretty_print_output:
+        output.write(b"\n")
+
+    write_output(filename, output.getvalue())
+
+
+def write_map_space(xf, level):
+    # The whitespace tostring(pretty_print=True) puts before a node at this depth
+
+    if pretty_print_output:
+        xf.write("\n" + "  " * level)
+
+
+def write_map_node(xf, node, level=1):
+    write_map_space(xf, level)
+
+    if pretty_print_output and len(node):
+        etree.indent(node, level=level)
+
+    xf.write(node)
+
+
+def write_related_ditamap(related_list, path):
+    # Every row is padded out to the longest, which makes this by far the
+    # largest map
+
+    reltable_width = get_reltable_width(related_list)
+
+    with map_writer(path / "relations.ditamap") as xf:
+        write_map_node(xf, etree.Comment(
+            "Reltable for related commands: each row with as many cells needed for all of the related commands to that particular command."))
+
+        write_map_space(xf, 1)
+
+        with xf.element('reltable'):
+            relheader_element = etree.Element('relheader')
+
+            for i in range(reltable_width):
+                relheader_element.append(etree.Element('relcolspec', type='reference'))
+
+            write_map_node(xf, relheader_element, 2)
+
+            for row in related_list:
+                write_map_node(xf, get_related_row(row, reltable_width), 2)
+
+            write_map_space(xf, 1)
+
+
+def write_environments_ditamap(environments_list, path):
+    environments_map = etree.Element('map')
+    environments_map.set(XML_LANG, output_lang)
+
+    title_element = etree.Element('title')
+    title_element.text = "Environments"
+    environments_map.append(title_element)
+
+    for environment in sorted(environments_list):
+        topicref_element = etree.Element(
+            'topicref', keys=f"environment_{environment}", href=f"environments/c_environment_{environment}.dita")
+        environments_map.append(topicref_element)
+
+    filename = path / "environments.ditamap"
+
+    write_dita(environments_map, filename, MAP_DOCTYPE)
+
+
+def write_classes_ditamap(classes_list, path):
+    classes_map = etree.Element('map')
+    classes_map.set(XML_LANG, output_lang)
+
+    title_element = etree.Element('title')
+    title_element.text = "Classes"
+    classes_map.append(title_element)
+
+    for cmd_class in sorted(classes_list):
+        topicref_element = etree.Element(
+            'topicref', keys=f"class_{cmd_class}", href=f"classes/c_class_{cmd_class}.dita")
+        classes_map.append(topicref_element)
+
+    filename = path / "classes.ditamap"
+
+    write_dita(classes_map, filename, MAP_DOCTYPE)
+
+
+def write_variants_ditamap(variant_list, path, map_filename, map_title):
+    variants_map = etree.Element('map')
+    variants_map.set(XML_LANG, output_lang)
+
+    title_element = etree.Element('title')
+    title_element.text = map_title
+    variants_map.append(title_element)
+
+    for variant in variant_list:
+        topic_name = get_topic_name(variant)
+        topicref_element = etree.Element(
+            'topicref', keys=f"command_{topic_name}", href=get_command_url(topic_name))
+        variants_map.append(topicref_element)
+
+    filename = path / map_filename
+
+    write_dita(variants_map, filename, MAP_DOCTYPE)
+
+
+def write_command_ditamap(command_list, path, map_filename, map_title):
+    with map_writer(path / map_filename) as xf:
+        title_element = etree.Element('title')
+        title_element.text = map_title
+        write_map_node(xf, title_element)
+
+        for command in sorted(command_list):
+            topicref_element = etree.Element(
+                'topicref', keys=f"command_{command}", href=f"commands/{command[0]}/r_command_{command}.dita")
+            write_map_node(xf, topicref_element)
+
+
+# --- Manually Edited Topics ---
+
+# The manually edited topics are synced into the build directory rather than
+# copied wholesale. A manifest there records the size, mtime and content hash
+# of every file as it was last synced; a file is only hashed again when its
+# size or mtime has moved, and only copied (or hard linked) when its content
+# has changed or the output lacks it. No generated file shares a path with a
+# manually edited one, so the sync runs in a thread while topics are generated.
+
+MANUAL_TOPICS_MANIFEST = "interface2dita_manual_manifest"
+
+
+def get_build_cache_path(build_path, stem, suffix):
+    # Kept for each sink and destination; None if output_sink keeps nothing
+    if output_sink.cache_tag is None:
+        return None
+    return Path(build_path) / f"{stem}{output_sink.cache_tag}{suffix}"
+
+
+def load_manual_topics_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_manual_topics_manifest(files, manifest_path):
+    with open(manifest_path, 'w') as f:
+        json.dump({'files': files}, f, indent=1, sort_keys=True)
+
+
+def get_manual_topic_entry(source, previous_entry):
+    source_stat = os.stat(source)
+    entry = {'size': source_stat.st_size, 'mtime_ns': source_stat.st_mtime_ns}
+
+    if previous_entry is not None and all(previous_entry.get(key) == value for key, value in entry.items()):
+        entry['hash'] = previous_entry['hash']
+    else:
+        entry['hash'] = get_content_hash(Path(source).read_bytes())
+
+    return entry
+
+
+def import_manually_edited_topics(met_path, build_path, manifest_path=None, link=False, delete=False, force=False):
+    # Over the generated output, file by file. Without a manifest everything is
+    # copied. Returns the names of the files by what happened to them; files
+    # deleted from met_path since the last sync are removed if delete is set,
+    # and otherwise kept as stale.
+
+    previous_files = {}
+    if manifest_path is not None and not force:
+        previous_files = load_manual_topics_manifest(manifest_path)
+
+    files = {}
+    summary = {'added': [], 'changed': [], 'unchanged': [], 'removed': [], 'stale': []}
+
+    for directory, subdirectories, filenames in os.walk(met_path):
+        subdirectories.sort()
+        target_path = Path(build_path) / os.path.relpath(directory, met_path)
+        output_sink.make_dirs(target_path)
+
+        for filename in sorted(filenames):
+            source = Path(directory) / filename
+            target = target_path / filename
+            name = source.relative_to(met_path).as_posix()
+
+            previous_entry = previous_files.get(name)
+            files[name] = get_manual_topic_entry(source, previous_entry)
+
+            if previous_entry is not None and previous_entry['hash'] == files[name]['hash'] \
+                    and output_sink.exists(target):
+                output_sink.keep(target)
+                summary['unchanged'].append(name)
+            else:
+                summary[output_sink.put_file(target, source, link)].append(name)
+
+    for name in sorted(set(previous_files) - set(files)):
+        target = Path(build_path) / name
+
+        if not output_sink.exists(target):
+            continue
+
+        if delete:
+            logger.info("Removing deleted manually edited topic %s", target)
+            output_sink.remove(target)
+            summary['removed'].append(name)
+        else:
+            # Still in the output, so still for a later sync to delete
+            output_sink.keep(target)
+            files[name] = previous_files[name]
+            summary['stale'].append(name)
+
+    if manifest_path is not None:
+        save_manual_topics_manifest(files, manifest_path)
+
+    return summary
+
+
+class ManualTopicSync(threading.Thread):
+    # import_manually_edited_topics, in the background; a failure is reported
+    # like a failed write, and leaves the manifest as it was
+
+    def __init__(self, met_path, build_path, **options):
+        super().__init__(daemon=True)
+        self.met_path = met_path
+        self.build_path = build_path
+        self.options = options
+        self.summary = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.summary = import_manually_edited_topics(
+                self.met_path, self.build_path, **self.options)
+        except Exception as error:
+            # Whatever it was, finish() reports it instead of a summary
+            self.error = error
+
+    def finish(self):
+        with profile_phase("import_manually_edited_topics"):
+            self.join()
+
+        if self.error is not None:
+            logger.error("Could not sync the manually edited topics: %s", self.error)
+            write_failures.append((str(self.met_path), str(self.error)))
+            return
+
+        copied = len(self.summary['added']) + len(self.summary['changed'])
+        deleted = len(self.summary['removed']) + len(self.summary['stale'])
+
+        report(
+            f"Manually edited topics: {copied} copied, {len(self.summary['unchanged'])} unchanged, {deleted} {'removed' if self.options['delete'] else 'stale'}.")
+
+
+def start_manual_topic_sync(build_path, args):
+    sync = ManualTopicSync(Path.cwd() / 'manually_edited_topics', build_path,
+                           manifest_path=get_build_cache_path(
+                               build_path, MANUAL_TOPICS_MANIFEST, ".json"),
+                           link=args['link_manual_topics'], delete=args['prune'], force=args['force'])
+    sync.start()
+    return sync
+
+
+# --- Build Cache ---
+
+# The manifest records, for every command topic, a hash of everything the topic
+# is generated from (its stanza, the stanzas of its donors, and this script) and
+# a hash of the topic that was written. If the first hash is unchanged and the
+# output still holds that very topic, there is no need to generate it again.
+
+def get_generator_hash():
+    return get_content_hash(Path(__file__).read_bytes())
+
+
+def get_command_build_key(command_data, commands_dict):
+    key_parts = [get_topic_name(command_data), command_data.stanza_hash]
+
+    # A command's topic links to its variants
+    if command_data.variant_id is None:
+        key_parts.extend(variant_topic_names.get(command_data.name, ()))
+
+    for donor in sorted(get_command_donors(command_data)):
+        if donor in commands_dict:
+            key_parts.append(f"{donor}:{commands_dict[donor].stanza_hash}")
+        else:
+            key_parts.append(f"{donor}:MISSING")
+
+    return get_content_hash("\n".join(key_parts))
+
+
+def new_build_manifest():
+    # A reproducible build's topics carry its date, so they are only current
+    # for the same date
+    build_date = today.isoformat() if reproducible_build else None
+    return {'generator': get_generator_hash(), 'pretty_print': pretty_print_output,
+            'build_date': build_date, 'commands': {}}
+
+
+def load_build_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return new_build_manifest()
+
+    if manifest.get('generator') != get_generator_hash():
+        logger.info("Build manifest is from a different generator; ignoring it.")
+        return new_build_manifest()
+
+    if manifest.get('pretty_print') != pretty_print_output:
+        logger.info("Build manifest used different output settings; ignoring it.")
+        return new_build_manifest()
+
+    if manifest.get('build_date') != new_build_manifest()['build_date']:
+        logger.info("Build manifest has different topic dates; ignoring it.")
+        return new_build_manifest()
+
+    return manifest
+
+
+def save_build_manifest(manifest, manifest_path):
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+# Set from --diff for --all: the topic names to generate again, when the rest
+# are taken to be current whatever the manifest says
+regenerate_topics = None
+
+
+def is_command_topic_current(manifest, command_name, build_key, topic_path):
+    if regenerate_topics is not None:
+        return command_name not in regenerate_topics and output_sink.exists(topic_path)
+
+    entry = manifest['commands'].get(command_name)
+
+    if entry is None or entry['stanza'] != build_key:
+        return False
+
+    # The topic may have been changed or replaced since
+    return entry['topic'] is not None and output_sink.holds(topic_path, entry['topic'])
+
+
+# --- Name Index ---
+
+# --name only needs one stanza, so rather than processing the whole interface
+# it reads the stanza straight from the file. The name index, kept in the build
+# directory, gives the byte range of every stanza, the stanza that makes each
+# command and each variant, and the same light summary scan_interface makes for
+# every stanza, which is all topic generation needs to know about donors and
+# variant links.
+
+def get_input_signature(input_file):
+    input_stat = os.stat(input_file)
+    return {
+        'path': str(Path(input_file).resolve()),
+        'size': input_stat.st_size,
+        'mtime_ns': input_stat.st_mtime_ns,
+    }
+
+
+def get_line_offsets(data):
+    line_offsets = [0]
+    position = data.find(b"\n")
+
+    while position != -1:
+        line_offsets.append(position + 1)
+        position = data.find(b"\n", position + 1)
+
+    return line_offsets
+
+
+def get_stanza_byte_range(data, line_offset):
+    start = data.index(b"<cd:command", line_offset)
+    start_tag_end = data.index(b">", start)
+
+    if data[start_tag_end - 1:start_tag_end] == b"/":
+        return start, start_tag_end + 1
+
+    end_tag = b"</cd:command>"
+    return start, data.index(end_tag, start_tag_end) + len(end_tag)
+
+
+def build_name_index(input_file):
+    logger.debug("### Building name index.")
+
+    data = Path(input_file).read_bytes()
+    line_offsets = get_line_offsets(data)
+
+    root_start = data.index(b"<cd:interface")
+    root_tag = data[root_start:data.index(b">", root_start) + 1]
+
+    name_index = {
+        'generator': get_generator_hash(),
+        'input': get_input_signature(input_file),
+        'root_tag': root_tag.decode("utf-8"),
+        'stanzas': [],
+        'commands': {},
+        'variants': {},
+    }
+
+    scanned_variants = []
+
+    for stanza in iter_interface_stanzas(input_file):
+        stanza_name, stanza_type, variant_type, environment_prefix = get_stanza_type(
+            stanza)
+
+        start, end = get_stanza_byte_range(
+            data, line_offsets[stanza.sourceline - 1])
+
+        stanza_number = len(name_index['stanzas'])
+        name_index['stanzas'].append(
+            [start, end, get_stanza_summary(stanza)])
+
+        if stanza_type == "variant":
+            if stanza_name not in STANZA_NAME_ERRORS:
+                scanned_variants.append(
+                    (stanza_number, scan_variant(stanza_name, stanza, variant_type)))
+            continue
+
+        for command_name in get_stanza_command_names(stanza_name, stanza_type, stanza):
+            name_index['commands'].setdefault(command_name, stanza_number)
+
+    # As in scan_interface, the first stanza of each variant wins
+    for stanza_number, (stanza_name, command_names, variant_id, summary) in scanned_variants:
+        if is_known_duplicate(stanza_name, name_index['commands']):
+            continue
+
+        for command_name in command_names:
+            name_index['variants'].setdefault(command_name, {}).setdefault(
+                variant_id, stanza_number)
+
+    return name_index
+
+
+def load_name_index(index_path, input_file):
+    try:
+        with open(index_path, 'r') as f:
+            name_index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if name_index.get('generator') != get_generator_hash():
+        logger.info("Name index is from a different generator; ignoring it.")
+        return None
+
+    if name_index.get('input') != get_input_signature(input_file):
+        logger.info("Name index is for a different input file; ignoring it.")
+        return None
+
+    return name_index
+
+
+def get_name_index(input_file, index_path):
+    name_index = load_name_index(index_path, input_file)
+
+    if name_index is None:
+        name_index = build_name_index(input_file)
+        Path(index_path).parent.mkdir(exist_ok=True, parents=True)
+        with open(index_path, 'w') as f:
+            json.dump(name_index, f)
+
+    return name_index
+
+
+def get_indexed_commands(name_index):
+    # A light commands_dict, as scan_interface makes
+    return {command_name: CommandRecord(name=command_name, **name_index['stanzas'][stanza_number][2])
+            for command_name, stanza_number in name_index['commands'].items()}
+
+
+def get_indexed_variants(name_index):
+    # A light variants_dict, as scan_interface makes
+    return {command_name: [CommandRecord(name=command_name, variant_id=variant_id,
+                                         **name_index['stanzas'][stanza_number][2])
+                           for variant_id, stanza_number in variants.items()]
+            for command_name, variants in name_index['variants'].items()}
+
+
+def get_indexed_variant_topics(name_index):
+    # The command and stanza of each variant topic, by topic name
+    return {f"{command_name}_{variant_id}": (command_name, stanza_number)
+            for command_name, variants in name_index['variants'].items()
+            for variant_id, stanza_number in variants.items()}
+
+
+def read_indexed_stanza(input_file, name_index, stanza_number):
+    start, end, summary = name_index['stanzas'][stanza_number]
+
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        stanza_bytes = f.read(end - start)
+
+    root = etree.fromstring(
+        name_index['root_tag'].encode("utf-8") + stanza_bytes + b"</cd:interface>")
+
+    return root[0]
+
+
+def get_name_trigrams(name):
+    padded = f"  {name.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def suggest_command_names(name, command_names, count=5):
+    # The names sharing the most trigrams with this one are the candidates,
+    # and the closest of those by edit similarity are suggested
+
+    trigram_index = {}
+    for command_name in command_names:
+        for trigram in get_name_trigrams(command_name):
+            trigram_index.setdefault(trigram, []).append(command_name)
+
+    name_trigrams = get_name_trigrams(name)
+    shared_counts = Counter()
+    for trigram in name_trigrams:
+        shared_counts.update(trigram_index.get(trigram, ()))
+
+    scores = []
+    for command_name, shared in shared_counts.items():
+        total = len(name_trigrams) + \
+            len(get_name_trigrams(command_name)) - shared
+        scores.append((-shared / total, command_name))
+
+    candidates = [command_name for score,
+                  command_name in sorted(scores)[:count * 4]]
+
+    candidates.sort(key=lambda command_name: -difflib.SequenceMatcher(
+        None, name, command_name).ratio())
+
+    return candidates[:count]
+
+
+# --- Model Cache ---
+
+# The processed command model holds no XML, so it can be kept between runs. It
+# is stored with the hash of the interface file and of this script, and is only
+# used when both still match.
+
+def load_model_cache(cache_path, input_hash):
+    try:
+        with open(cache_path, 'rb') as f:
+            model = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+    if model.get('generator') != get_generator_hash():
+        logger.info("Model cache is from a different generator; ignoring it.")
+        return None
+
+    if model.get('input_hash') != input_hash:
+        logger.info("Model cache is for a different input file; ignoring it.")
+        return None
+
+    return model
+
+
+def save_model_cache(cache_path, input_hash, commands_dict, variants_dict, classes_list, environments_list, relations_list):
+    model = {
+        'generator': get_generator_hash(),
+        'input_hash': input_hash,
+        'commands': commands_dict,
+        'variants': variants_dict,
+        'classes': classes_list,
+        'environments': environments_list,
+        'relations': relations_list,
+        'donors': donor_set,
+        'stanza_index': stanza_index,
+        'structure': interface_structure,
+        'unknown_argument_tags': unknown_argument_tags,
+        'unknown_argument_lines': unknown_argument_lines,
+    }
+
+    Path(cache_path).parent.mkdir(exist_ok=True, parents=True)
+
+    with open(cache_path, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def restore_model_cache(model):
+    # Put back the module state that processing the interface would have left
+
+    donor_set.update(model['donors'])
+    set_stanza_index(model['stanza_index'])
+    set_interface_structure(model['structure'])
+    unknown_argument_tags.update(model['unknown_argument_tags'])
+    unknown_argument_lines.update(model['unknown_argument_lines'])
+
+    return model['commands'], model['variants'], model['classes'], model['environments'], model['relations']
+
+
+# --- Topic Generation Jobs ---
+
+# The job functions below read the module globals commands_dict, variants_dict,
+# focus_path and old_manifest, just as the builders do. Worker processes are
+# forked after those are set up, so they see the command model without it ever
+# being pickled.
+
+def build_command_topic(command_data):
+    # Returns the manifest entry for the topic, whether it was generated, and
+    # how long generating and writing it took
+
+    # Variants are kept under their own topic name
+    command_name = get_topic_name(command_data)
+
+    logger.debug("Processing %s...", command_name)
+
+    build_key = get_command_build_key(command_data, commands_dict)
+
+    topic_path = get_command_topic_path(command_name, focus_path)
+
+    if is_command_topic_current(old_manifest, command_name, build_key, topic_path):
+        output_sink.keep(topic_path)
+        write_log.append((str(topic_path), "unchanged"))
+        # Going by --diff, a kept topic may have no entry yet
+        manifest_entry = old_manifest['commands'].get(command_name, {'topic': None})
+        return dict(manifest_entry, stanza=build_key), False, None
+
+    start_time = time.perf_counter()
+
+    xml_topic = generate_dita_topic(command_data)
+
+    generated_time = time.perf_counter()
+
+    output = write_command_topic(xml_topic, command_name, focus_path)
+
+    written_time = time.perf_counter()
+
+    manifest_entry = {
+        'stanza': build_key,
+        'topic': get_content_hash(output),
+    }
+
+    timing = (generated_time - start_time, written_time - generated_time)
+
+    return manifest_entry, True, timing
+
+
+def generate_command_topics(command_names):
+    results = []
+
+    for command_name in command_names:
+        manifest_entry, generated, timing = build_command_topic(
+            commands_dict[command_name])
+        results.append((command_name, manifest_entry, generated, timing))
+
+    # Builders add to the donor set as they go, and a worker's additions would
+    # otherwise be lost when it exits
+    return results, donor_set
+
+
+def generate_variant_topics(command_names):
+    # The variants of the given commands, from the module global variants_dict
+
+    results = []
+
+    for command_name in command_names:
+        for variant_data in variants_dict[command_name]:
+            manifest_entry, generated, timing = build_command_topic(
+                variant_data)
+            results.append((get_topic_name(variant_data),
+                           manifest_entry, generated, timing))
+
+    return results, donor_set
+
+
+def generate_class_topics(class_names):
+    for cmd_class in class_names:
+        write_class_topic(generate_class_topic(
+            cmd_class), cmd_class, focus_path)
+
+    return [], donor_set
+
+
+def generate_environment_topics(environment_names):
+    for environment in environment_names:
+        write_environment_topic(generate_environment_topic(
+            environment), environment, focus_path)
+
+    return [], donor_set
+
+
+def stream_command_topics(input_file, classes_list, environments_list, relations_list,
+                          progress=None):
+    # Here commands_dict and variants_dict are the light dictionaries from
+    # scan_interface. The full data for a stanza's commands and variants lives
+    # only until their topics are written; variants are decoded in full, as
+    # their base stanzas are not kept. Returns the results for the commands
+    # and for the variants.
+
+    results = []
+    variant_results = []
+    stream_commands = {}
+    written_variants = set()
+
+    for stanza_count, stanza in enumerate(iter_interface_stanzas(input_file), 1):
+        stanza_commands = {}
+        stanza_variants = {}
+        process_stanza(stanza, ChainMap(stanza_commands, stream_commands),
+                       classes_list, environments_list, relations_list,
+                       variants_dict=stanza_variants)
+
+        for command_name, command_data in stanza_commands.items():
+            manifest_entry, generated, timing = build_command_topic(
+                command_data)
+            results.append((command_name, manifest_entry, generated, timing))
+            stream_commands[command_name] = commands_dict.get(command_name)
+
+        # The first stanza of a variant wins, as in process_variant
+        for variants in stanza_variants.values():
+            for variant_data in variants:
+                topic_name = get_topic_name(variant_data)
+                if topic_name in written_variants:
+                    continue
+                written_variants.add(topic_name)
+                manifest_entry, generated, timing = build_command_topic(
+                    variant_data)
+                variant_results.append(
+                    (topic_name, manifest_entry, generated, timing))
+
+        if progress:
+            progress.update(len(stanza_commands))
+
+        if stanza_count % SHARED_RECORDS_WINDOW == 0:
+            clear_shared_records()
+
+    clear_shared_records()
+
+    return results, variant_results
+
+
+# Serial runs work through the names in chunks too, so that progress can be
+# reported the same way
+SERIAL_CHUNK_SIZE = 64
+
+
+def run_topic_job_chunk(job_function, names):
+    # In a worker: also hand back what was written and what could not be, for
+    # the parent's write log, and what the parent's sink should store if the
+    # worker cannot store it itself
+
+    global output_sink
+
+    parent_sink = output_sink
+    if not parent_sink.forkable:
+        output_sink = ForwardingSink(parent_sink)
+
+    log_start = len(write_log)
+    failures_start = len(write_failures)
+
+    try:
+        results, job_donors = job_function(names)
+        flush_background_writes()
+        sink_entries = getattr(output_sink, 'entries', [])
+    finally:
+        output_sink = parent_sink
+
+    return results, job_donors, write_log[log_start:], write_failures[failures_start:], sink_entries
+
+
+def merge_topic_job_results(chunk_results, progress=None):
+    results = []
+
+    for chunk_result, job_donors, job_write_log, job_write_failures, sink_entries in chunk_results:
+        results.extend(chunk_result)
+        donor_set.update(job_donors - donor_set)
+        write_log.extend(job_write_log)
+        write_failures.extend(job_write_failures)
+        replay_sink_entries(sink_entries)
+        if progress:
+            progress.update(len(chunk_result))
+
+    return results
+
+
+def run_topic_jobs(job_function, names, jobs=1, progress=None):
+    # Returns the merged results of job_function over names, in order
+
+    if jobs <= 1:
+        chunk_size = SERIAL_CHUNK_SIZE
+    else:
+        # Many small chunks keep the workers evenly loaded
+        chunk_size = max(1, len(names) // (jobs * 8))
+
+    chunks = [names[i:i + chunk_size]
+              for i in range(0, len(names), chunk_size)]
+
+    if jobs <= 1 or len(chunks) < 2:
+        # Nothing to hand back; the write log is already this process's own
+        chunk_results = ((*job_function(chunk), [], [], [])
+                         for chunk in chunks)
+        return merge_topic_job_results(chunk_results, progress)
+
+    # Nothing may be half written when the workers are forked
+    flush_background_writes()
+
+    # Keep the collector away from the shared model, so that the pages holding
+    # it are not copied into every worker
+    gc.freeze()
+
+    try:
+        with multiprocessing.get_context("fork").Pool(jobs, initializer=random.seed) as pool:
+            job_chunk_function = functools.partial(
+                run_topic_job_chunk, job_function)
+            return merge_topic_job_results(pool.imap(job_chunk_function, chunks), progress)
+    finally:
+        gc.unfreeze()
+
+
+# --- Change Summary ---
+
+# Generated topics live in these places; anything there that this run did not
+# write is left over from a command that no longer exists
+GENERATED_TOPIC_PATTERNS = [
+    "commands/*/r_command_*.dita",
+    "classes/c_class_*.dita",
+    "environments/c_environment_*.dita",
+]
+
+
+def find_removed_topics(path):
+    # A topic that failed to write is not stale, and must not be pruned
+    written = set(filename for filename, status in write_log)
+    written.update(filename for filename, error in write_failures)
+    removed = []
+
+    for pattern in GENERATED_TOPIC_PATTERNS:
+        for filename in sorted(output_sink.list(path, pattern)):
+            if filename not in written:
+                removed.append(filename)
+
+    return removed
+
+
+def summarize_changes(path, removed):
+    summary = {'added': [], 'changed': [], 'unchanged': [], 'removed': []}
+
+    for filename, status in write_log:
+        summary[status].append(os.path.relpath(filename, path))
+
+    summary['removed'] = [os.path.relpath(filename, path)
+                          for filename in removed]
+
+    for status in summary:
+        summary[status].sort()
+
+    return summary
+
+
+def prune_removed_topics(removed):
+    for filename in removed:
+        logger.info("Removing stale topic %s", filename)
+        output_sink.remove(filename)
+
+
+def keep_removed_topics(removed):
+    # Without --prune, stale topics stay in the output; an archive sink only
+    # carries over what it is told to
+    for filename in removed:
+        output_sink.keep(filename)
+
+
+# --- Logging and Console Output ---
+
+# Set by --quiet; the --name and --test reports are printed regardless
+console_quiet = False
+
+# Set to the language when several are built at once, so their lines can be
+# told apart
+console_prefix = ""
+
+
+def configure_logging(log_file, verbose=False, quiet=False):
+    if quiet:
+        level = logging.ERROR
+    elif verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.WARNING
+
+    logger.setLevel(level)
+
+    formatter = logging.Formatter('%(levelname)s:%(message)s')
+
+    if log_file:
+        file_handler = logging.FileHandler(log_file, mode='w')
+        file_handler.setFormatter(formatter)
+        logger.addHandler(file_handler)
+
+    if verbose:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        logger.addHandler(console_handler)
+
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+
+
+def report(message):
+    if not console_quiet:
+        print(f"{console_prefix}{message}")
+
+
+class ProgressLine:
+    """One console line for a long phase, rewritten in place with the count,
+    throughput and estimated time left. When the console is not a terminal only
+    the final line is printed.
+    """
+
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.count = 0
+        self.start_time = time.perf_counter()
+        self.shown_time = 0
+        # Several languages' progress lines would overwrite each other
+        self.live = not console_quiet and not console_prefix and sys.stderr.isatty()
+
+    def update(self, count=1):
+        self.count += count
+
+        if not self.live:
+            return
+
+        now = time.perf_counter()
+        if now - self.shown_time < 0.1 and self.count < self.total:
+            return
+        self.shown_time = now
+
+        elapsed = now - self.start_time
+        rate = self.count / elapsed if elapsed else 0
+        remaining = (self.total - self.count) / rate if rate else 0
+
+        sys.stderr.write(
+            f"\r{self.label}: {self.count}/{self.total} ({self.count / max(self.total, 1):.0%}) {rate:.0f}/s ETA {remaining:.0f}s  ")
+        sys.stderr.flush()
+
+    def finish(self):
+        if console_quiet:
+            return
+
+        elapsed = time.perf_counter() - self.start_time
+        rate = self.count / elapsed if elapsed else 0
+
+        if self.live:
+            sys.stderr.write("\r\033[K")
+            sys.stderr.flush()
+
+        print(f"{self.label}: {self.count} in {elapsed:.1f}s ({rate:.0f}/s)")
+
+
+# --- Profiling ---
+
+# Phase timings are always collected, as they cost next to nothing; --profile
+# prints them along with the most expensive command and variant topics. With
+# --write-threads a topic's own time only covers handing its bytes to the
+# writer, and the writing itself shows up in the "write drain" phase.
+
+phase_timings = OrderedDict()
+
+
+@contextlib.contextmanager
+def profile_phase(phase_name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_timings[phase_name] = phase_timings.get(
+            phase_name, 0) + time.perf_counter() - start_time
+
+
+def get_settings_key_count(command_data):
+    # How many keys the settings tables of a command list, over all their
+    # settings; a setting inherited whole has none of its own
+
+    key_count = 0
+
+    for arg in command_data.arguments:
+        if arg.type == "SETTINGS":
+            for setting in arg.children:
+                key_count += len(setting.keys or ())
+
+    return key_count
+
+
+def print_profile_report(command_timings, top_n):
+    total_time = sum(phase_timings.values())
+
+    print("## Phase timings")
+    for phase_name, seconds in phase_timings.items():
+        print(f"{phase_name:<40}{seconds:>10.3f}s{seconds / total_time:>8.1%}")
+    print(f"{'total':<40}{total_time:>10.3f}s")
+
+    if not command_timings:
+        return
+
+    topics = dict(commands_dict)
+    for variants in variants_dict.values():
+        for variant_data in variants:
+            topics[get_topic_name(variant_data)] = variant_data
+
+    print(f"## {min(top_n, len(command_timings))} most expensive topics")
+    print(f"{'topic':<40}{'generate':>12}{'enqueue' if write_threads > 0 else 'write':>12}{'settings keys':>15}")
+
+    ranked = sorted(command_timings.items(),
+                    key=lambda item: sum(item[1]), reverse=True)
+
+    for topic_name, (generate_seconds, write_seconds) in ranked[:top_n]:
+        key_count = get_settings_key_count(topics[topic_name]) \
+            if topics[topic_name].arguments is not None else "-"
+        print(
+            f"{topic_name:<40}{generate_seconds * 1000:>10.2f}ms{write_seconds * 1000:>10.2f}ms{key_count:>15}")
+
+
+# A simple sampling profiler, for flame graphs: on every tick of the profiling
+# timer the current Python stack is counted, and the counts are written in the
+# collapsed format ("outer;inner;innermost count") flamegraph.pl reads.
+
+sampled_stacks = Counter()
+
+
+def sample_stack(signum, frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+        frame = frame.f_back
+    sampled_stacks[";".join(reversed(stack))] += 1
+
+
+def start_stack_sampling(interval=0.001):
+    signal.signal(signal.SIGPROF, sample_stack)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+
+def stop_stack_sampling():
+    signal.setitimer(signal.ITIMER_PROF, 0, 0)
+    signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+
+def write_collapsed_stacks(filename):
+    with open(filename, 'w') as f:
+        for stack, count in sorted(sampled_stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+# --- Languages ---
+
+# ConTeXt's interface files for each language are made from one source and
+# differ only in names and text: the same stanzas, of the same types, in the
+# same order. process_interface_tree notes the stanza and command names of every
+# stanza in interface_structure (and their types, for --diff), so that the
+# command relations worked out for the first language can be carried over to the
+# others stanza by stanza, rather than worked out again.
+# add_supporting_env_commands goes by English command names (setup...,
+# define...), so this is also the only way other languages get them right.
+
+interface_structure = {'stanza_names': [], 'stanza_types': [], 'command_names': []}
+
+
+def set_interface_structure(structure):
+    interface_structure.clear()
+    interface_structure.update(structure)
+
+
+def get_structure_name_maps(primary_structure, structure):
+    # Stanza and command names of the primary language to those of another, or
+    # None if the two files are not made of the same stanzas
+
+    if len(primary_structure['stanza_names']) != len(structure['stanza_names']):
+        return None
+
+    stanza_name_map = {}
+    command_name_map = {}
+
+    for primary_name, name, primary_commands, commands in zip(primary_structure['stanza_names'], structure['stanza_names'],
+                                                              primary_structure['command_names'], structure['command_names']):
+        if len(primary_commands) != len(commands):
+            return None
+
+        stanza_name_map.setdefault(primary_name, name)
+        for primary_command, command in zip(primary_commands, commands):
+            command_name_map.setdefault(primary_command, command)
+
+    return stanza_name_map, command_name_map
+
+
+def translate_relations(primary_structure, structure):
+    # The relations of the primary language, in the names of another
+
+    name_maps = get_structure_name_maps(primary_structure, structure)
+
+    if name_maps is None:
+        return None
+
+    stanza_name_map, command_name_map = name_maps
+
+    def translate_members(members):
+        return [command_name_map[member] for member in members if member in command_name_map]
+
+    def translate_environment(relation):
+        return {'stem': stanza_name_map.get(relation['stem'], relation['stem']),
+                'members': translate_members(relation['members'])}
+
+    relations_list = []
+
+    for relation in primary_structure['relations']:
+        if 'stem' in relation:
+            relations_list.append(translate_environment(relation))
+        elif 'name' in relation:
+            instances = []
+            for instance in relation['instances']:
+                if type(instance) == dict:
+                    instances.append(translate_environment(instance))
+                else:
+                    instances.extend(translate_members([instance]))
+            relations_list.append({'name': stanza_name_map.get(relation['name'], relation['name']),
+                                   'instances': instances})
+
+    return relations_list
+
+
+def get_language_pairs(inputs, langs):
+    # --input and --lang are given in pairs; a single --lang may be left at
+    # its default
+
+    if len(inputs) != len(langs):
+        raise SystemExit(
+            f"Got {len(inputs)} --input file(s) but {len(langs)} --lang code(s); give one language per file.")
+
+    if len(set(langs)) != len(langs):
+        raise SystemExit("Each language can only be built once per run.")
+
+    return list(zip(inputs, langs))
+
+
+# --- Building a Language ---
+
+# The command model is loaded, and the topics and maps built, by the functions
+# below. They set the module globals the job functions read; with several
+# languages each language is built in a process of its own, forked once the
+# first language's model (and with it the shared structure) is ready.
+
+def load_command_model(input_file, lang, args, primary_structure=None):
+    # Returns the classes, environments and relations, and leaves the
+    # commands, variants and inheritance index in the module globals
+
+    global commands_dict, variants_dict, inheritance_index, variant_topic_names
+
+    if args['all'] and args['stream']:
+
+        report("Scanning interface file.")
+
+        with profile_phase("scan interface"):
+            commands_dict, variants_dict = scan_interface(input_file)
+
+        # These are filled in as the stanzas stream past
+        classes_list = []
+        environments_list = []
+        relations_list = []
+
+        if args['jobs'] > 1:
+            report("Note: --jobs is ignored for command topics when streaming.")
+
+    else:
+
+        model_cache_path = get_build_cache_path(
+            Path.cwd() / 'build', f"interface2dita_model_{lang}", ".pickle")
+
+        with profile_phase("model cache"):
+            input_hash = get_content_hash(Path(input_file).read_bytes())
+            if args['force'] or model_cache_path is None:
+                model = None
+            else:
+                model = load_model_cache(model_cache_path, input_hash)
+
+        if model is not None:
+            report("Loaded the command model from the cache.")
+
+            commands_dict, variants_dict, classes_list, environments_list, relations_list = restore_model_cache(
+                model)
+
+        else:
+
+            with profile_phase("parse"):
+                full_tree = etree.parse(input_file)
+
+            # Process tree into dict of commands and variants
+
+            report("Processing interface file.")
+
+            with profile_phase("process_interface_tree"):
+                commands_dict, variants_dict, classes_list, environments_list, relations_list = process_interface_tree(
+                    full_tree)
+
+            with profile_phase("add_supporting_env_commands"):
+                if primary_structure is None:
+                    relations_list = add_supporting_env_commands(
+                        relations_list, commands_dict)
+                else:
+                    translated_relations = translate_relations(
+                        primary_structure, interface_structure)
+                    if translated_relations is None:
+                        logger.warning(
+                            "%s is not made of the same stanzas as the first interface file; working out its relations from its own names.", input_file)
+                        relations_list = add_supporting_env_commands(
+                            relations_list, commands_dict)
+                    else:
+                        relations_list = translated_relations
+
+            interface_structure['relations'] = relations_list
 
-    for argument_data in topic_data['arguments']:
-        if argument_data['type'] == 'OPTIONS':
-            refbody_element.append(add_topic_refbody_options(argument_data))
-        elif argument_data['type'] == 'SETTINGS':
-            refbody_element.append(add_topic_refbody_settings(argument_data))
+            # Nothing holds on to the tree any more
+            del full_tree
 
-    refbody_element.append(add_topic_notes())
-    refbody_element.append(add_topic_mwe())
-    refbody_element.append(add_topic_second_ex())
+            if model_cache_path is not None:
+                with profile_phase("model cache"):
+                    save_model_cache(model_cache_path, input_hash, commands_dict, variants_dict,
+                                     classes_list, environments_list, relations_list)
 
-    return refbody_element
+    report_stanza_collisions(stanza_index)
 
+    # Nothing looks stanzas up while streaming, so the index is let go once its
+    # collisions are reported
+    if args['all'] and args['stream']:
+        set_stanza_index(new_stanza_index())
 
-def add_topic_prolog(topic_data):
+    # When streaming, variants_dict holds the light entries from the scan, as
+    # the variants themselves are only decoded as they stream past
+    with profile_phase("inheritance index"):
+        inheritance_index = build_inheritance_index(
+            commands_dict, variants_dict)
+        variant_topic_names = get_variant_topic_names(variants_dict)
 
-    prolog_element = etree.Element('prolog')
+    report_inheritance_problems(inheritance_index)
 
-    # Source file (TODO: is this path reasonable?)
+    return classes_list, environments_list, relations_list
 
-    source_element = etree.Element('source')
-    source_element.text = f"tex/texmf-context/tex/context/base/mkiv/{topic_data['filename']}"
-    prolog_element.append(source_element)
 
-    # Critical Dates
+def build_language_topics(input_file, lang, args, classes_list, environments_list, relations_list,
+                          languages=None, import_manual_topics=True):
+    # Writes every topic and map for one language, and returns the change
+    # summary and the time each generated command and variant topic took
 
-    critdates_element = etree.Element('critdates')
+    global focus_path, old_manifest, output_lang
 
-    random_number_of_days = random.randrange(120, 240)
-    check_date = today + datetime.timedelta(days=random_number_of_days)
+    output_lang = lang
 
-    created_element = etree.Element(
-        'created', date=f"{today.strftime('%Y-%m-%d')}", expiry=f"{check_date.strftime('%Y-%m-%d')}")
-    critdates_element.append(created_element)
+    report("Generating command topics.")
 
-    revised_comment = etree.Comment(
-        '<revised date="YYYY-MM-DD" expiry="YYYY-MM-DD"/>')
-    critdates_element.append(revised_comment)
+    logger.debug("### Starting run of all commands!")
 
-    prolog_element.append(critdates_element)
+    command_timings = {}
 
-    # Metadata
+    # Setting up paths
 
-    metadata_element = etree.Element('metadata')
+    build_path = Path.cwd() / 'build'
+    build_path.mkdir(exist_ok=True, parents=True)
+    dita_path = Path.cwd() / 'build' / 'dita'
+    output_sink.make_dirs(dita_path)
 
-    if topic_data['is_system']:
-        audience_element = etree.Element('audience', type="internal")
-    else:
-        audience_element = etree.Element('audience', type="user")
-    metadata_element.append(audience_element)
+    focus_path = make_output_dirs(dita_path, lang, languages)
 
-    category_element = etree.Element('category')
-    category_element.text = topic_data['category']
-    metadata_element.append(category_element)
+    if import_manual_topics:
+        manual_topic_sync = start_manual_topic_sync(build_path, args)
 
-    keywords_element = etree.Element('keywords')
-    for kw in topic_data['keywords']:
-        keyword_element = etree.Element('keyword')
-        keyword_element.text = kw
-        keywords_element.append(keyword_element)
-    metadata_element.append(keywords_element)
+    manifest_path = get_build_cache_path(
+        build_path, f"interface2dita_manifest_{lang}", ".json")
 
-    prodinfo_string = """
-            <prodinfo>
-        <prodname>ConTeXt</prodname>
-          <vrmlist>
-            <vrm version="iv" release="production" modification=""/>
-          </vrmlist>
-        </prodinfo>"""
+    if args['force'] or manifest_path is None:
+        old_manifest = new_build_manifest()
+    else:
+        old_manifest = load_build_manifest(manifest_path)
 
-    prodinfo_element = etree.fromstring(prodinfo_string)
+    manifest = new_build_manifest()
+    unchanged_count = 0
 
-    metadata_element.append(prodinfo_element)
+    # Keep track of what commands we see for the maps
+    full_topics_list = []
+    user_topics_list = []
+    system_topics_list = []
 
-    prolog_element.append(metadata_element)
+    report("Writing topic files.")
 
-    return prolog_element
+    report("Writing command topics.")
 
+    for command_name, command_data in commands_dict.items():
+        full_topics_list.append(command_name)
+        if command_data.is_system:
+            system_topics_list.append(command_data.name)
+        else:
+            user_topics_list.append(command_data.name)
 
-def add_topic_shortdesc(topic_data):
-    cmdname_element = etree.Element('cmdname')
-    cmdname_element.text = f"\\{topic_data['name']}"
-    cmdname_element.tail = " command..."
+    progress = ProgressLine(f"{console_prefix}Command topics", len(commands_dict))
 
-    shortdesc_element = etree.Element('shortdesc', rev='0')
-    shortdesc_element.text = "The "
-    shortdesc_element.append(cmdname_element)
+    with profile_phase("command topics"):
+        if args['stream']:
+            command_results, variant_results = stream_command_topics(
+                input_file, classes_list, environments_list, relations_list, progress)
+            relations_dict = add_supporting_env_commands(
+                relations_list, commands_dict)
+        else:
+            command_results = run_topic_jobs(
+                generate_command_topics, list(commands_dict), args['jobs'], progress)
 
-    return shortdesc_element
+    progress.finish()
 
+    for command_name, manifest_entry, generated, timing in command_results:
+        manifest['commands'][command_name] = manifest_entry
+        if not generated:
+            unchanged_count += 1
+        else:
+            command_timings[command_name] = timing
 
-def add_topic_title(topic_data):
-    title_element = etree.Element('title')
-    title_element.text = f"\\{topic_data['name']}"
-    return title_element
+    report(
+        f"Command topics: {len(commands_dict) - unchanged_count} generated, {unchanged_count} unchanged.")
 
+    # Streamed variants are already written
+    if not args['stream']:
+        report("Writing variant topics.")
+        with profile_phase("variant topics"):
+            variant_results = run_topic_jobs(
+                generate_variant_topics, list(variants_dict), args['jobs'])
 
-def generate_dita_topic(topic_data):
-    topic = etree.Element('reference', id=f"r_command_{topic_data['name']}")
+    variant_unchanged_count = 0
 
-    attr = topic.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
+    for topic_name, manifest_entry, generated, timing in variant_results:
+        manifest['commands'][topic_name] = manifest_entry
+        if not generated:
+            variant_unchanged_count += 1
+        else:
+            command_timings[topic_name] = timing
 
-    topic.append(add_topic_title(topic_data))
-    topic.append(add_topic_shortdesc(topic_data))
-    topic.append(add_topic_prolog(topic_data))
-    topic.append(add_topic_refbody(topic_data))
-    topic.append(add_topic_rellinks(topic_data))
+    # A topic that could not be written must be generated again next time
+    with profile_phase("write drain"):
+        flush_background_writes()
+    failed_filenames = set(filename for filename, error in write_failures)
+    for topic_name in list(manifest['commands']):
+        if str(get_command_topic_path(topic_name, focus_path)) in failed_filenames:
+            del manifest['commands'][topic_name]
 
-    return topic
+    if manifest_path is not None:
+        save_build_manifest(manifest, manifest_path)
 
+    report(
+        f"Variant topics: {len(variant_results) - variant_unchanged_count} generated, {variant_unchanged_count} unchanged.")
 
-def generate_environment_topic(environment_name):
-    topic = etree.Element(
-        'concept', id=f"r_command_{environment_name}")
+    report("Writing class topics.")
+    with profile_phase("class topics"):
+        run_topic_jobs(generate_class_topics, classes_list, args['jobs'])
 
-    attr = topic.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
+    report("Writing environment topics.")
+    with profile_phase("environment topics"):
+        run_topic_jobs(generate_environment_topics,
+                       environments_list, args['jobs'])
 
-    keyword_element = etree.Element('keyword')
-    keyword_element.text = f"{environment_name}"
-    keyword_element.tail = " Environment"
+    report("Writing maps.")
 
-    title_element = etree.Element('title')
-    title_element.text = "The "
-    title_element.append(keyword_element)
-    topic.append(title_element)
+    with profile_phase("maps"):
+        write_inheritance_ditamap(donor_set, focus_path)
 
-    keyword_element = etree.Element('keyword')
-    keyword_element.text = f"{environment_name}"
-    keyword_element.tail = " environment..."
+        write_related_ditamap(relations_list, focus_path)
 
-    shortdesc_element = etree.Element('shortdesc', rev='0')
-    shortdesc_element.text = "The "
-    shortdesc_element.append(keyword_element)
-    topic.append(shortdesc_element)
+        # Ditamap files for DITA processors
+        write_command_ditamap(full_topics_list, focus_path,
+                              "full_commands.ditamap", "Full Commands")
+        write_command_ditamap(user_topics_list, focus_path,
+                              "user_commands.ditamap", "User Commands")
+        write_command_ditamap(system_topics_list, focus_path,
+                              "system_commands.ditamap", "System Commands")
 
-    conbody_element_string = """<conbody>
-    <section>
-      <p></p>
-    </section>
-  </conbody>
-    """
+        # # XML files for ConTeXt setups
+        write_command_ditamap(full_topics_list, focus_path,
+                              "full_commands.xml", "Full Commands")
+        write_command_ditamap(user_topics_list, focus_path,
+                              "user_commands.xml", "User Commands")
+        write_command_ditamap(system_topics_list, focus_path,
+                              "system_commands.xml", "System Commands")
 
-    topic.append(etree.fromstring(conbody_element_string))
+        write_classes_ditamap(classes_list, focus_path)
 
-    return topic
+        write_environments_ditamap(environments_list, focus_path)
 
+        # Alongside the command maps, for the same publications
+        variant_list = [variant for command in sorted(variants_dict)
+                        for variant in variants_dict[command]]
+        write_variants_ditamap(variant_list, focus_path,
+                               "full_variants.ditamap", "Full Command Variants")
+        write_variants_ditamap([variant for variant in variant_list if not variant.is_system], focus_path,
+                               "user_variants.ditamap", "User Command Variants")
+        write_variants_ditamap([variant for variant in variant_list if variant.is_system], focus_path,
+                               "system_variants.ditamap", "System Command Variants")
 
-def generate_class_topic(class_name):
-    topic = etree.Element('concept', id=f"c_class_{class_name}")
+    with profile_phase("write drain"):
+        flush_background_writes()
 
-    attr = topic.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
+    report_write_failures()
 
-    keyword_element = etree.Element('keyword')
-    keyword_element.text = f"{class_name}"
-    keyword_element.tail = " Class"
+    if import_manual_topics:
+        manual_topic_sync.finish()
 
-    title_element = etree.Element('title')
-    title_element.text = "The "
-    title_element.append(keyword_element)
-    topic.append(title_element)
+    removed_topics = find_removed_topics(focus_path)
 
-    keyword_element = etree.Element('keyword')
-    keyword_element.text = f"{class_name}"
-    keyword_element.tail = " class..."
+    if args['prune']:
+        prune_removed_topics(removed_topics)
+    else:
+        keep_removed_topics(removed_topics)
 
-    shortdesc_element = etree.Element('shortdesc', rev='0')
-    shortdesc_element.text = "The "
-    shortdesc_element.append(keyword_element)
-    topic.append(shortdesc_element)
+    change_summary = summarize_changes(focus_path, removed_topics)
 
-    conbody_element_string = """<conbody>
-    <section>
-      <p></p>
-    </section>
-  </conbody>
-    """
+    report(
+        f"Topics and maps: {len(change_summary['added'])} added, {len(change_summary['changed'])} changed, {len(change_summary['unchanged'])} unchanged, {len(change_summary['removed'])} {'removed' if args['prune'] else 'stale'}.")
 
-    topic.append(etree.fromstring(conbody_element_string))
+    return change_summary, command_timings
 
-    return topic
 
+def build_language(input_file, lang, args, languages, primary_model, summary_sender):
+    # In a process of its own: the first language's model is already loaded,
+    # and the others are loaded here using its structure. Each interface file
+    # names its commands, keys and values in its own language, so there is no
+    # model to share but the structure; decoding the other files before the
+    # fork would only do one after another what the processes do at once. The
+    # inheritance index is keyed by the translated names too, and takes a few
+    # milliseconds to build next to the decoding.
 
-# --- Dealing With Output
+    global console_prefix, output_sink
 
-def make_output_dirs(base_path, lang):
+    console_prefix = f"[{lang}] "
+    random.seed()
 
-    # Setup areas for common and translation
-    common_path = base_path / 'common'
-    common_path.mkdir(exist_ok=True)
-    supported_languages = ['en']
+    if not output_sink.forkable:
+        output_sink = ForwardingSink(output_sink)
 
-    for language in supported_languages:
-        lp = base_path / language
-        lp.mkdir(exist_ok=True)
+    if primary_model is None:
+        # Start from what the first language's model left behind
+        primary_structure = dict(interface_structure)
+        phase_timings.clear()
+        donor_set.clear()
+        unknown_argument_tags.clear()
+        unknown_argument_lines.clear()
+        model = load_command_model(input_file, lang, args, primary_structure)
+    else:
+        model = primary_model
 
-    focus_path = base_path / lang
+    change_summary, command_timings = build_language_topics(
+        input_file, lang, args, *model, languages=languages, import_manual_topics=False)
 
-    topic_areas = ["commands", "classes", "environments", "frontmatter", "glossary",
-                   "out", "arguments", "support", "temp", ]
+    flush_background_writes()
 
-    for directory in topic_areas:
-        topic_area = focus_path / directory
-        topic_area.mkdir(exist_ok=True)
+    summary_sender.send(
+        (change_summary, getattr(output_sink, 'entries', [])))
+    summary_sender.close()
 
-    for directory in string.ascii_lowercase:
-        command_area = focus_path / "commands" / directory
-        command_area.mkdir(exist_ok=True)
+    report_unknown_argument_tags()
 
-    return focus_path
+    if args['profile']:
+        print_profile_report(command_timings, args['profile_top'])
 
+    if write_failures:
+        raise SystemExit(1)
 
-def import_manually_edited_topics(met_path, build_path):
-    copy_tree(str(met_path), str(build_path), update=1)
 
+def build_languages(language_pairs, args, primary_model):
+    # One process per language, all at once; returns each language's change
+    # summary, or exits if any of them failed
 
-def write_class_topic(class_topic, name, path):
+    languages = [lang for input_file, lang in language_pairs]
 
-    filename = path / "classes" / f"c_class_{name}.dita"
+    build_path = Path.cwd() / 'build'
+    dita_path = build_path / 'dita'
+    output_sink.make_dirs(dita_path)
+    make_output_dirs(dita_path, languages[0], languages)
 
-    output_bytes = etree.tostring(class_topic,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE concept PUBLIC "-//OASIS//DTD DITA Concept//EN" "concept.dtd">''')
+    # Once for every language, while they are built
+    flush_background_writes()
+    manual_topic_sync = start_manual_topic_sync(build_path, args)
 
-    output = output_bytes.decode("utf-8")
+    context = multiprocessing.get_context("fork")
+    processes = []
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
+    for index, (input_file, lang) in enumerate(language_pairs):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=build_language, args=(
+            input_file, lang, args, languages, primary_model if index == 0 else None, sender))
+        process.start()
+        # Only the child may send, so that receiving fails if it dies first
+        sender.close()
+        processes.append((lang, process, receiver))
 
-    with open(filename, 'w') as f:
-        f.write(output)
+    # The summaries are read before the processes are joined, as a child
+    # cannot exit while its summary is still waiting in the pipe
+    change_summaries = {}
 
+    for lang, process, receiver in processes:
+        try:
+            change_summaries[lang], sink_entries = receiver.recv()
+            replay_sink_entries(sink_entries)
+        except EOFError:
+            pass
+        process.join()
 
-def write_environment_topic(environment_topic, name, path):
+    manual_topic_sync.finish()
 
-    filename = path / "environments" / f"c_environment_{name}.dita"
+    failed = [lang for lang, process, receiver in processes
+              if process.exitcode != 0 or lang not in change_summaries]
 
-    output_bytes = etree.tostring(environment_topic,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE concept PUBLIC "-//OASIS//DTD DITA Concept//EN" "concept.dtd">''')
+    if failed:
+        raise SystemExit(
+            f"Building {', '.join(failed)} failed; see the log.")
 
-    output = output_bytes.decode("utf-8")
+    return {lang: change_summaries[lang] for lang in languages}
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
 
-    with open(filename, 'w') as f:
-        f.write(output)
+# --- Interface Diff ---
 
+# --diff OLD NEW compares two versions of the interface by their command models
+# rather than their XML. It finds commands added and removed, and commands that
+# moved between class, environment and command stanzas. For commands whose
+# stanzas changed, it spells out what changed in their arguments, options and
+# settings keys. Commands inherit a donor's options1 and settings1 tables, so
+# when those change (or the donor comes or goes), every command inheriting from
+# it, directly or not, is listed too. With --all, exactly these topics are
+# generated again, and the rest are kept.
 
-def write_command_topic(topic_element, name, path):
+def load_interface_version(input_file):
+    # The full command model of another version of the interface, by topic
+    # name, and the classification of its stanzas; the module state stays as
+    # the model being built left it
 
-    filename = path / "commands" / name[0].lower() / f"r_command_{name}.dita"
+    saved_donors = set(donor_set)
+    saved_stanza_index = dict(stanza_index)
+    saved_structure = dict(interface_structure)
+    saved_tags = Counter(unknown_argument_tags)
+    saved_lines = dict(unknown_argument_lines)
 
-    output_bytes = etree.tostring(topic_element,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE reference PUBLIC "-//OASIS//DTD DITA Reference//EN" "reference.dtd">''')
+    try:
+        commands, variants = process_interface_tree(etree.parse(str(input_file)))[:2]
+        classification = get_stanza_classification(interface_structure)
+    finally:
+        donor_set.clear()
+        donor_set.update(saved_donors)
+        set_stanza_index(saved_stanza_index)
+        set_interface_structure(saved_structure)
+        unknown_argument_tags.clear()
+        unknown_argument_tags.update(saved_tags)
+        unknown_argument_lines.clear()
+        unknown_argument_lines.update(saved_lines)
 
-    output = output_bytes.decode("utf-8")
+    return get_diff_topics(commands, variants), classification
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
 
-    with open(filename, 'w') as f:
-        f.write(output)
+def get_diff_topics(commands_dict, variants_dict):
+    topics = dict(commands_dict)
 
+    for variants in variants_dict.values():
+        for variant_data in variants:
+            topics[get_topic_name(variant_data)] = variant_data
 
-def write_inheritance_ditamap(donor_set, path):
-    inheritance_map = etree.Element('map')
-    attr = inheritance_map.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
+    return topics
 
-    title_element = etree.Element('title')
-    title_element.text = "Command Inheritance"
-    inheritance_map.append(title_element)
 
-    inheritance_map.append(etree.Comment(
-        "Conrefs for commands that use settings that other command inheirit. We only ever want to update these in one place, and have all of the dependant commands also update."))
+def get_stanza_classification(structure):
+    # class, environment or command, by stanza name, as get_stanza_type had
+    # them; a command that becomes an environment keeps its stanza name, but
+    # not its command names
 
-    for donor in donor_set:
-        keydef_element = etree.Element(
-            'keydef', keys=f"command_{donor}", href=f"commands/{donor[0]}/r_command_{donor}.dita")
-        inheritance_map.append(keydef_element)
+    classification = {}
 
-    filename = path / "inheritance.ditamap"
+    for stanza_name, stanza_type in zip(structure['stanza_names'], structure['stanza_types']):
+        if stanza_type != "variant":
+            classification.setdefault(stanza_name, stanza_type)
 
-    output_bytes = etree.tostring(inheritance_map,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">''')
+    return classification
 
-    output = output_bytes.decode("utf-8")
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
+def get_record_fields(record, skipped=('stanza_hash',)):
+    return {field: value for field, value in record.as_dict().items() if field not in skipped}
 
-    with open(filename, 'w') as f:
-        f.write(output)
 
+def get_argument_label(argument, position):
+    return argument.name or f"argument {position} ({argument.type})"
 
-def get_reltable_width(related_list):
 
-    longest_row = 1
+def get_value_label(value):
+    if value.type == "argument":
+        return value.text.lower()
+    return value.text
 
-    for row in related_list:
-        if 'instances' in row:
-            if len(row['instances']) > longest_row:
-                longest_row = len(row['instances'])
 
-    # We add two here to accomodate a link to the umbrella topic for the class, the environment, or both
-    return longest_row + 2
+def diff_values(label, old_values, new_values, noun):
+    # Options, or the keys of a setting; inherited ones by donor
 
+    changes = []
 
-def write_related_ditamap(related_list, path):
+    old_donors = [value.donor for value in old_values if value.type == "inherit"]
+    new_donors = [value.donor for value in new_values if value.type == "inherit"]
+    old_by_label = {get_value_label(value): value for value in old_values if value.type != "inherit"}
+    new_by_label = {get_value_label(value): value for value in new_values if value.type != "inherit"}
 
-    reltable_width = get_reltable_width(related_list)
-    relationship_map = etree.Element('map')
-    attr = relationship_map.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
+    for value_label in old_by_label:
+        if value_label not in new_by_label:
+            changes.append(f"{label}: removed {noun} {value_label}")
 
-    title_element = etree.Element('title')
-    title_element.text = "Command Relationships"
+    for value_label, value in new_by_label.items():
+        if value_label not in old_by_label:
+            changes.append(f"{label}: added {noun} {value_label}")
+        elif value.default != old_by_label[value_label].default:
+            changes.append(
+                f"{label}: {value_label} is {'now' if value.default else 'no longer'} the default")
 
-    relationship_map.append(etree.Comment(
-        "Reltable for related commands: each row with as many cells needed for all of the related commands to that particular command."))
+    for donor in old_donors:
+        if donor not in new_donors:
+            changes.append(f"{label}: no longer inherits from \\{donor}")
 
-    reltable_element = etree.Element('reltable')
+    for donor in new_donors:
+        if donor not in old_donors:
+            changes.append(f"{label}: now inherits from \\{donor}")
 
-    relheader_element = etree.Element('relheader')
+    return changes
 
-    for i in range(reltable_width):
-        relheader_element.append(etree.Element('relcolspec', type='reference'))
 
-    reltable_element.append(relheader_element)
+def diff_settings(label, old_settings, new_settings):
+    changes = []
 
-    for row in related_list:
-        relrow_element = etree.Element('relrow')
-        # print(row)
-        if 'stem' in row:
-            # print(f"Found environment")
-            relcell_element = etree.Element('relcell')
-            relcell_element.attrib['collection-type'] = "family"
-            topicref_element = etree.Element(
-                'topicref', keyref=f"environment_{row['stem']}")
-            relcell_element.append(topicref_element)
-            for member in row['members']:
-                topicref_element = etree.Element(
-                    'topicref', keyref=f"command_{member}")
-                relcell_element.append(topicref_element)
-            relrow_element.append(relcell_element)
-            for i in range(reltable_width - len(relrow_element)):
-                relrow_element.append(etree.Element('relcell'))
+    old_by_name = {setting.name: setting for setting in old_settings if setting.type != "inherit"}
+    new_by_name = {setting.name: setting for setting in new_settings if setting.type != "inherit"}
 
-        elif 'name' in row:
-            # print(f"Found class")
-            relcell_element = etree.Element('relcell')
-            topicref_element = etree.Element(
-                'topicref', keyref=f"class_{row['name']}")
-            relcell_element.append(topicref_element)
-            relrow_element.append(relcell_element)
+    for name in old_by_name:
+        if name not in new_by_name:
+            changes.append(f"{label}: removed key {name}")
 
-            for instance in row['instances']:
-                # Make a relcell
-                relcell_element = etree.Element('relcell')
-                # populate the relcell
-                if type(instance) == str:
-                    relcell_element = etree.Element('relcell')
-                    topicref_element = etree.Element(
-                        'topicref', keyref=f"command_{instance}")
-                    relcell_element.append(topicref_element)
-                elif type(instance) == dict:
-                    relcell_element = etree.Element('relcell')
-                    relcell_element.attrib['collection-type'] = "family"
-                    topicref_element = etree.Element(
-                        'topicref', keyref=f"environment_{instance['stem']}")
-                    relcell_element.append(topicref_element)
-                    for member in instance['members']:
-                        topicref_element = etree.Element(
-                            'topicref', keyref=f"command_{member}")
-                        relcell_element.append(topicref_element)
-                    relrow_element.append(relcell_element)
-                # add relcell to row
-                relrow_element.append(relcell_element)
+    for name, setting in new_by_name.items():
+        if name not in old_by_name:
+            changes.append(f"{label}: added key {name}")
+        else:
+            changes.extend(diff_values(f"{label} {name}", old_by_name[name].keys or (),
+                                       setting.keys or (), "value"))
 
-            # pad row with empty cells
-            for i in range(reltable_width - len(relrow_element)):
-                relrow_element.append(etree.Element('relcell'))
+    # Settings inherited whole are listed by donor, as options are
+    changes.extend(diff_values(label, [setting for setting in old_settings if setting.type == "inherit"],
+                               [setting for setting in new_settings if setting.type == "inherit"], "key"))
 
-        reltable_element.append(relrow_element)
+    return changes
 
-    relationship_map.append(reltable_element)
 
-    filename = path / "relations.ditamap"
+def diff_argument(old_argument, new_argument, position):
+    label = get_argument_label(new_argument, position)
+    changes = []
 
-    output_bytes = etree.tostring(relationship_map,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">''')
+    if old_argument.type != new_argument.type:
+        return [f"{label}: was {old_argument.type}"]
 
-    output = output_bytes.decode("utf-8")
+    if old_argument.optional != new_argument.optional:
+        changes.append(f"{label}: {'now' if new_argument.optional else 'no longer'} optional")
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
+    if old_argument.delimiters != new_argument.delimiters:
+        changes.append(f"{label}: delimiters {old_argument.delimiters} became {new_argument.delimiters}")
 
-    with open(filename, 'w') as f:
-        f.write(output)
+    if new_argument.type == "SETTINGS":
+        changes.extend(diff_settings(label, old_argument.children or (), new_argument.children or ()))
+    elif new_argument.children is not None or old_argument.children is not None:
+        changes.extend(diff_values(label, old_argument.children or (), new_argument.children or (), "option"))
 
+    return changes
 
-def write_environments_ditamap(environments_list, path):
-    environments_map = etree.Element('map')
-    attr = environments_map.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
 
-    title_element = etree.Element('title')
-    title_element.text = "Environments"
-    environments_map.append(title_element)
+def diff_command(old_data, new_data):
+    # What changed, in words, and whether the options1 or settings1 tables that
+    # inheritors pull in are among it
 
-    for environment in sorted(environments_list):
-        topicref_element = etree.Element(
-            'topicref', keys=f"environment_{environment}", href=f"environments/c_environment_{environment}.dita")
-        environments_map.append(topicref_element)
+    changes = []
 
-    filename = path / "environments.ditamap"
+    for field in ('is_system', 'category', 'keywords', 'filename'):
+        old_value = getattr(old_data, field)
+        new_value = getattr(new_data, field)
+        if old_value != new_value:
+            changes.append(f"{field}: {old_value} became {new_value}")
 
-    output_bytes = etree.tostring(environments_map,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">''')
+    old_arguments = old_data.arguments or ()
+    new_arguments = new_data.arguments or ()
 
-    output = output_bytes.decode("utf-8")
+    for position, (old_argument, new_argument) in enumerate(
+            zip_longest(old_arguments, new_arguments), start=1):
+        if new_argument is None:
+            changes.append(f"{get_argument_label(old_argument, position)}: removed")
+        elif old_argument is None:
+            changes.append(f"{get_argument_label(new_argument, position)}: added")
+        elif get_record_fields(old_argument) != get_record_fields(new_argument):
+            changes.extend(diff_argument(old_argument, new_argument, position))
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
+    if not changes:
+        # Nothing spelled out above, but the records differ all the same
+        changes.append("changed")
 
-    with open(filename, 'w') as f:
-        f.write(output)
+    tables_changed = get_inherited_tables(old_data) != get_inherited_tables(new_data)
 
+    return changes, tables_changed
 
-def write_classes_ditamap(classes_list, path):
-    classes_map = etree.Element('map')
-    attr = classes_map.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
 
-    title_element = etree.Element('title')
-    title_element.text = "Classes"
-    classes_map.append(title_element)
+def get_inherited_tables(command_data):
+    return {argument.name: get_record_fields(argument) for argument in command_data.arguments or ()
+            if argument.name in ("options1", "settings1")}
 
-    for cmd_class in sorted(classes_list):
-        topicref_element = etree.Element(
-            'topicref', keys=f"class_{cmd_class}", href=f"classes/c_class_{cmd_class}.dita")
-        classes_map.append(topicref_element)
 
-    filename = path / "classes.ditamap"
+def diff_interfaces(old_topics, old_classification, new_topics, new_classification, index):
+    # index is the inheritance index of the new interface
 
-    output_bytes = etree.tostring(classes_map,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">''')
+    added = sorted(set(new_topics) - set(old_topics))
+    removed = sorted(set(old_topics) - set(new_topics))
 
-    output = output_bytes.decode("utf-8")
+    # Where the reclassified stanzas now are, from the stanza index of the new
+    # interface
+    reclassified = {}
+    for stanza_name, stanza_type in sorted(new_classification.items()):
+        old_type = old_classification.get(stanza_name)
+        if old_type is not None and old_type != stanza_type:
+            records = [record for record in find_stanzas(name=stanza_name)
+                       if record['key'][1] == stanza_type]
+            reclassified[stanza_name] = {
+                'was': old_type,
+                'now': stanza_type,
+                'file': records[0]['file'] if records else None,
+                'sourceline': records[0]['sourceline'] if records else None,
+            }
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
+    changed = {}
+    changed_donors = set(added) | set(removed)
 
-    with open(filename, 'w') as f:
-        f.write(output)
+    for topic_name in sorted(set(old_topics) & set(new_topics)):
+        old_data = old_topics[topic_name]
+        new_data = new_topics[topic_name]
 
+        if old_data.stanza_hash == new_data.stanza_hash:
+            continue
 
-def write_command_ditamap(command_list, path, map_filename, map_title):
-    command_map = etree.Element('map')
-    attr = command_map.attrib
-    attr['{http://www/w3/org/XML/1998/namespace}lang'] = "en"
+        if get_record_fields(old_data) == get_record_fields(new_data):
+            # The stanza changed, but nothing a topic shows
+            continue
 
-    title_element = etree.Element('title')
-    title_element.text = map_title
-    command_map.append(title_element)
+        changes, tables_changed = diff_command(old_data, new_data)
+        changed[topic_name] = changes
+        if tables_changed:
+            changed_donors.add(topic_name)
+
+    inheritors = {}
+    for inheritor in sorted(index['inheritors']):
+        via = [donor for donor in get_transitive_donors(inheritor, index['inheritors'])
+               if donor in changed_donors]
+        if via:
+            inheritors[inheritor] = via
+
+    # A command's topic links to each of its variants
+    variant_bases = set()
+    for topic_name in added:
+        if new_topics[topic_name].variant_id is not None:
+            variant_bases.add(new_topics[topic_name].name)
+    for topic_name in removed:
+        if old_topics[topic_name].variant_id is not None:
+            variant_bases.add(old_topics[topic_name].name)
+
+    regenerate = set(added) | set(changed) | set(inheritors) | \
+        ((set(reclassified) | variant_bases) & set(new_topics))
+
+    return {
+        'added': added,
+        'removed': removed,
+        'reclassified': reclassified,
+        'changed': changed,
+        'inheritors': inheritors,
+        'regenerate': sorted(regenerate),
+    }
 
-    for command in sorted(command_list):
-        topicref_element = etree.Element(
-            'topicref', keys=f"command_{command}", href=f"commands/{command[0]}/r_command_{command}.dita")
-        command_map.append(topicref_element)
 
-    filename = path / map_filename
+def print_interface_diff(interface_diff):
+    print(f"## Added ({len(interface_diff['added'])})")
+    for topic_name in interface_diff['added']:
+        print(f"\\{topic_name}")
 
-    output_bytes = etree.tostring(command_map,
-                                  pretty_print=True,
-                                  xml_declaration=True,
-                                  encoding='UTF-8',
-                                  doctype='''<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">''')
+    print(f"## Removed ({len(interface_diff['removed'])})")
+    for topic_name in interface_diff['removed']:
+        print(f"\\{topic_name}")
 
-    output = output_bytes.decode("utf-8")
+    print(f"## Reclassified ({len(interface_diff['reclassified'])})")
+    for stanza_name, change in interface_diff['reclassified'].items():
+        print(f"{stanza_name}: {change['was']} became {change['now']} ({change['file']}, line {change['sourceline']})")
 
-    output = output.replace(
-        'xmlns:ns0="http://www/w3/org/XML/1998/namespace" ', '')
-    output = output.replace('ns0:lang="en"', 'xml:lang="en"')
+    print(f"## Changed ({len(interface_diff['changed'])})")
+    for topic_name, changes in interface_diff['changed'].items():
+        print(f"\\{topic_name}")
+        for change in changes:
+            print(f"  {change}")
 
-    with open(filename, 'w') as f:
-        f.write(output)
+    print(f"## Inherited tables changed ({len(interface_diff['inheritors'])})")
+    for inheritor, donors in interface_diff['inheritors'].items():
+        donor_names = ", ".join(f"\\{donor}" for donor in donors)
+        print(f"\\{inheritor}, from {donor_names}")
+
+    print(f"## Topics to generate again: {len(interface_diff['regenerate'])}")
 
 
 # --- Main ---
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Client settings")
-    parser.add_argument("--input", type=str, default="context-en.xml")
-    parser.add_argument("--lang", type=str, default="en")
+    parser.add_argument("--input", type=str, nargs="+", default=["context-en.xml"],
+                        help="interface files, one for each --lang")
+    parser.add_argument("--lang", type=str, nargs="+", default=["en"],
+                        help="languages of the interface files; several are built at once")
     parser.add_argument("--name", type=str)
     parser.add_argument("--all", action="store_true")
+    parser.add_argument("--diff", type=str, nargs=2, metavar=("OLD", "NEW"),
+                        help="report what changed between two interface files; with --all, generate again only the topics that changed, from NEW")
+    parser.add_argument("--diff-file", type=str,
+                        help="write the --diff report to this JSON file")
     parser.add_argument("--test", action="store_true")
+    parser.add_argument("--force", action="store_true",
+                        help="ignore the build manifest and regenerate every command topic")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes used to generate topics")
+    parser.add_argument("--stream", action="store_true",
+                        help="with --all, read the interface file one stanza at a time")
+    parser.add_argument("--compact", action="store_true",
+                        help="write topics and maps without indentation")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="write the same bytes for the same input; implied by SOURCE_DATE_EPOCH, which sets the date")
+    parser.add_argument("--sink", choices=["directory", "zip", "tar", "memory"], default="directory",
+                        help="where topics and maps go: files under build/, one archive, or nowhere (for timing)")
+    parser.add_argument("--archive", type=str,
+                        help="with --sink zip or tar, the archive to write (build/dita.zip or build/dita.tar by default)")
+    parser.add_argument("--write-threads", type=int, default=4,
+                        help="threads writing files in the background while topics are generated; 0 writes them as they are made")
+    parser.add_argument("--summary-file", type=str,
+                        help="write the added/changed/removed/unchanged files to this JSON file")
+    parser.add_argument("--prune", action="store_true",
+                        help="delete topics of commands that are no longer in the interface, and manually edited topics that were deleted")
+    parser.add_argument("--link-manual-topics", action="store_true",
+                        help="hard link the manually edited topics into the build directory rather than copying them")
+    parser.add_argument("--quiet", action="store_true",
+                        help="print nothing but errors and requested reports")
+    parser.add_argument("--verbose", action="store_true",
+                        help="log every command as it is processed, to the console too")
+    parser.add_argument("--log-file", type=str, default="interface2dita_debug.log",
+                        help="where to write the log; an empty string turns it off")
+    parser.add_argument("--profile", action="store_true",
+                        help="report phase timings and the most expensive topics")
+    parser.add_argument("--profile-top", type=int, default=20,
+                        help="how many topics the profile report lists")
+    parser.add_argument("--profile-output", type=str,
+                        help="write cProfile statistics (pstats) to this file")
+    parser.add_argument("--profile-stacks", type=str,
+                        help="write sampled stacks in flame graph collapsed format to this file")
     args = vars(parser.parse_args())
 
-    input_file = args['input']
+    if args['diff']:
+        if len(args['lang']) > 1:
+            raise SystemExit("--diff compares the interface files of one language.")
+        if args['stream']:
+            raise SystemExit("--diff needs the full command model; leave out --stream.")
+        args['input'] = args['diff'][1:]
+
+    language_pairs = get_language_pairs(args['input'], args['lang'])
 
-    full_tree = etree.parse(input_file)
+    # --name and --test only look at the first language
+    input_file, lang = language_pairs[0]
+    output_lang = lang
 
-    today = datetime.date.today()
+    console_quiet = args['quiet']
 
-    print("Starting up.")
+    configure_logging(args['log_file'], args['verbose'], args['quiet'])
 
-    # Process tree into dict of commands and variants
+    pretty_print_output = not args['compact']
 
-    print("Processing interface file.")
+    write_threads = args['write_threads']
 
-    commands_dict, variants_dict, classes_list, environments_list, relations_list = process_interface_tree(
-        full_tree)
+    reproducible_build = args['reproducible'] or "SOURCE_DATE_EPOCH" in os.environ
 
-    relations_dict = add_supporting_env_commands(relations_list, commands_dict)
+    today = get_build_date()
 
     if args['all']:
+        output_sink = new_output_sink(
+            args['sink'], Path.cwd() / 'build', args['archive'])
 
-        print("Generating command topics.")
+    # Only topics generated in this process show up in cProfile and stack
+    # samples, so profile with --jobs 1 and one language to see the builders
+    if args['profile_output']:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-        logger.debug("### Starting run of all commands!")
+    if args['profile_stacks']:
+        start_stack_sampling()
 
-        # Setting up paths
+    command_timings = {}
 
-        build_path = Path.cwd() / 'build'
-        build_path.mkdir(exist_ok=True, parents=True)
-        dita_path = Path.cwd() / 'build' / 'dita'
-        dita_path.mkdir(exist_ok=True, parents=True)
+    report("Starting up.")
 
-        manual_topics_path = Path.cwd() / 'manually_edited_topics'
+    if args['name'] and not args['all']:
 
-        focus_path = make_output_dirs(dita_path, args['lang'])
+        # Just the requested stanza; everything else comes from the name index
 
-        # Keep track of what commands we see for the maps
-        full_topics_list = []
-        user_topics_list = []
-        system_topics_list = []
+        name_index_path = Path.cwd() / 'build' / \
+            f"interface2dita_names_{lang}.json"
 
-        print("Writing topic files.")
+        with profile_phase("name index"):
+            name_index = get_name_index(input_file, name_index_path)
 
-        print("Writing command topics.")
+        commands_dict = get_indexed_commands(name_index)
+        variants_dict = get_indexed_variants(name_index)
+        variant_topics = get_indexed_variant_topics(name_index)
+        requested_command = None
 
-        for num, (command_name, command_data) in enumerate(commands_dict.items()):
-            logger.info(f"{num:04}: Processing {command_data['name']}...")
+        if args['name'] in commands_dict:
+            requested_stanza = read_indexed_stanza(
+                input_file, name_index, name_index['commands'][args['name']])
+            stanza_commands = {}
+            process_stanza(requested_stanza, stanza_commands, [], [], [])
+            commands_dict.update(stanza_commands)
+            requested_command = commands_dict[args['name']]
 
-            command_data = commands_dict[command_name]
+        elif args['name'] in variant_topics:
+            command_name, stanza_number = variant_topics[args['name']]
+            requested_stanza = read_indexed_stanza(
+                input_file, name_index, stanza_number)
+            # Decoded in full, as when streaming, as its base stanza is not read
+            stanza_variants = {}
+            process_stanza(requested_stanza, commands_dict, [], [], [],
+                           variants_dict=stanza_variants)
+            requested_command = next(variant_data for variant_data in stanza_variants[command_name]
+                                     if get_topic_name(variant_data) == args['name'])
 
-            xml_topic = generate_dita_topic(command_data)
+        report_stanza_collisions(stanza_index)
 
-            full_topics_list.append(command_name)
-            if command_data['is_system']:
-                system_topics_list.append(command_data['name'])
-            else:
-                user_topics_list.append(command_data['name'])
+        with profile_phase("inheritance index"):
+            inheritance_index = build_inheritance_index(
+                commands_dict, variants_dict)
+            variant_topic_names = get_variant_topic_names(variants_dict)
+
+        report_inheritance_problems(inheritance_index)
 
-            write_command_topic(xml_topic, command_name, focus_path)
+    else:
 
-        print("Writing class topics.")
-        for cmd_class in classes_list:
-            write_class_topic(generate_class_topic(
-                cmd_class), cmd_class, focus_path)
+        classes_list, environments_list, relations_list = load_command_model(
+            input_file, lang, args)
 
-        print("Writing environment topics.")
-        for environment in environments_list:
-            write_environment_topic(generate_environment_topic(
-                environment), environment, focus_path)
+    if args['diff']:
 
-        print("Writing maps.")
+        report("Processing the old interface file.")
 
-        write_inheritance_ditamap(donor_set, focus_path)
+        with profile_phase("diff"):
+            old_topics, old_classification = load_interface_version(
+                args['diff'][0])
+            interface_diff = diff_interfaces(
+                old_topics, old_classification, get_diff_topics(commands_dict, variants_dict),
+                get_stanza_classification(interface_structure), inheritance_index)
 
-        write_related_ditamap(relations_list, focus_path)
+        print_interface_diff(interface_diff)
 
-        # Ditamap files for DITA processors
-        write_command_ditamap(full_topics_list, focus_path,
-                              "full_commands.ditamap", "Full Commands")
-        write_command_ditamap(user_topics_list, focus_path,
-                              "user_commands.ditamap", "User Commands")
-        write_command_ditamap(system_topics_list, focus_path,
-                              "system_commands.ditamap", "System Commands")
+        if args['diff_file']:
+            with open(args['diff_file'], 'w') as f:
+                json.dump(interface_diff, f, indent=1)
 
-        # # XML files for ConTeXt setups
-        write_command_ditamap(full_topics_list, focus_path,
-                              "full_commands.xml", "Full Commands")
-        write_command_ditamap(user_topics_list, focus_path,
-                              "user_commands.xml", "User Commands")
-        write_command_ditamap(system_topics_list, focus_path,
-                              "system_commands.xml", "System Commands")
+        if args['all']:
+            regenerate_topics = set(interface_diff['regenerate'])
 
-        write_classes_ditamap(classes_list, focus_path)
+    if args['all'] and len(language_pairs) > 1:
 
-        write_environments_ditamap(environments_list, focus_path)
+        if args['stream']:
+            report("Note: relations are worked out for each language separately when streaming.")
+
+        report(f"Building {len(language_pairs)} languages at once.")
+
+        change_summaries = build_languages(
+            language_pairs, args, (classes_list, environments_list, relations_list))
+
+        if args['summary_file']:
+            with open(args['summary_file'], 'w') as f:
+                json.dump(change_summaries, f, indent=1)
+
+        report("Done.")
+
+    elif args['all']:
 
-        print("Importing manually edited topics.")
+        change_summary, command_timings = build_language_topics(
+            input_file, lang, args, classes_list, environments_list, relations_list)
 
-        import_manually_edited_topics(manual_topics_path, build_path)
+        if args['summary_file']:
+            with open(args['summary_file'], 'w') as f:
+                json.dump(change_summary, f, indent=1)
 
-        print("Done.")
+        report("Done.")
 
     elif args['name']:
         # show individual dita
 
         req_name = args['name']
 
-        logger.debug(f"### Processing for command {req_name}!")
+        logger.debug("### Processing for command %s!", req_name)
 
-        if req_name in commands_dict:
-
-            requested_command = commands_dict[req_name]
+        if requested_command is not None:
 
             print(f"## XML stanza:")
-            print(ppxml(requested_command['tree']))
+            print(ppxml(requested_stanza))
 
             print("## Resulting Data Structure")
             pp = pprint.PrettyPrinter(indent=2)
-            pp.pprint(requested_command)
+            pp.pprint(requested_command.as_dict())
 
             print("## DITA Output:")
             print(ppxml(generate_dita_topic(requested_command)))
 
         else:
-            print(f"Command name {commands_dict[req_name]} unknown!")
+            print(f"Command name {req_name} unknown!")
+            suggestions = suggest_command_names(
+                req_name, [*commands_dict, *variant_topics])
+            if suggestions:
+                print(f"Did you mean: {', '.join(suggestions)}?")
 
     elif args['test']:
         print("Data generated.")
@@ -1954,7 +5040,27 @@ if __name__ == "__main__":
         print("## Relations Data Structure")
         pp = pprint.PrettyPrinter(indent=2)
         pp.pprint(relations_list)
-    else:
+    elif not args['diff']:
         print("No action taken")
 
+    if len(language_pairs) == 1 or not args['all']:
+        report_unknown_argument_tags()
+
+    if args['profile_stacks']:
+        stop_stack_sampling()
+        write_collapsed_stacks(args['profile_stacks'])
+
+    if args['profile_output']:
+        profiler.disable()
+        profiler.dump_stats(args['profile_output'])
+
+    if args['profile'] and (len(language_pairs) == 1 or not args['all']):
+        print_profile_report(command_timings, args['profile_top'])
+
     logger.debug("\n*\n*\n*")
+
+    flush_background_writes()
+    output_sink.close()
+
+    if write_failures:
+        sys.exit(1)
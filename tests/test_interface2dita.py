@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_PATH))
+
+import interface2dita as i2d  # noqa: E402
+
+
+# --- Interface Diff ---
+
+def test_diff_regenerates_base_of_removed_variant():
+    command = i2d.CommandRecord("definecolor", stanza_hash="command")
+    variant = i2d.CommandRecord("definecolor", stanza_hash="variant", variant_id="name")
+
+    old_topics = {"definecolor": command, "definecolor_name": variant}
+    new_topics = {"definecolor": command}
+
+    interface_diff = i2d.diff_interfaces(
+        old_topics, {}, new_topics, {}, {'inheritors': {}})
+
+    assert interface_diff['removed'] == ["definecolor_name"]
+    assert interface_diff['regenerate'] == ["definecolor"]
+
+
+def test_diff_regenerates_base_of_added_variant():
+    command = i2d.CommandRecord("definecolor", stanza_hash="command")
+    variant = i2d.CommandRecord("definecolor", stanza_hash="variant", variant_id="name")
+
+    old_topics = {"definecolor": command}
+    new_topics = {"definecolor": command, "definecolor_name": variant}
+
+    interface_diff = i2d.diff_interfaces(
+        old_topics, {}, new_topics, {}, {'inheritors': {}})
+
+    assert interface_diff['regenerate'] == ["definecolor", "definecolor_name"]
+
+
+# --- Single Topics ---
+
+NAME_TEST_INTERFACE = """<?xml version='1.0'?>
+<cd:interface xmlns:cd="http://www.pragma-ade.com/commands">
+    <cd:interface file="i-color.xml">
+        <cd:command category="colors" file="colo-ini.mkiv" level="style" name="definecolor">
+            <cd:arguments>
+                <cd:keywords>
+                    <cd:constant type="cd:name" />
+                </cd:keywords>
+                <cd:assignments list="yes">
+                    <cd:parameter name="r">
+                        <cd:constant type="cd:number" />
+                    </cd:parameter>
+                    <cd:parameter name="g">
+                        <cd:constant type="cd:number" />
+                    </cd:parameter>
+                </cd:assignments>
+            </cd:arguments>
+        </cd:command>
+        <cd:command category="colors" file="colo-ini.mkiv" level="style" name="definecolor" variant="name">
+            <cd:arguments>
+                <cd:keywords>
+                    <cd:constant type="cd:name" />
+                </cd:keywords>
+                <cd:keywords>
+                    <cd:constant type="cd:color" />
+                </cd:keywords>
+            </cd:arguments>
+        </cd:command>
+        <cd:command category="colors" file="colo-ini.mkiv" level="style" name="defineglobalcolor">
+            <cd:arguments>
+                <cd:keywords>
+                    <cd:constant type="cd:name" />
+                </cd:keywords>
+                <cd:assignments list="yes">
+                    <cd:inherit name="definecolor" />
+                </cd:assignments>
+            </cd:arguments>
+        </cd:command>
+    </cd:interface>
+</cd:interface>
+"""
+
+
+def run_interface2dita(work_path, *arguments):
+    env = dict(os.environ, SOURCE_DATE_EPOCH="1760000000")
+    return subprocess.run(
+        [sys.executable, str(REPO_PATH / "interface2dita.py"), "--input", "context-en.xml",
+         "--log-file", "", "--quiet", *arguments],
+        cwd=work_path, env=env, check=True, capture_output=True, text=True).stdout
+
+
+@pytest.mark.parametrize("topic_name", ["definecolor", "definecolor_name", "defineglobalcolor"])
+def test_name_output_matches_all(tmp_path, topic_name):
+    (tmp_path / "context-en.xml").write_text(NAME_TEST_INTERFACE)
+
+    run_interface2dita(tmp_path, "--all")
+    name_output = run_interface2dita(tmp_path, "--name", topic_name)
+
+    topic_path = tmp_path / "build" / "dita" / "en" / "commands" / topic_name[0] / \
+        f"r_command_{topic_name}.dita"
+
+    assert name_output.split("## DITA Output:\n", 1)[1] == topic_path.read_text() + "\n"
+
+
+def test_variant_links_are_indented_like_source_link(monkeypatch):
+    monkeypatch.setattr(i2d, "variant_topic_names",
+                        {"definecolor": ["definecolor_name", "definecolor_rgb"]})
+    related_links = i2d.get_fragment('related_links')
+    source_link_tail = related_links[0].tail
+
+    i2d.add_variant_links(related_links, i2d.CommandRecord("definecolor"))
+
+    assert [link.tail for link in related_links] == [
+        related_links.text, related_links.text, source_link_tail]